@@ -1,2 +1,6 @@
 """Simplifies imports for this package."""
 from atq.atqclient import Q
+from atq.tasks import cached
+from atq.tasks import idempotent
+from atq.tasks import run_in
+from atq.futures import QExecutor
@@ -1,8 +1,41 @@
 """atq server entry point."""
 import argparse
 from atq import atqserver
+from atq import compression
+from atq import discovery
+from atq import journal
+from atq import objects
+from atq import protocol
+from atq import serializers
 
 NUM_WORKERS_DEFAULT = 4
+MEGABYTE = 1024 ** 2  # bytes
+
+
+def queue_weight(value):
+    """Parses queue name and weight given as NAME=WEIGHT."""
+    name, separator, weight = value.rpartition('=')
+    try:
+        weight = float(weight)
+    except ValueError:
+        weight = 0
+    if not separator or not name or weight <= 0:
+        raise argparse.ArgumentTypeError(
+            'expected NAME=WEIGHT with positive weight, got %r' % value)
+    return name, weight
+
+
+def peer_address(value):
+    """Parses host and port of the peer given as HOST:PORT."""
+    try:
+        servers = discovery.parse_servers(value)
+    except ValueError:
+        servers = []
+    if len(servers) != 1:
+        raise argparse.ArgumentTypeError(
+            'expected HOST:PORT, got %r' % value)
+    return servers[0]
+
 
 def main():
     """Main function of the module."""
@@ -15,9 +48,114 @@ def main():
     parser.add_argument('-w', '--workers', dest='num_workers', type=int,
                         default=NUM_WORKERS_DEFAULT,
                         help='max number of workers')
+    parser.add_argument('--max-message-size', dest='max_message_size',
+                        type=int, default=protocol.MAX_MESSAGE_SIZE,
+                        help='max size of message from client in bytes')
+    parser.add_argument('--result-cache-size', dest='result_cache_size',
+                        type=int, default=atqserver.RESULT_CACHE_SIZE,
+                        help='max number of cached task results')
+    parser.add_argument('--result-cache-ttl', dest='result_cache_ttl',
+                        type=float, default=atqserver.RESULT_CACHE_TTL,
+                        help='time in seconds task result stays cached')
+    parser.add_argument('--max-queue-depth', dest='max_queue_depth',
+                        type=int, default=None,
+                        help='max number of tasks on the server, '
+                             'new tasks are rejected as busy')
+    parser.add_argument('--task-log-rate', dest='task_log_rate',
+                        type=float, default=1,
+                        help='fraction of tasks that are logged')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int,
+                        default=None,
+                        help='serve Prometheus metrics on this port')
+    parser.add_argument('--queue-weight', dest='queue_weights',
+                        type=queue_weight, action='append', default=[],
+                        metavar='NAME=WEIGHT',
+                        help='share of workers of the named queue, '
+                             'may be given several times')
+    parser.add_argument('--peer', dest='peers', type=peer_address,
+                        action='append', default=[], metavar='HOST:PORT',
+                        help='server that gets tasks waiting for workers '
+                             'when it has idle workers, may be given '
+                             'several times')
+    parser.add_argument('--offload-interval', dest='offload_interval',
+                        type=float, default=atqserver.OFFLOAD_INTERVAL,
+                        help='time in seconds between checks of peers')
+    parser.add_argument('--executor', dest='default_executor',
+                        choices=protocol.EXECUTORS, default=protocol.PROCESS,
+                        help='run tasks in worker processes, threads or '
+                             'event loop of the server unless task chooses '
+                             'executor')
+    parser.add_argument('--threads', dest='num_threads', type=int,
+                        default=atqserver.NUM_THREADS_DEFAULT,
+                        help='number of threads that run tasks, also max '
+                             'number of coroutines running at once')
+    parser.add_argument('--max-tasks-per-worker', dest='max_tasks_per_worker',
+                        type=int, default=None,
+                        help='replace worker process after this number of '
+                             'tasks')
+    parser.add_argument('--max-worker-rss', dest='max_worker_rss',
+                        type=float, default=None,
+                        help='replace worker process when its resident '
+                             'memory exceeds this number of megabytes')
+    parser.add_argument('--preload', dest='preload', action='append',
+                        default=[], metavar='MODULE',
+                        help='module imported by worker processes before '
+                             'they get tasks, may be given several times')
+    parser.add_argument('--serializer', dest='serializers', action='append',
+                        choices=serializers.available(), default=[],
+                        help='serializer that clients may use, may be given '
+                             'several times, all available ones by default')
+    parser.add_argument('--compression', dest='codecs', action='append',
+                        choices=compression.available(), default=None,
+                        help='codec that clients may compress messages '
+                             'with, may be given several times, all '
+                             'available ones by default')
+    parser.add_argument('--no-compression', dest='codecs',
+                        action='store_const', const=[],
+                        help="don't compress messages")
+    parser.add_argument('--compression-threshold',
+                        dest='compression_threshold', type=int,
+                        default=compression.COMPRESSION_THRESHOLD,
+                        help='size in bytes of the smallest response that '
+                             'is compressed')
+    parser.add_argument('--object-store-size', dest='object_store_size',
+                        type=float,
+                        default=objects.OBJECT_STORE_SIZE / MEGABYTE,
+                        help='max size in megabytes of objects that clients '
+                             'put on the server')
+    parser.add_argument('--object-ttl', dest='object_ttl', type=float,
+                        default=objects.OBJECT_TTL,
+                        help='time in seconds after last use when stored '
+                             'object is dropped')
+    parser.add_argument('--journal', dest='journal_path', type=str,
+                        default=None, metavar='PATH',
+                        help='append tasks accepted and completed by the '
+                             'server to this file, so server restarted '
+                             'after crash knows which tasks it completed')
+    parser.add_argument('--journal-size', dest='journal_size', type=int,
+                        default=journal.MAX_COMPLETED,
+                        help='number of the last completed tasks that '
+                             'journal remembers, file is compacted to them')
     args = parser.parse_args()
+    max_worker_rss = (None if args.max_worker_rss is None
+                      else int(args.max_worker_rss * MEGABYTE))
     worker_server = atqserver.QServer.create(
-        args.host, args.port, args.num_workers)
+        args.host, args.port, args.num_workers,
+        max_message_size=args.max_message_size,
+        result_cache_size=args.result_cache_size,
+        result_cache_ttl=args.result_cache_ttl,
+        max_queue_depth=args.max_queue_depth,
+        task_log_rate=args.task_log_rate, metrics_port=args.metrics_port,
+        queue_weights=dict(args.queue_weights), peers=args.peers,
+        offload_interval=args.offload_interval,
+        default_executor=args.default_executor, num_threads=args.num_threads,
+        max_tasks_per_worker=args.max_tasks_per_worker,
+        max_worker_rss=max_worker_rss, preload=args.preload,
+        accepted_serializers=args.serializers, accepted_codecs=args.codecs,
+        compression_threshold=args.compression_threshold,
+        object_store_size=int(args.object_store_size * MEGABYTE),
+        object_ttl=args.object_ttl, journal_path=args.journal_path,
+        journal_size=args.journal_size)
     try:
         worker_server.run_forever()
     except KeyboardInterrupt:
@@ -1,14 +1,42 @@
 """atq client module."""
 import asyncio
-import cloudpickle
-import pickle
+import inspect
+import os
 import random
+import time
 import warnings
+import weakref
 
+from atq import cache as caches
+from atq import compression as compressions
+from atq import connection as connections
+from atq import discovery as discoveries
+from atq import mapreduce
+from atq import objects
+from atq import protocol
+from atq import scheduler as schedulers
+from atq import serializers
+from atq import stats
+from atq import tasks
+from atq.connection import WorkerConnectionError
+from atq.scheduler import random_scheduler  # pylint: disable=unused-import
 from collections import defaultdict
 
 WAIT_TIME = 0.1  # seconds
-MAX_RETRY_COUNT = 100
+MIN_WAIT_TIME = 0.01  # seconds
+# Retries are counted once per backoff delay of the server, not per
+# attempt, so giving up after 10 of them takes about 10 seconds.
+MAX_RETRY_COUNT = 10
+HEALTH_CHECK_INTERVAL = 1  # seconds
+HEALTH_CHECK_TIMEOUT = 1  # seconds
+DISCOVERY_INTERVAL = 5  # seconds
+# Compression with the best codec both client and server have.
+AUTO_COMPRESSION = 'auto'
+FUNCTION_CACHE_SIZE = 1024
+# Server that has objects used by the task gets it unless it has at least
+# that many tasks per worker.
+LOCALITY_MAX_LOAD = 1
+DEFAULT_OPTIONS = protocol.pack_options()
 
 
 class Error(Exception):
@@ -16,51 +44,531 @@ class Error(Exception):
     pass
 
 
-class WorkerConnectionError(Error):
-    """Raised on socket read error."""
+class MaxRetriesReachedError(Error):
+    """Raised when maximum number of retries is reached."""
     pass
 
 
-class MaxRetriesReachedError(Error):
-    """Raised when maximum number of retries is reached."""
+class ServerBusyError(Error):
+    """Raised when server rejects task because its queue is full."""
+    pass
+
+
+class NoServersError(Error):
+    """Raised when client has no servers to send task to."""
+    pass
+
+
+class ObjectReleasedError(Error):
+    """Raised when task uses ref of released object."""
     pass
 
 
-class Task:
-    """Wraps function and it's arguments."""
-    def __init__(self, host, func, *args, **kwargs):
-        self.host = host
-        self.func, self.args, self.kwargs = func, args, kwargs
+def _unpack_result(load, payload):
+    """Updates server load from result payload and returns result.
 
-    def __call__(self):
-        return self.func(*self.args, **self.kwargs)
+    Raises:
+        Exception raised by the task.
+    """
+    load.report(*protocol.LOAD_REPORT.unpack_from(payload))
+    task_result = serializers.loads(
+        memoryview(payload)[protocol.LOAD_REPORT.size:])
+    if isinstance(task_result, BaseException):
+        raise task_result
+    return task_result
 
-    def __str__(self):
-        return '<%s> from %s' % (self.func.__name__, self.host)
 
+def _reject(load, payload):
+    """Updates server load from busy response and avoids the server.
 
-def random_scheduler(workers):
-    """Picks next worker uniformly at random."""
-    while True:
-        yield random.choice(workers)
+    Raises:
+        ServerBusyError: Always.
+    """
+    load.report(*protocol.LOAD_REPORT.unpack_from(payload))
+    load.busy(WAIT_TIME)
+    raise ServerBusyError('Server is busy')
 
 
-class Q:
+class Q(mapreduce.MapReduce):
     """Task queue client.
 
+    Servers can be added and removed while client is used. Scheduler gets
+    list of servers that is changed in place, so it must look at the list
+    on every pick.
+
     Attributes:
-        _workers: Collection of available workers specified by
-                  hostnames and ports.
+        _workers: List of available workers specified by hostnames and
+                  ports.
         _scheduler: Generator that returns host and port of selected worker.
-        _retries_per_server: Defaultdict that stores number of retries for
-                             each task queue server.
+        _load: Defaultdict that stores ServerLoad of each task queue server.
+        _connections: Maps event loop to connections.Pool of its
+                      connections to servers.
+        _functions: LRU cache that maps functions to their ids and
+                    serialized code, so function is pickled once.
+        _max_message_size: Larger messages from servers are rejected.
+        _stats: ClientStats that aggregates events of all tasks.
+        _observers: Callables that get stats.TaskEvent of every finished
+                    task.
+        _health_check_interval: Seconds between health checks of servers
+                                or None if servers are not checked.
+        _discovery: Callable that returns current servers or None.
+        _discovery_interval: Seconds between polls of discovery.
+        _background: Maps event loop to set of its background tasks that
+                     check and discover servers and drain removed ones.
+        _serializer: Name of serializer of tasks, servers that don't
+                     accept it get tasks serialized with CLOUDPICKLE.
+        _codecs: Names of codecs that messages may be compressed with in
+                 order of preference.
+        _compression_threshold: Smaller messages are not compressed.
+        _compression_stats: Defaultdict that maps server to
+                            compression.CompressionStats of its
+                            connections.
+        _objects: Maps object id to objects.ClientObject of every object
+                  put by the client whose ref is not released.
     """
-    def __init__(self, workers):
-        self._workers = workers
-        self._scheduler = random_scheduler(self._workers)
-        self._retries_per_server = defaultdict(int)
+    def __init__(self, workers,
+                 scheduler=schedulers.least_outstanding_scheduler,
+                 max_message_size=protocol.MAX_MESSAGE_SIZE, observers=(),
+                 health_check_interval=HEALTH_CHECK_INTERVAL, discovery=None,
+                 discovery_interval=DISCOVERY_INTERVAL,
+                 serializer=serializers.PICKLE, compression=None,
+                 compression_threshold=compressions.COMPRESSION_THRESHOLD):
+        self._workers = [tuple(worker) for worker in workers]
+        self._serializer = serializers.get(serializer).name
+        if compression is None:
+            self._codecs = []
+        elif compression == AUTO_COMPRESSION:
+            self._codecs = compressions.available()
+        else:
+            self._codecs = [compressions.get(compression).name]
+        self._compression_threshold = compression_threshold
+        self._compression_stats = defaultdict(compressions.CompressionStats)
+        self._objects = {}
+        self._max_message_size = max_message_size
+        self._load = defaultdict(schedulers.ServerLoad)
+        self._scheduler = scheduler(self._workers, self._load)
+        self._connections = weakref.WeakKeyDictionary()
+        self._health_check_interval = health_check_interval
+        if isinstance(discovery, (str, os.PathLike)):
+            discovery = discoveries.FileDiscovery(discovery)
+        self._discovery = discovery
+        self._discovery_interval = discovery_interval
+        self._background = weakref.WeakKeyDictionary()
+        self._functions = caches.LRUCache(FUNCTION_CACHE_SIZE)
+        self._stats = stats.ClientStats()
+        self._observers = [self._stats] + list(observers)
+
+    def add_observer(self, observer):
+        """Adds callable that gets stats.TaskEvent of every finished task.
+
+        Observer is called in the event loop when task is done, including
+        tasks that failed. Single calls and chunks of map are observed,
+        streams are not.
+        """
+        self._observers.append(observer)
+
+    def remove_observer(self, observer):
+        """Removes observer added before."""
+        self._observers.remove(observer)
+
+    def stats(self):
+        """Returns snapshot of statistics of every server.
+
+        Returns:
+            Dict that maps host and port of the server to dict with number
+            of tasks, errors, failed connection attempts, rejections by
+            busy server, latency mean and percentiles of the most recent
+            tasks, tasks in flight, state of the circuit breaker, load
+            reported by the server and compression ratio and CPU time of
+            messages.
+        """
+        snapshot = self._stats.snapshot()
+        for server_address, load in self._load.items():
+            server_stats = snapshot.setdefault(server_address, {})
+            server_stats.update({
+                'in_flight': load.in_flight,
+                'state': load.state,
+                'num_workers': load.num_workers,
+                'server_tasks': load.server_tasks,
+                'compression': self._compression_stats[
+                    server_address].snapshot(),
+            })
+        return snapshot
+
+    def add_server(self, server_address):
+        """Adds server, it gets new tasks right away.
+
+        Args:
+            server_address: Host and port of the server.
+        """
+        server_address = tuple(server_address)
+        if server_address not in self._workers:
+            self._workers.append(server_address)
+
+    async def remove_server(self, server_address):
+        """Removes server gracefully.
+
+        Server gets no new tasks, tasks and streams already sent to it are
+        finished and then its connection is closed.
+
+        Args:
+            server_address: Host and port of the server.
+        """
+        server_address = tuple(server_address)
+        if server_address in self._workers:
+            self._workers.remove(server_address)
+        await self._drain(server_address)
+
+    async def _drain(self, server_address):
+        """Waits until removed server has no tasks and closes connection
+        to it, unless server is added back meanwhile."""
+        load = self._load.get(server_address)
+        while (load is not None and load.in_flight and
+               server_address not in self._workers):
+            await asyncio.sleep(WAIT_TIME)
+        if server_address in self._workers:
+            return
+        self._load.pop(server_address, None)
+        pool = self._connections.get(asyncio.get_event_loop())
+        if pool is not None:
+            pool.drop(server_address)
+
+    async def _discover(self):
+        """Adds and removes servers to match discovery.
+
+        Removed servers are drained in background. Servers are kept when
+        discovery fails.
+        """
+        try:
+            servers = self._discovery()
+            if inspect.isawaitable(servers):
+                servers = await servers
+            servers = [tuple(server) for server in servers]
+        except Exception as exc:  # pylint: disable=broad-except
+            warnings.warn('Discovery of servers failed: %s: %s' % (
+                type(exc).__name__, str(exc)))
+            return
+        for server_address in servers:
+            self.add_server(server_address)
+        for server_address in list(self._workers):
+            if server_address not in servers:
+                self._workers.remove(server_address)
+                self._spawn_background(self._drain(server_address))
+
+    async def _poll_discovery(self):
+        """Periodically updates servers from discovery."""
+        while True:
+            await self._discover()
+            await asyncio.sleep(self._discovery_interval)
+
+    def _spawn_background(self, coro):
+        """Runs coroutine as background task of the current event loop."""
+        background = self._background.setdefault(
+            asyncio.get_event_loop(), set())
+        task = asyncio.ensure_future(coro)
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+    def _start_background(self):
+        """Starts health checks and discovery in the current event loop if
+        needed."""
+        if asyncio.get_event_loop() in self._background:
+            return
+        self._background[asyncio.get_event_loop()] = set()
+        if self._health_check_interval is not None:
+            self._spawn_background(self._check_health())
+        if self._discovery is not None:
+            self._spawn_background(self._poll_discovery())
+
+    def _notify(self, event):
+        """Passes event to observers, failing observer doesn't fail task."""
+        for observer in self._observers:
+            try:
+                observer(event)
+            except Exception as exc:  # pylint: disable=broad-except
+                warnings.warn('Observer failed: %s: %s' % (
+                    type(exc).__name__, str(exc)))
+
+    async def _get_connection(self, server_address):
+        """Returns pooled connection to the server, opens it if needed.
+
+        Connections are bound to event loop, so every loop that uses
+        the client gets its own pool.
+
+        Raises:
+            OSError: Raised when connection can't be established.
+        """
+        pool = self._connections.get(asyncio.get_event_loop())
+        if pool is None:
+            pool = self._connections[asyncio.get_event_loop()] = (
+                connections.Pool(self._open_connection))
+        return await pool.get(server_address)
+
+    def close(self):
+        """Closes all pooled connections of the current event loop and
+        stops its background tasks."""
+        for task in self._background.pop(asyncio.get_event_loop(), ()):
+            task.cancel()
+        pool = self._connections.pop(asyncio.get_event_loop(), None)
+        if pool is not None:
+            pool.close()
+
+    def _serialize_function(self, func, refresh=False):
+        """Returns id and serialized code of the function.
+
+        Function is pickled on first use only, so changes of its globals
+        made later are not seen by workers until it's registered again.
+
+        Args:
+            func: Function to serialize.
+            refresh: Whether to pickle function even if it's cached.
+        """
+        cacheable = True
+        try:
+            known = None if refresh else self._functions.get(func)
+        except TypeError:  # Unhashable callable.
+            cacheable, known = False, None
+        if known is not None:
+            return known
+        serialized_func = serializers.dumps_function(func)
+        known = protocol.function_id(serialized_func), serialized_func
+        if cacheable:
+            self._functions.put(func, known)
+        return known
+
+    async def register(self, func):
+        """Registers function on all servers.
+
+        Tasks that use registered function send only its id. Function is
+        pickled again, so this also picks up changes of its globals.
+        Unreachable servers get function with the first task instead.
+        """
+        func_id, serialized_func = self._serialize_function(
+            func, refresh=True)
+        for server_address in list(self._workers):
+            try:
+                connection = await self._get_connection(server_address)
+            except OSError:
+                continue
+            await connection.register(func_id, serialized_func)
+
+    async def put(self, obj, replicas=1):
+        """Stores object on servers and returns objects.ObjectRef to it.
+
+        Object is serialized once and uploaded to replicas least loaded
+        servers. Tasks get the object when ref is their argument, directly
+        or inside lists, tuples, sets and dicts. Tasks that use objects
+        are sent to servers that have them unless those are overloaded,
+        objects are uploaded to other servers when tasks are sent there.
+        Client keeps serialized object until ref is released or garbage
+        collected, so object dropped by the server is uploaded again.
+
+        Args:
+            obj: Object to store.
+            replicas: Number of servers that get the object right away.
+        Raises:
+            objects.ObjectTooLargeError: Raised when object is larger than
+                                         object store of the server.
+        """
+        parts = serializers.get(self._serializer).dumps(obj)
+        stored = objects.ClientObject(parts)
+        ref = objects.ObjectRef(objects.new_id(), stored.size)
+        self._objects[ref.object_id] = stored
+        weakref.finalize(ref, self._objects.pop, ref.object_id, None)
+        acquired = []
+        try:
+            for _ in range(min(replicas, len(self._workers)) or 1):
+                connection, load = await self._acquire()
+                acquired.append(load)
+                if connection.server_address not in stored.servers:
+                    await self._upload(connection, ref.object_id)
+        finally:
+            for load in acquired:
+                load.in_flight -= 1
+        return ref
+
+    def submit(self, func, *args, priority=0, queue=protocol.DEFAULT_QUEUE,
+               executor=None, retry=False, **kwargs):
+        """Starts task whose result stays on the server.
+
+        Must be called while event loop runs. Handle can be passed as
+        argument to q, submit, map, starmap and stream, directly or inside
+        lists, tuples, sets and dicts, so pipeline stages don't send
+        intermediate results through the client. Dependent task is sent
+        when the task is finished, preferably to the server that has its
+        result, other servers get the result from that server. Exception
+        raised by the task is raised by awaiting the handle and by tasks
+        that depend on it. Task is retried like in q.
+
+        Returns:
+            objects.TaskHandle of the task.
+        """
+        result_id = objects.new_id()
+        producer = asyncio.ensure_future(self._execute(
+            func, tasks.Task(None, tasks.name_of(func), *args, **kwargs),
+            options=tasks.pack_options(func, priority, queue, executor),
+            result_id=result_id, retry=retry))
+        handle = objects.TaskHandle(result_id, self, producer)
+        self._objects[result_id] = objects.ClientObject(None, producer)
+        weakref.finalize(handle, self._objects.pop, result_id, None)
+        return handle
+
+    async def get(self, ref):
+        """Returns object of objects.ObjectRef or result of TaskHandle.
+
+        Raises:
+            ObjectReleasedError: Raised when ref is released.
+            objects.ObjectNotFoundError: Raised when no server has the
+                                         object anymore.
+            Exception raised by the task of the handle.
+        """
+        stored = self._objects.get(ref.object_id)
+        if stored is None:
+            raise ObjectReleasedError(
+                'Object %s is released' % ref.object_id.hex())
+        if stored.parts is not None:
+            return serializers.loads(b''.join(stored.parts))
+        await asyncio.shield(stored.producer)
+        for server_address in list(stored.servers):
+            try:
+                connection = await self._get_connection(server_address)
+                msg_type, payload = await connection.request(
+                    protocol.GET, ref.object_id)
+            except (OSError, WorkerConnectionError):
+                continue
+            if msg_type == protocol.RESULT:
+                return _unpack_result(self._load[server_address], payload)
+        raise objects.ObjectNotFoundError(
+            'Object %s is not found' % ref.object_id.hex())
+
+    async def completed_tasks(self, server_address, task_ids):
+        """Asks server which of the tasks it completed.
+
+        Server started with --journal keeps ids of tasks it completed across
+        restarts, so tasks that were running on the server when connection
+        was lost can be told from those that finished. Ids of tasks are
+        reported to observers by task_id of stats.TaskEvent.
+
+        Args:
+            server_address: Host and port of the server.
+            task_ids: Ids of tasks.
+        Returns:
+            Set of ids of completed tasks, task that raised exception is
+            completed too.
+        Raises:
+            OSError: Raised when connection can't be established.
+            WorkerConnectionError: Raised when connection is lost.
+            journal.NoJournalError: Raised when server has no journal.
+        """
+        server_address = tuple(server_address)
+        connection = await self._get_connection(server_address)
+        _, payload = await connection.request(
+            protocol.COMPLETED_TASKS, *task_ids)
+        return set(_unpack_result(self._load[server_address], payload))
+
+    async def _wait_for_producers(self, refs):
+        """Waits until tasks that compute objects used by the task finish.
 
-    async def _run(self, func, args=(), kwargs={}):  # pylint: disable=dangerous-default-value
+        Raises:
+            Exception raised by any of those tasks.
+        """
+        for object_id in refs:
+            stored = self._objects.get(object_id)
+            if stored is not None and stored.producer is not None:
+                await asyncio.shield(stored.producer)
+
+    async def release(self, ref):
+        """Drops object from servers and serialized copy of the client.
+
+        Tasks can't use the ref afterwards. Objects that are not released
+        are dropped by servers after they are not used for a while.
+        """
+        stored = self._objects.pop(ref.object_id, None)
+        if stored is None:
+            return
+        for server_address in stored.servers:
+            try:
+                connection = await self._get_connection(server_address)
+                await connection.send(protocol.RELEASE, ref.object_id)
+            except (OSError, WorkerConnectionError):
+                continue
+
+    async def _upload(self, connection, object_id):
+        """Uploads object to the server of the connection.
+
+        Result of the task is not uploaded, server gets it from the server
+        that has it instead. Concurrent tasks that miss the same object wait
+        for single upload.
+
+        Raises:
+            ObjectReleasedError: Raised when ref of the object is released.
+            objects.ObjectNotFoundError: Raised when no other server has
+                                         result of the task.
+        """
+        stored = self._objects.get(object_id)
+        if stored is None:
+            raise ObjectReleasedError(
+                'Object %s is released' % object_id.hex())
+        server_address = connection.server_address
+        upload = stored.uploads.get(server_address)
+        if upload is None:
+            upload = stored.uploads[server_address] = asyncio.ensure_future(
+                self._send_object(connection, object_id, stored))
+            upload.add_done_callback(
+                lambda _: stored.uploads.pop(server_address, None))
+        _, payload = await asyncio.shield(upload)
+        _unpack_result(self._load[server_address], payload)
+        stored.servers.add(server_address)
+
+    @staticmethod
+    async def _send_object(connection, object_id, stored):
+        """Puts object on the server of the connection or asks the server
+        to get result of the task from the server that has it.
+
+        Returns:
+            Tuple of message type and payload of the response.
+        """
+        if stored.parts is not None:
+            return await connection.request(
+                protocol.PUT, object_id, *stored.parts)
+        holders = [server_address for server_address in stored.servers
+                   if server_address != connection.server_address]
+        if not holders:
+            raise objects.ObjectNotFoundError(
+                'Object %s is lost' % object_id.hex())
+        return await connection.request(
+            protocol.FETCH, object_id, ('%s:%s' % holders[0]).encode())
+
+    def _local_server(self, refs):
+        """Returns server that has the most bytes of objects used by the
+        task or None if no server has them or the one that has is too
+        loaded to wait for it."""
+        held = defaultdict(int)
+        for object_id in refs:
+            stored = self._objects.get(object_id)
+            if stored is None:
+                continue
+            for server_address in stored.servers:
+                if (server_address in self._workers and
+                        not self._load[server_address].is_avoided):
+                    held[server_address] += stored.size
+        if not held:
+            return None
+        server_address = max(held, key=lambda worker: (
+            held[worker], -self._load[worker].tasks_per_worker))
+        if self._load[server_address].tasks_per_worker >= LOCALITY_MAX_LOAD:
+            return None
+        return server_address
+
+    async def _open_connection(self, server_address):
+        """Opens new connection to the server."""
+        return await connections.connect(
+            server_address, self._max_message_size, self._serializer,
+            self._codecs, self._compression_threshold,
+            self._compression_stats[server_address])
+
+    async def _run(self, func, args=(), kwargs={}, use_cache=False,  # pylint: disable=dangerous-default-value
+                   options=DEFAULT_OPTIONS, retry=False):
         """Runs function in the task queue.
 
         Runs func in task queue and returns result or raises exception.
@@ -69,6 +577,43 @@ class Q:
             func: Function to run in task queue.
             args: Function non-keyword arguments
             kwargs: Function keyword arguments.
+            use_cache: Whether result may be taken from the server cache.
+            options: Task options packed by protocol.pack_options.
+            retry: Whether task may run again on another server when
+                   connection is lost.
+
+        Raises:
+            WorkerConnectionError: Raised on error reading data from job
+                                   queue worker.
+            MaxRetriesReachedError: Raised when maximum number of retries for
+                                    specific server is reached.
+        """
+        return await self._execute(
+            func, tasks.Task(None, tasks.name_of(func), *args, **kwargs),
+            use_cache, options, retry=retry)
+
+    async def _execute(self, func, task, use_cache=False,
+                       options=DEFAULT_OPTIONS, result_id=None,
+                       retry=False):
+        """Sends task to selected server and returns its result.
+
+        Task is sent when tasks whose results it uses are finished. Task
+        rejected by busy server is sent to another one, as is task that may
+        be retried whose connection is lost, at most MAX_RETRY_COUNT times. Task
+        keeps its id on all servers.
+
+        Args:
+            func: Function to bind to the task on the worker.
+            task: tasks.Task or tasks.ChunkTask with function arguments.
+            use_cache: Whether result may be taken from the server cache.
+                       Results of functions decorated with cached always
+                       are.
+            options: Task options packed by protocol.pack_options.
+            result_id: Id of the object that result is stored as on the
+                       server or None if result is sent back.
+            retry: Whether task may run again when connection is lost.
+                   Tasks of functions decorated with idempotent always
+                   may.
 
         Raises:
             WorkerConnectionError: Raised on error reading data from job
@@ -76,42 +621,345 @@ class Q:
             MaxRetriesReachedError: Raised when maximum number of retries for
                                     specific server is reached.
         """
+        event = stats.TaskEvent(task.func_name)
+        event.task_id = os.urandom(protocol.TASK_ID_SIZE)
+        retry = retry or getattr(func, 'atq_idempotent', False)
+        start, retries = time.perf_counter(), 0
+        try:
+            await self._wait_for_producers(task.refs)
+            while True:
+                connection, load = await self._acquire(event, task.refs)
+                try:
+                    return await self._execute_on(
+                        connection, load, func, task, use_cache, event,
+                        options, result_id)
+                except ServerBusyError:
+                    event.rejections.append(event.server)
+                except WorkerConnectionError:
+                    if not retry or retries >= MAX_RETRY_COUNT:
+                        raise
+                    retries += 1
+                    load.failed()
+                    event.connect_failures.append(event.server)
+                    warnings.warn(
+                        'Connection to %s:%s is lost. Retrying task...' %
+                        event.server)
+                finally:
+                    load.in_flight -= 1
+        except BaseException as exc:
+            event.error = exc
+            raise
+        finally:
+            event.total_time = time.perf_counter() - start
+            self._notify(event)
+
+    async def _acquire(self, event=None, refs=()):
+        """Selects server and returns connection to it and its load.
+
+        Task is counted in flight on the server from the moment it's
+        selected, so while client connects, concurrent tasks prefer other
+        servers. Servers that failed or are busy are not selected while
+        others are available, task waits if all of them are avoided.
+        Server that has objects used by the task is preferred to the one
+        picked by scheduler. Caller must decrement in_flight when task is
+        done.
+
+        Args:
+            event: stats.TaskEvent that gets selected server, connection
+                   time and failed servers.
+            refs: Ids of stored objects used by the task.
+        Raises:
+            MaxRetriesReachedError: Raised when all servers are down and
+                                    maximum number of retries is reached
+                                    for every one of them.
+            NoServersError: Raised when client has no servers.
+        """
+        self._start_background()
+        start = time.perf_counter()
         while True:
-            server_address = next(self._scheduler)
+            if not self._workers and self._discovery is not None:
+                await self._discover()
+            if not self._workers:
+                raise NoServersError('No servers to send task to')
+            server_address = self._local_server(refs) if refs else None
+            if server_address is None:
+                server_address = next(self._scheduler)
+            load = self._load[server_address]
+            if load.is_avoided:
+                available = [worker for worker in self._workers
+                             if not self._load[worker].is_avoided]
+                if not available:
+                    await self._wait_for_server()
+                    continue
+                server_address = min(available, key=lambda worker: (
+                    self._load[worker].rank(), random.random()))
+                load = self._load[server_address]
+            load.in_flight += 1
             try:
-                reader, writer = await asyncio.open_connection(*server_address)
-            except OSError:
-                self._retries_per_server[server_address] += 1
-                if self._retries_per_server[server_address] > MAX_RETRY_COUNT:
-                    raise MaxRetriesReachedError(
-                        'Max number of retries is reached for %s:%s' %
-                        server_address)
-                warnings.warn(
-                    "Can't connect to %s:%s. Retrying..." % server_address)
-                await asyncio.sleep(WAIT_TIME)
-            else:
-                self._retries_per_server[server_address] = 0
+                connection = await self._connect(server_address, load)
+            except BaseException:
+                load.in_flight -= 1
+                raise
+            if connection is not None:
                 break
+            load.in_flight -= 1
+            if event is not None:
+                event.connect_failures.append(server_address)
+        if event is not None:
+            event.server = server_address
+            event.connect_time += time.perf_counter() - start
+        return connection, load
+
+    async def _wait_for_server(self):
+        """Waits until some server can be tried again.
 
-        curr_host, *_ = writer.get_extra_info('sockname')
-        serialized_task = cloudpickle.dumps(
-            Task(curr_host, func, *args, **kwargs))
-        writer.write(serialized_task)
-        if writer.can_write_eof():
-            writer.write_eof()
-        await writer.drain()
+        Raises:
+            MaxRetriesReachedError: Raised when all servers are down and
+                                    maximum number of retries is reached
+                                    for every one of them.
+        """
+        loads = [self._load[worker] for worker in self._workers]
+        if all(load.retries > MAX_RETRY_COUNT for load in loads):
+            raise MaxRetriesReachedError(
+                'Max number of retries is reached for all servers')
+        delay = min(load.avoided_for() for load in loads)
+        await asyncio.sleep(min(max(delay, MIN_WAIT_TIME), WAIT_TIME))
 
+    async def _connect(self, server_address, load):
+        """Returns connection to the server or None if task has to be sent
+        to another server."""
+        load.probe()
         try:
-            serialized_result = await reader.read()
-        except ConnectionResetError:
-            raise WorkerConnectionError
-
-        task_result = pickle.loads(serialized_result)
-        writer.close()
-        if isinstance(task_result, BaseException):
-            raise task_result
+            connection = await self._get_connection(server_address)
+        except OSError:
+            load.failed()
+            warnings.warn(
+                "Can't connect to %s:%s. Retrying..." % server_address)
+            return None
+        load.connected()
+        return connection
+
+    async def _check_health(self):
+        """Periodically checks all servers."""
+        while True:
+            await asyncio.sleep(self._health_check_interval)
+            await asyncio.gather(*[
+                self._check_server(server_address)
+                for server_address in self._workers])
+
+    async def _check_server(self, server_address):
+        """Pings the server, marks it down if it doesn't answer in time.
+
+        Server that is down is probed when its backoff delay is over, so
+        tasks don't have to. Tasks in flight are not affected.
+        """
+        load = self._load[server_address]
+        if load.state == schedulers.OPEN:
+            return
+        load.probe()
+        try:
+            connection = await asyncio.wait_for(
+                self._get_connection(server_address), HEALTH_CHECK_TIMEOUT)
+            msg_type, payload = await asyncio.wait_for(
+                connection.request(protocol.PING), HEALTH_CHECK_TIMEOUT)
+        except (OSError, WorkerConnectionError, asyncio.TimeoutError):
+            load.failed()
+            return
+        if msg_type == protocol.PONG:
+            load.report(*protocol.LOAD_REPORT.unpack_from(payload))
+        load.connected()
+
+    async def _execute_on(self, connection, load, func, task, use_cache,
+                          event, options, result_id=None):
+        """Sends task through the connection and returns its result.
+
+        Timings and sizes are recorded in the event. Task whose result is
+        stored returns size of the result.
+
+        Raises:
+            ServerBusyError: Raised when server rejects the task.
+        """
+        func_id, serialized_func = self._serialize_function(func)
+        task.host = connection.host
+        options = protocol.extend_options(options, task.refs, event.task_id)
+        start = time.perf_counter()
+        serialized_task = connection.serializer.dumps(task)
+        event.serialize_time += time.perf_counter() - start
+        event.task_size = sum(len(part) for part in serialized_task)
+        msg_type, key = protocol.TASK, ()
+        if result_id is not None:
+            msg_type, key = protocol.STORED_TASK, (result_id,)
+        elif use_cache or getattr(func, 'atq_cached', False):
+            msg_type, key = protocol.CACHED_TASK, (task.cache_key(func_id),)
+        start = time.perf_counter()
+        registered = False
+        while True:
+            if func_id not in connection.functions:
+                await connection.register(func_id, serialized_func)
+                registered = True
+            response_type, payload = await connection.request(
+                msg_type, options, *key, func_id, *serialized_task)
+            if response_type == protocol.UNKNOWN_FUNCTION:
+                if registered:
+                    raise connections.UnknownFunctionError(
+                        'Server lost function %s' % func_id.hex())
+                # Server evicted the function from its cache.
+                connection.functions.discard(func_id)
+            elif response_type == protocol.UNKNOWN_OBJECT:
+                for object_id in protocol.split_ids(payload):
+                    await self._upload(connection, object_id)
+            else:
+                break
+        event.request_time += time.perf_counter() - start
+
+        if response_type == protocol.BUSY:
+            _reject(load, payload)
+        event.result_size = len(payload) - protocol.LOAD_REPORT.size
+        start = time.perf_counter()
+        try:
+            task_result = _unpack_result(load, payload)
+        finally:
+            event.deserialize_time += time.perf_counter() - start
+        stored = self._objects.get(result_id)
+        if stored is not None:
+            stored.size = task_result
+            stored.servers.add(connection.server_address)
         return task_result
 
-    async def q(self, func, *args, **kwargs):
-        """Convenient wrapper for _run method."""
-        return await self._run(func, args=args, kwargs=kwargs)
+    async def q(self, func, *args, cache=False, timeout=None, priority=0,
+                queue=protocol.DEFAULT_QUEUE, executor=None, retry=False,
+                **kwargs):
+        """Convenient wrapper for _run method.
+
+        Result is taken from the server cache if cache is set. Task that
+        doesn't finish in timeout seconds is stopped on the server, as is
+        task whose caller is cancelled. Server starts tasks of the same
+        queue with higher priority first and shares workers between queues
+        by their weights. Task runs in executor given by the call, by
+        run_in decorator of the function or in default executor of the
+        server. Task that may be retried, by retry of the call or by
+        idempotent decorator of the function, is sent to another server
+        when connection to its server is lost, so it may run more than
+        once.
+
+        Raises:
+            asyncio.TimeoutError: Raised when timeout expires.
+            WorkerConnectionError: Raised when connection is lost and task
+                                   may not be retried.
+        """
+        return await asyncio.wait_for(
+            self._run(func, args=args, kwargs=kwargs, use_cache=cache,
+                      options=tasks.pack_options(
+                          func, priority, queue, executor),
+                      retry=retry),
+            timeout)
+
+    async def stream(self, func, *args, priority=0,
+                     queue=protocol.DEFAULT_QUEUE, executor=None, **kwargs):
+        """Runs generator function in the task queue and yields its items.
+
+        Items are sent one by one as they are produced. Server sends at most
+        protocol.STREAM_WINDOW items ahead of the consumer, so memory stays
+        bounded on both ends. Closing iterator early stops the generator.
+        Stream rejected by busy server is sent to another one. Streams run
+        in worker processes or threads, streams that ask for event loop
+        run in threads.
+
+        Args:
+            func: Generator function or function returning iterable.
+            args: Function non-keyword arguments
+            priority: Priority of the stream in its queue on the server.
+            queue: Name of the queue of the stream on the server.
+            executor: Executor of the stream on the server or None.
+            kwargs: Function keyword arguments.
+        Yields:
+            Items produced by the function.
+        """
+        task = tasks.Task(None, tasks.name_of(func), *args, **kwargs)
+        options = tasks.pack_options(func, priority, queue, executor)
+        await self._wait_for_producers(task.refs)
+        while True:
+            connection, load = await self._acquire(refs=task.refs)
+            items = self._stream_from(connection, load, func, task, options)
+            try:
+                async for item in items:
+                    yield item
+                return
+            except ServerBusyError:
+                pass
+            finally:
+                load.in_flight -= 1
+                # Cancels the stream if iteration ended early.
+                await items.aclose()
+
+    async def _stream_from(self, connection, load, func, task, options):
+        """Runs stream through the connection and yields its items.
+
+        Raises:
+            ServerBusyError: Raised when server rejects the stream.
+        """
+        func_id, serialized_func = self._serialize_function(func)
+        task.host = connection.host
+        options = protocol.extend_options(options, task.refs)
+        serialized_task = connection.serializer.dumps(task)
+        registered = False
+        while True:
+            if func_id not in connection.functions:
+                await connection.register(func_id, serialized_func)
+                registered = True
+            request_id, responses = await connection.open_stream(
+                protocol.STREAM, options, func_id, *serialized_task)
+            finished, consumed = False, 0
+            try:
+                while True:
+                    response = await responses.get()
+                    if isinstance(response, BaseException):
+                        finished = True
+                        raise response
+                    msg_type, payload = response
+                    if msg_type != protocol.STREAM_ITEM:
+                        finished = True
+                        break
+                    yield serializers.loads(payload)
+                    consumed += 1
+                    if consumed == protocol.STREAM_WINDOW // 2:
+                        await connection.send(
+                            protocol.ACK, protocol.ACK_COUNT.pack(consumed),
+                            request_id=request_id)
+                        consumed = 0
+            finally:
+                connection.close_stream(request_id)
+                if not finished:
+                    await connection.cancel(request_id)
+            if await self._end_stream(connection, load, func_id, registered,
+                                      msg_type, payload):
+                return
+
+    async def _end_stream(self, connection, load, func_id, registered,
+                          msg_type, payload):
+        """Handles the last response of the stream.
+
+        Returns:
+            True if stream is over, False if it must be opened again.
+        Raises:
+            ServerBusyError: Raised when server rejects the stream.
+            connections.UnknownFunctionError: Raised when server doesn't
+                                              know function that was
+                                              registered for the stream.
+            Exception raised by the generator.
+        """
+        if msg_type == protocol.BUSY:
+            _reject(load, payload)
+        if msg_type == protocol.UNKNOWN_OBJECT:
+            for object_id in protocol.split_ids(payload):
+                await self._upload(connection, object_id)
+            return False
+        if msg_type == protocol.UNKNOWN_FUNCTION:
+            if registered:
+                raise connections.UnknownFunctionError(
+                    'Server lost function %s' % func_id.hex())
+            # Server evicted the function from its cache.
+            connection.functions.discard(func_id)
+            return False
+        _unpack_result(load, payload)
+        return True
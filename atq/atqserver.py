@@ -1,27 +1,50 @@
 """atq server module."""
 import asyncio
 import cloudpickle
+import concurrent.futures
+import functools
 import logging
-import pickle
-import signal
+import multiprocessing
+import random
+import time
 
+from atq import cache
+from atq import compression
+from atq import connection as connections
+from atq import discovery
 from atq import executor
+from atq import journal as journals
+from atq import metrics
+from atq import objects
+from atq import protocol
+from atq import queues
+from atq import serializers
+from atq import session
+from atq import transfer
+from atq import worker
+
+FUNCTION_CACHE_SIZE = 1024
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 300  # seconds
+OFFLOAD_INTERVAL = 0.1  # seconds
+NUM_THREADS_DEFAULT = 16
+PEER_TIMEOUT = 1  # seconds
+# Modules imported by the fork server, so worker processes start with them.
+WORKER_PRELOAD = ('atq.atqserver',)
 
 logging.basicConfig(
     format='%(asctime)s.%(msecs)03d %(levelname)s - %(message)s',
     datefmt='%m/%d/%Y %H:%M:%S', level=logging.INFO)
 
 
-def task_wrapper(serialized_task):
-    """Unpickles task, runs it and pickles result."""
-    task = pickle.loads(serialized_task)
-    logging.info('Running %s', str(task))
-    return cloudpickle.dumps(task())
+def _serializer_of(payload):
+    """Returns serializer of the task from task payload after options."""
+    return serializers.detect(payload[protocol.FUNCTION_ID_SIZE:])
 
 
-def _silence_sigint():
-    """Silences SIGINT"""
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+def _payloads(pinned):
+    """Returns ids and payloads of pinned objects for the worker."""
+    return [(stored.object_id, stored.payload) for stored in pinned]
 
 
 class QServer:
@@ -31,27 +54,761 @@ class QServer:
         host: Hostname of the server.
         port: Port number of the server.
         loop: Event loop to run in.
-        task_executor: Executor that will run tasks from clients.
+        executor: Executor with worker processes that run tasks from
+                  clients.
+        thread_executor: Executor that runs tasks in threads.
+        default_executor: One of protocol.EXECUTORS that runs tasks that
+                          don't choose executor.
+        functions: LRU cache that maps function ids to serialized
+                   functions registered by clients.
+        num_workers: Number of workers of default executor, reported to
+                     clients.
+        num_tasks: Number of tasks accepted and not finished yet.
+        max_message_size: Larger messages from clients are rejected.
+        max_queue_depth: Maximum number of tasks on the server, new tasks
+                         are rejected as busy when it's reached. None
+                         means no limit.
+        task_log_rate: Fraction of tasks that are logged.
+        metrics_port: Port of metrics endpoint or None.
+        task_schedulers: Maps executor to queues.TaskScheduler that
+                         starts its tasks when its workers are free.
+        peers: Hosts and ports of servers that get waiting tasks when
+               they have idle workers.
+        offload_interval: Seconds between checks of peers.
+        serializers: Names of serializers that clients may use, offered
+                     to them in the handshake.
+        codecs: Names of codecs that clients may compress messages with.
+        compression_threshold: Smaller responses are not compressed.
+        compression_stats: compression.CompressionStats of messages of all
+                           clients.
+        objects: objects.ObjectStore with objects put by clients.
+        journal: journal.Journal of tasks that have ids or None.
+        metrics: ServerMetrics of the server.
+        results: TTL cache that maps serializer names and cache keys to
+                 serialized results of cached tasks.
+        _computing: Maps serializer names and cache keys to futures of
+                    results that are being computed.
+        _peer_connections: Maps peer and serializer name to connection to
+                           the peer.
     """
-    def __init__(self, host, port, event_loop, task_executor):
+    def __init__(self, host, port, event_loop, task_executor,
+                 max_message_size=protocol.MAX_MESSAGE_SIZE,
+                 result_cache_size=RESULT_CACHE_SIZE,
+                 result_cache_ttl=RESULT_CACHE_TTL, max_queue_depth=None,
+                 task_log_rate=1, metrics_port=None, queue_weights=None,
+                 peers=(), offload_interval=OFFLOAD_INTERVAL,
+                 thread_executor=None, default_executor=protocol.PROCESS,
+                 accepted_serializers=None, accepted_codecs=None,
+                 compression_threshold=compression.COMPRESSION_THRESHOLD,
+                 object_store_size=objects.OBJECT_STORE_SIZE,
+                 object_ttl=objects.OBJECT_TTL, journal=None):
         self.host, self.port = host, port
         self.loop = event_loop
         self.executor = task_executor
+        self.thread_executor = (
+            thread_executor or
+            concurrent.futures.ThreadPoolExecutor(NUM_THREADS_DEFAULT))
+        self.default_executor = default_executor
+        self.max_message_size = max_message_size
+        self.max_queue_depth = max_queue_depth
+        self.task_log_rate = task_log_rate
+        self.metrics_port = metrics_port
+        self.metrics = metrics.ServerMetrics()
+        self.functions = cache.LRUCache(FUNCTION_CACHE_SIZE)
+        self.results = cache.TTLCache(result_cache_size, result_cache_ttl)
+        self._computing = {}
+        num_processes = task_executor._max_workers  # pylint: disable=protected-access
+        num_threads = self.thread_executor._max_workers  # pylint: disable=protected-access
+        # Coroutines are limited to the number of threads too.
+        self.task_schedulers = {
+            protocol.PROCESS: queues.TaskScheduler(
+                num_processes, queue_weights),
+            protocol.THREAD: queues.TaskScheduler(num_threads, queue_weights),
+            protocol.ASYNC: queues.TaskScheduler(num_threads, queue_weights),
+        }
+        self.num_workers = (
+            num_processes if default_executor == protocol.PROCESS
+            else num_threads)
+        self.num_tasks = 0
+        self.peers = list(peers)
+        self.offload_interval = offload_interval
+        self.serializers = list(
+            accepted_serializers or serializers.available())
+        self.codecs = list(
+            compression.available() if accepted_codecs is None
+            else accepted_codecs)
+        self.compression_threshold = compression_threshold
+        self.compression_stats = compression.CompressionStats()
+        self.objects = objects.ObjectStore(object_store_size, object_ttl)
+        self.journal = journal
+        self._peer_connections = {}
+        # Handlers of client messages by message type, they are called with
+        # session.Session, request id and payload of the message.
+        self._handlers = {
+            protocol.REGISTER: self._register,
+            protocol.RELEASE: self._release,
+            protocol.PUT: session.spawner(self.put_object),
+            protocol.FETCH: session.spawner(self.fetch_object),
+            protocol.GET: session.spawner(self.get_object),
+            protocol.COMPLETED_TASKS: session.spawner(self._completed_tasks),
+            protocol.HELLO: session.spawner(self._hello),
+            protocol.PING: session.spawner(self._pong),
+            protocol.TASK: functools.partial(
+                self._start_task, offloadable=True),
+            protocol.OFFLOADED_TASK: self._start_task,
+            protocol.STORED_TASK: functools.partial(
+                self._start_task, store=True),
+            protocol.CACHED_TASK: self._start_cached_task,
+            protocol.STREAM: self._start_stream,
+            protocol.ACK: self._ack,
+            protocol.CANCEL: self._cancel,
+        }
 
     async def handle_task(self, reader, writer):
-        """Handles task execution."""
-        serialized_task = await reader.read()
+        """Handles tasks from single client connection.
+
+        Reads messages until client closes connection and runs every task
+        concurrently, so responses may be sent out of order. Tasks cancelled
+        by the client or left running when client disconnects are stopped.
+        """
+        message_reader = protocol.MessageReader(
+            reader, self.max_message_size, self.compression_stats)
+        client = session.Session(protocol.FrameWriter(writer))
+        while True:
+            try:
+                request_id, msg_type, payload = await message_reader.read()
+            except (protocol.MessageTooLargeError,
+                    protocol.DecompressionError) as exc:
+                logging.error('%s: %s', type(exc).__name__, str(exc))
+                client.spawn(self._send_result(
+                    client.frame_writer, exc.request_id,
+                    cloudpickle.dumps(exc)))
+                continue
+            except protocol.FrameTooLargeError as exc:
+                logging.error('%s: %s', type(exc).__name__, str(exc))
+                break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            self.metrics.bytes_received.inc(amount=len(payload))
+            handler = self._handlers.get(msg_type)
+            if handler is not None:
+                handler(client, request_id, payload)
+        await client.close()
+
+    def _register(self, client, request_id, payload):
+        """Keeps function uploaded by the client and confirms it.
+
+        Function is kept before the next message is read, so tasks that
+        follow it find it.
+        """
+        func_id = bytes(payload[:protocol.FUNCTION_ID_SIZE])
+        self.functions.put(func_id, bytes(payload[protocol.FUNCTION_ID_SIZE:]))
+        client.spawn(self._send_result(
+            client.frame_writer, request_id, cloudpickle.dumps(None)))
+
+    def _release(self, _client, _request_id, payload):
+        """Drops object released by the client."""
+        self.objects.release(bytes(payload[:protocol.OBJECT_ID_SIZE]))
+
+    def _start_task(self, client, request_id, payload, offloadable=False,
+                    store=False):
+        """Runs task in background, so client can cancel it."""
+        self.metrics.tasks_received.inc()
+        client.track(request_id, self.run_task(
+            client.frame_writer, request_id, payload,
+            offloadable=offloadable, store=store))
+
+    def _start_cached_task(self, client, request_id, payload):
+        """Runs cached task in background, so client can cancel it."""
+        self.metrics.tasks_received.inc()
+        client.track(request_id, self.run_cached_task(
+            client.frame_writer, request_id, payload))
+
+    def _start_stream(self, client, request_id, payload):
+        """Runs stream in background with its flow control state."""
+        self.metrics.streams_received.inc()
+        stream = client.streams[request_id] = session.Stream()
+        task = client.spawn(self.run_stream(
+            client.frame_writer, request_id, payload, stream))
+        task.add_done_callback(lambda _: client.streams.pop(request_id))
+
+    @staticmethod
+    def _ack(client, request_id, payload):
+        """Adds credits to the stream."""
+        stream = client.streams.get(request_id)
+        if stream is not None:
+            stream.ack(*protocol.ACK_COUNT.unpack(payload))
+
+    @staticmethod
+    def _cancel(client, request_id, _payload):
+        """Stops stream or task cancelled by the client."""
+        if request_id in client.streams:
+            client.streams[request_id].cancel()
+        elif request_id in client.tasks:
+            client.tasks[request_id].cancel()
+
+    async def _pong(self, frame_writer, request_id, _payload):
+        """Answers ping with load report."""
+        await self._send_result(frame_writer, request_id, b'',
+                                msg_type=protocol.PONG)
+
+    async def _hello(self, frame_writer, request_id, payload):
+        """Answers handshake with accepted serializers and picks codec.
+
+        Responses are compressed once the answer is sent, as client
+        compresses its messages once it gets the answer.
+        """
+        _, offered_codecs = protocol.unpack_hello(payload)
+        codec = compression.choose(offered_codecs, self.codecs)
+        await self._send(frame_writer, request_id, protocol.HELLO,
+                         protocol.pack_hello(
+                             self.serializers, [codec] if codec else []))
+        if codec is not None:
+            frame_writer.compressor = compression.Compressor(
+                compression.get(codec), self.compression_threshold,
+                self.compression_stats)
+
+    @property
+    def is_busy(self):
+        """Whether queue of the server is full."""
+        return (self.max_queue_depth is not None and
+                self.num_tasks >= self.max_queue_depth)
+
+    async def put_object(self, frame_writer, request_id, payload):
+        """Stores object put by the client and confirms it."""
+        try:
+            self.objects.put(bytes(payload[:protocol.OBJECT_ID_SIZE]),
+                             memoryview(payload)[protocol.OBJECT_ID_SIZE:])
+            result = cloudpickle.dumps(None)
+        except objects.Error as exc:
+            logging.error('%s: %s', type(exc).__name__, str(exc))
+            result = cloudpickle.dumps(exc)
+        await self._send_result(frame_writer, request_id, result)
+
+    async def fetch_object(self, frame_writer, request_id, payload):
+        """Gets object from the server that has it, stores it and confirms
+        it to the client."""
+        object_id = bytes(payload[:protocol.OBJECT_ID_SIZE])
+        try:
+            peers = discovery.parse_servers(
+                bytes(payload[protocol.OBJECT_ID_SIZE:]).decode())
+            if len(peers) != 1:
+                raise ValueError('Expected single server, got %d' % len(peers))
+            peer = peers[0]
+            connection = await self._peer_connection(peer)
+            msg_type, response = await connection.request(
+                protocol.GET, object_id)
+            if msg_type != protocol.RESULT:
+                raise objects.ObjectNotFoundError(
+                    'Object %s is not found on %s:%s' % (
+                        (object_id.hex(),) + peer))
+            self.objects.put(
+                object_id, memoryview(response)[protocol.LOAD_REPORT.size:])
+            result = cloudpickle.dumps(None)
+        except (ValueError, OSError, connections.WorkerConnectionError,
+                objects.Error) as exc:
+            logging.error('%s: %s', type(exc).__name__, str(exc))
+            result = cloudpickle.dumps(exc)
+        await self._send_result(frame_writer, request_id, result)
+
+    async def get_object(self, frame_writer, request_id, payload):
+        """Sends stored object."""
+        object_id = bytes(payload[:protocol.OBJECT_ID_SIZE])
+        data = self.objects.read(object_id)
+        if data is None:
+            await self._send(frame_writer, request_id,
+                             protocol.UNKNOWN_OBJECT, object_id)
+        else:
+            await self._send_result(frame_writer, request_id, data)
+
+    async def _completed_tasks(self, frame_writer, request_id, payload):
+        """Sends ids of tasks that the server completed out of the asked
+        ones."""
+        if self.journal is None:
+            result = cloudpickle.dumps(journals.NoJournalError(
+                'Server %s:%s has no journal' % (self.host, self.port)))
+        else:
+            result = cloudpickle.dumps([
+                task_id for task_id in protocol.split_ids(payload)
+                if task_id in self.journal.completed])
+        await self._send_result(frame_writer, request_id, result)
+
+    def _accept(self, task_id):
+        """Journals task that has id."""
+        if self.journal is not None and task_id is not None:
+            self.journal.append(journals.ACCEPTED, task_id)
+
+    async def _complete(self, task_id):
+        """Journals completed task and waits until record is on disk.
+
+        Result is sent even if record can't be written.
+        """
+        if self.journal is None or task_id is None:
+            return
+        self.journal.append(journals.COMPLETED, task_id)
+        try:
+            await self.journal.sync()
+        except OSError:
+            pass
+
+    async def _check_task(self, frame_writer, request_id, func_id, refs):
+        """Asks client to upload the function if it's not registered and
+        objects used by the task that are not stored.
+
+        Function is taken from the cache here and is passed along with the
+        task, so it can't be evicted while the task waits for a worker.
+
+        Returns:
+            Serialized function of the task or None if server doesn't have
+            everything the task needs.
+        """
+        serialized_func = self.functions.get(func_id)
+        if serialized_func is None:
+            await self._send(frame_writer, request_id,
+                             protocol.UNKNOWN_FUNCTION, func_id)
+            return None
+        missing = self.objects.missing(refs)
+        if missing:
+            await self._send(frame_writer, request_id,
+                             protocol.UNKNOWN_OBJECT, *missing)
+            return None
+        return serialized_func
+
+    async def run_task(self, frame_writer, request_id, payload,
+                       offloadable=True, store=False):
+        """Runs single task and sends result back to the client.
+
+        Asks client to upload the function and objects the task uses if
+        server doesn't have them. Rejects task if server is busy. Task that
+        waits for worker may be offloaded to peer if it's offloadable and
+        uses no stored objects. Result of the task that is stored is kept
+        as object and client gets its size, such task is not offloaded.
+        Task that has id is journaled and its result is sent when it's
+        journaled as completed.
+        """
+        if self.is_busy:
+            await self._reject(frame_writer, request_id)
+            return
+        options, payload = protocol.unpack_options(payload)
+        result_id = None
+        if store:
+            result_id = bytes(payload[:protocol.OBJECT_ID_SIZE])
+            payload = payload[protocol.OBJECT_ID_SIZE:]
+        func_id = bytes(payload[:protocol.FUNCTION_ID_SIZE])
+        serialized_func = await self._check_task(
+            frame_writer, request_id, func_id, options[3])
+        if serialized_func is None:
+            return
+        pinned = self.objects.pin(options[3])
+        self._accept(options[4])
+        try:
+            result, succeeded = await self._compute(
+                func_id, serialized_func, payload, options,
+                offloadable and not store, pinned)
+            if store and succeeded:
+                self.objects.put(result_id, result)
+                result = cloudpickle.dumps(len(result))
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error('%s: %s', type(exc).__name__, str(exc))
+            result = cloudpickle.dumps(exc)
+        finally:
+            self.objects.unpin(pinned)
+        await self._complete(options[4])
+        await self._send_result(frame_writer, request_id, result)
+
+    async def run_cached_task(self, frame_writer, request_id, payload):
+        """Sends cached result of the task or runs it and caches result.
+
+        Cache hits are answered without running worker. Tasks with the
+        same key that arrive while the result is computed wait for it
+        instead of running again. Computation is shared, so it goes on
+        when some of the waiting tasks are cancelled. Exceptions are sent,
+        but not cached. Task that has to run is rejected if server is busy.
+        Task that has id is journaled like in run_task.
+        """
+        options, payload = protocol.unpack_options(payload)
+        key = bytes(payload[:protocol.CACHE_KEY_SIZE])
+        payload = payload[protocol.CACHE_KEY_SIZE:]
+        # Results are cached in format of the serializer of the task.
+        key = _serializer_of(payload).name, key
+        result = self.results.get(key)
+        if result is not None:
+            self.metrics.cache_hits.inc()
+        else:
+            computing = self._computing.get(key)
+            if computing is None:
+                if self.is_busy:
+                    await self._reject(frame_writer, request_id)
+                    return
+                func_id = bytes(payload[:protocol.FUNCTION_ID_SIZE])
+                serialized_func = await self._check_task(
+                    frame_writer, request_id, func_id, options[3])
+                if serialized_func is None:
+                    return
+                computing = self._computing[key] = asyncio.ensure_future(
+                    self._compute_cached(
+                        key, func_id, serialized_func, payload, options,
+                        self.objects.pin(options[3])))
+            self._accept(options[4])
+            result = await asyncio.shield(computing)
+        await self._complete(options[4])
+        await self._send_result(frame_writer, request_id, result)
+
+    async def _compute_cached(self, key, func_id, serialized_func, payload,
+                              options, pinned):
+        """Runs cached task in the worker and caches its result.
+
+        Returns:
+            Serialized result or exception raised by the task.
+        """
+        try:
+            result, cacheable = await self._compute(
+                func_id, serialized_func, payload, options, True, pinned)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error('%s: %s', type(exc).__name__, str(exc))
+            return cloudpickle.dumps(exc)
+        finally:
+            del self._computing[key]
+            self.objects.unpin(pinned)
+        if cacheable:
+            self.results.put(key, result)
+        return result
+
+    async def _compute(self, func_id, serialized_func, payload, options,
+                       offloadable=False, pinned=()):
+        """Runs task in the worker when task scheduler starts it.
+
+        Task offloaded by the scheduler runs on the peer, it runs locally
+        if peer can't take it. Only tasks that run in worker processes and
+        use no stored objects are offloaded.
+
+        Args:
+            func_id: Id of registered function of the task.
+            serialized_func: Serialized function of the task.
+            payload: Task payload after task options.
+            options: Priority, queue name, executor and refs of the task.
+            offloadable: Whether task may be offloaded to peer.
+            pinned: objects.StoredObject of every ref of the task.
+        Returns:
+            Tuple of serialized result or exception raised by the task and
+            whether result can be cached, that is task ran locally and
+            succeeded.
+        Raises:
+            Exception raised while task is passed to the worker.
+        """
+        priority, queue, executor_name, _, _ = options
+        executor_name = executor_name or self.default_executor
+        task_scheduler = self.task_schedulers[executor_name]
+        submitted = time.time()
+        self.num_tasks += 1
+        try:
+            peer = await task_scheduler.acquire(
+                priority, queue, (offloadable and not pinned and
+                                  executor_name == protocol.PROCESS))
+            if peer is not None:
+                result = await self._offload(
+                    peer, func_id, serialized_func, payload, priority, queue)
+                if result is not None:
+                    return result, False
+                await task_scheduler.acquire(priority, queue)
+            try:
+                report = await self._execute(
+                    func_id, serialized_func, payload, executor_name,
+                    _payloads(pinned))
+            finally:
+                task_scheduler.release()
+        finally:
+            self.num_tasks -= 1
+        self.metrics.executor_wait.observe(max(report.started - submitted, 0))
+        self.metrics.execution_time.observe(report.duration, report.func_name)
+        if report.failed:
+            self.metrics.tasks_failed.inc(report.func_name)
+        else:
+            self.metrics.tasks_completed.inc(report.func_name)
+        return transfer.read(report.result), not report.failed
+
+    async def _execute(self, func_id, serialized_func, payload,
+                       executor_name, stored_objects=()):
+        """Passes task to the executor and returns its worker.TaskReport.
+
+        Task that runs in thread can't be stopped, it's only dropped if
+        it's not started yet.
+        """
+        serializer = _serializer_of(payload).name
+        if executor_name == protocol.ASYNC:
+            return await worker.coroutine_wrapper(
+                func_id, serialized_func,
+                bytes(payload[protocol.FUNCTION_ID_SIZE:]), self._log_task(),
+                serializer=serializer, stored_objects=stored_objects)
+        if executor_name == protocol.THREAD:
+            future = self.thread_executor.submit(
+                worker.task_wrapper, func_id, serialized_func,
+                bytes(payload[protocol.FUNCTION_ID_SIZE:]), self._log_task(),
+                share=False, serializer=serializer,
+                stored_objects=stored_objects)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+        serialized_task = transfer.share(
+            memoryview(payload)[protocol.FUNCTION_ID_SIZE:])
+        future = self.executor.submit(
+            worker.task_wrapper, func_id, serialized_func, serialized_task,
+            self._log_task(), serializer=serializer,
+            stored_objects=stored_objects)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self._kill(future)
+            raise
+        finally:
+            transfer.discard(serialized_task)
+
+    async def _offload(self, peer, func_id, serialized_func, payload,
+                       priority, queue):
+        """Runs task on the peer.
+
+        Peer gets the same task payload as the server got from the client,
+        so it must accept serializer of the task.
+
+        Returns:
+            Serialized result or exception raised by the task or None if
+            peer can't run the task.
+        """
+        serializer = _serializer_of(payload).name
+        try:
+            connection = await self._peer_connection(peer, serializer)
+            if connection.serializer.name != serializer:
+                return None
+            registered = False
+            while True:
+                if func_id not in connection.functions:
+                    await connection.register(func_id, serialized_func)
+                    registered = True
+                msg_type, response = await connection.request(
+                    protocol.OFFLOADED_TASK,
+                    protocol.pack_options(priority, queue, protocol.PROCESS),
+                    payload)
+                if msg_type != protocol.UNKNOWN_FUNCTION:
+                    break
+                if registered:
+                    raise connections.UnknownFunctionError(
+                        'Peer lost function %s' % func_id.hex())
+                # Peer evicted the function from its cache.
+                connection.functions.discard(func_id)
+        except (OSError, connections.Error,
+                protocol.MessageTooLargeError) as exc:
+            logging.error("Can't offload task to %s:%s: %s", peer[0],
+                          peer[1], str(exc))
+            return None
+        if msg_type == protocol.BUSY:
+            return None
+        self.metrics.tasks_offloaded.inc()
+        return bytes(memoryview(response)[protocol.LOAD_REPORT.size:])
+
+    async def _peer_connection(self, peer,
+                               serializer=serializers.CLOUDPICKLE):
+        """Returns connection to the peer that asks for the serializer,
+        opens it if needed.
+
+        Raises:
+            OSError: Raised when connection can't be established.
+        """
+        connection = self._peer_connections.get((peer, serializer))
+        if connection is None or not connection.is_alive:
+            connection = await connections.connect(
+                peer, self.max_message_size, serializer)
+            self._peer_connections[peer, serializer] = connection
+        return connection
+
+    async def offload_waiting(self):
+        """Periodically offloads tasks that wait for workers to peers with
+        idle workers."""
+        while True:
+            await asyncio.sleep(self.offload_interval)
+            task_scheduler = self.task_schedulers[protocol.PROCESS]
+            if any(task_scheduler.queued().values()):
+                await asyncio.gather(*[
+                    self._offload_to(peer) for peer in self.peers])
+
+    async def _offload_to(self, peer):
+        """Offloads as many waiting tasks as the peer has idle workers."""
+        try:
+            connection = await asyncio.wait_for(
+                self._peer_connection(peer), PEER_TIMEOUT)
+            _, payload = await asyncio.wait_for(
+                connection.request(protocol.PING), PEER_TIMEOUT)
+        except (OSError, connections.WorkerConnectionError,
+                asyncio.TimeoutError):
+            return
+        num_workers, num_tasks = protocol.LOAD_REPORT.unpack_from(payload)
+        if num_tasks < num_workers:
+            self.task_schedulers[protocol.PROCESS].offload(
+                num_workers - num_tasks, peer)
+
+    def _kill(self, future):
+        """Stops task that nobody waits for.
+
+        Task is dropped if it's not started yet. Worker running the task is
+        killed if executor supports it.
+        """
+        kill = getattr(self.executor, 'kill', future.cancel)
+        kill(future)
+        if (future.done() and not future.cancelled() and
+                future.exception() is None):
+            transfer.discard(future.result().result)
+
+    def _log_task(self):
+        """Whether worker should log the next task."""
+        return (self.task_log_rate >= 1 or
+                random.random() < self.task_log_rate)
+
+    async def run_stream(self, frame_writer, request_id, payload, stream):
+        """Runs generator task and streams its items to the client.
+
+        Worker sends items through a pipe. Next item is read from the pipe
+        only when client has credits for it, so slow client makes worker
+        wait instead of buffering items in memory. Rejects stream if
+        server is busy. Streams run in worker processes or threads, stream
+        that asks for event loop runs in thread.
+        """
+        if self.is_busy:
+            await self._reject(frame_writer, request_id)
+            return
+        (priority, queue, executor_name, refs, _), payload = (
+            protocol.unpack_options(payload))
+        executor_name = executor_name or self.default_executor
+        if executor_name == protocol.ASYNC:
+            executor_name = protocol.THREAD
+        func_id = bytes(payload[:protocol.FUNCTION_ID_SIZE])
+        serialized_func = await self._check_task(
+            frame_writer, request_id, func_id, refs)
+        if serialized_func is None:
+            return
+        pinned = self.objects.pin(refs)
+        task_scheduler = self.task_schedulers[executor_name]
+        self.num_tasks += 1
         try:
-            result = await self.loop.run_in_executor(
-                self.executor, task_wrapper, serialized_task)
+            await task_scheduler.acquire(priority, queue)
+        except asyncio.CancelledError:
+            self.num_tasks -= 1
+            self.objects.unpin(pinned)
+            raise
+        if executor_name == protocol.THREAD:
+            stream_executor = self.thread_executor
+            serialized_task = bytes(payload[protocol.FUNCTION_ID_SIZE:])
+        else:
+            stream_executor = self.executor
+            serialized_task = transfer.share(
+                memoryview(payload)[protocol.FUNCTION_ID_SIZE:])
+        conn, worker_conn = multiprocessing.Pipe()
+        future = stream_executor.submit(
+            worker.stream_wrapper, func_id, serialized_func, serialized_task,
+            worker_conn, self._log_task(),
+            serializer=_serializer_of(payload).name,
+            stored_objects=_payloads(pinned))
+        try:
+            result = await self._pass_items(
+                frame_writer, request_id, stream, conn, future)
+        except ConnectionError:
+            logging.error('Client disconnected before stream is sent')
+            return
         except Exception as exc:  # pylint: disable=broad-except
             logging.error('%s: %s', type(exc).__name__, str(exc))
             result = cloudpickle.dumps(exc)
-        writer.write(result)
-        await writer.drain()
-        if writer.can_write_eof():
-            writer.write_eof()
-        writer.close()
+        finally:
+            self.num_tasks -= 1
+            task_scheduler.release()
+            self.objects.unpin(pinned)
+            conn.close()
+            worker_conn.close()
+            transfer.discard(serialized_task)
+        await self._send_result(frame_writer, request_id, result,
+                                msg_type=protocol.STREAM_END)
+
+    async def _pass_items(self, frame_writer, request_id, stream, conn,
+                          future):
+        """Passes items from worker to the client until stream ends.
+
+        If stream is cancelled, asks worker to stop and drops items it
+        has already sent.
+
+        Returns:
+            Serialized result of the stream.
+        """
+        while True:
+            cancelled = not await stream.wait()
+            if cancelled:
+                conn.send_bytes(b'cancel')
+            item = await self.loop.run_in_executor(
+                None, worker.receive_item, conn, future)
+            while cancelled and item is not None:
+                item = await self.loop.run_in_executor(
+                    None, worker.receive_item, conn, future)
+            if item is None:
+                break
+            stream.credits -= 1
+            self.metrics.bytes_sent.inc(amount=len(item))
+            await frame_writer.send(request_id, protocol.STREAM_ITEM, item)
+        await asyncio.wrap_future(future)
+        return cloudpickle.dumps(None)
+
+    async def _send_result(self, frame_writer, request_id, result,
+                           msg_type=protocol.RESULT):
+        """Sends result with load report of the server."""
+        load_report = protocol.LOAD_REPORT.pack(
+            self.num_workers, self.num_tasks)
+        await self._send(frame_writer, request_id, msg_type,
+                         load_report, result)
+
+    async def _reject(self, frame_writer, request_id):
+        """Tells client that server is busy."""
+        self.metrics.tasks_rejected.inc()
+        await self._send_result(frame_writer, request_id, b'',
+                                msg_type=protocol.BUSY)
+
+    async def _send(self, frame_writer, request_id, msg_type, *payload):
+        """Sends response, logs error if client is gone."""
+        self.metrics.bytes_sent.inc(
+            amount=sum(len(part) for part in payload))
+        try:
+            await frame_writer.send(request_id, msg_type, *payload)
+        except ConnectionError:
+            logging.error('Client disconnected before response is sent')
+
+    def render_metrics(self):
+        """Returns metrics of the server in Prometheus text format."""
+        self.metrics.queue_depth.set(self.num_tasks)
+        queued_tasks = {}
+        for task_scheduler in self.task_schedulers.values():
+            for queue, queued in task_scheduler.queued().items():
+                queued_tasks[queue] = queued_tasks.get(queue, 0) + queued
+        for queue, queued in queued_tasks.items():
+            self.metrics.queued_tasks.set(queued, queue)
+        self.metrics.worker_restarts.set(
+            getattr(self.executor, 'restarts', 0))
+        self.metrics.worker_recycles.set(
+            getattr(self.executor, 'recycles', 0))
+        self.metrics.compression_raw_bytes.set(
+            self.compression_stats.raw_bytes)
+        self.metrics.compression_compressed_bytes.set(
+            self.compression_stats.compressed_bytes)
+        self.metrics.compression_time.set(
+            self.compression_stats.compress_time, 'compress')
+        self.metrics.compression_time.set(
+            self.compression_stats.decompress_time, 'decompress')
+        self.metrics.stored_objects.set(len(self.objects))
+        self.metrics.object_store_bytes.set(self.objects.size)
+        if self.journal is not None:
+            self.metrics.journal_records.set(self.journal.records)
+            self.metrics.journal_syncs.set(self.journal.syncs)
+            self.metrics.journal_compactions.set(self.journal.compactions)
+        return self.metrics.render()
+
+    async def handle_metrics(self, reader, writer):
+        """Answers HTTP request for metrics."""
+        await metrics.serve(reader, writer, self.render_metrics)
 
     def run_forever(self):
         """Starts server."""
@@ -59,26 +816,112 @@ class QServer:
         self.loop.run_until_complete(
             asyncio.start_server(
                 self.handle_task, host=self.host, port=self.port))
+        if self.metrics_port is not None:
+            logging.info('Serving metrics on %s:%s', self.host,
+                         self.metrics_port)
+            self.loop.run_until_complete(
+                asyncio.start_server(
+                    self.handle_metrics, host=self.host,
+                    port=self.metrics_port))
+        if self.journal is not None:
+            logging.info('Journaling tasks to %s, %d completed before',
+                         self.journal.path, len(self.journal.completed))
+        if self.peers:
+            logging.info('Offloading tasks to %s', ', '.join(
+                '%s:%s' % peer for peer in self.peers))
+            asyncio.ensure_future(self.offload_waiting())
         self.loop.run_forever()
 
     def shutdown(self):
         """Shuts server down."""
         self.executor.shutdown(wait=True)
+        # Tasks that run in threads can't be stopped.
+        self.thread_executor.shutdown(wait=False)
+        self.objects.clear()
+        if self.journal is not None:
+            self.journal.close()
         self.loop.stop()
         self.loop.close()
 
     @classmethod
-    def create(cls, host, port, num_workers):
+    def create(cls, host, port, num_workers,
+               max_message_size=protocol.MAX_MESSAGE_SIZE,
+               result_cache_size=RESULT_CACHE_SIZE,
+               result_cache_ttl=RESULT_CACHE_TTL, max_queue_depth=None,
+               task_log_rate=1, metrics_port=None, queue_weights=None,
+               peers=(), offload_interval=OFFLOAD_INTERVAL,
+               default_executor=protocol.PROCESS,
+               num_threads=NUM_THREADS_DEFAULT, max_tasks_per_worker=None,
+               max_worker_rss=None, preload=(), accepted_serializers=None,
+               accepted_codecs=None,
+               compression_threshold=compression.COMPRESSION_THRESHOLD,
+               object_store_size=objects.OBJECT_STORE_SIZE,
+               object_ttl=objects.OBJECT_TTL, journal_path=None,
+               journal_size=journals.MAX_COMPLETED):
         """Factory method that creates an instance of the server.
 
         Args:
             host: Hostname of the server.
             port: Port number of the server.
             num_workers: Number of worker processes.
+            max_message_size: Maximum size of message from client in bytes.
+            result_cache_size: Maximum number of cached results.
+            result_cache_ttl: Number of seconds result stays in the cache.
+            max_queue_depth: Maximum number of tasks on the server or None.
+            task_log_rate: Fraction of tasks that are logged.
+            metrics_port: Port of metrics endpoint or None.
+            queue_weights: Dict that maps queue name to its share of
+                           workers, other queues get queues.DEFAULT_WEIGHT.
+            peers: Hosts and ports of servers that get waiting tasks.
+            offload_interval: Seconds between checks of peers.
+            default_executor: One of protocol.EXECUTORS that runs tasks
+                              that don't choose executor.
+            num_threads: Number of threads that run tasks, also maximum
+                         number of coroutine tasks running at once.
+            max_tasks_per_worker: Number of tasks after which worker
+                                  process is replaced or None.
+            max_worker_rss: Resident set size in bytes after which worker
+                            process is replaced or None.
+            preload: Names of modules imported by worker processes before
+                     they get tasks.
+            accepted_serializers: Names of serializers that clients may
+                                  use or None for all available ones.
+            accepted_codecs: Names of codecs that clients may compress
+                             messages with or None for all available ones.
+            compression_threshold: Size in bytes of the smallest response
+                                   that is compressed.
+            object_store_size: Size in bytes of objects that clients may
+                               put on the server.
+            object_ttl: Number of seconds after last use when stored
+                        object is dropped.
+            journal_path: Path of the file that tasks are journaled to or
+                          None.
+            journal_size: Number of the last completed tasks that journal
+                          remembers.
         Returns:
             An instance of the server.
         """
         event_loop = asyncio.get_event_loop()
-        pool_executor = executor.ProcessPoolExecutorWithInit(
-            max_workers=num_workers, initializer=_silence_sigint)
-        return cls(host, port, event_loop, pool_executor)
+        pool_executor = executor.WorkerPool(
+            num_workers, initializer=worker.silence_sigint,
+            max_tasks_per_worker=max_tasks_per_worker,
+            max_rss=max_worker_rss, preload=WORKER_PRELOAD + tuple(preload))
+        thread_executor = concurrent.futures.ThreadPoolExecutor(
+            num_threads, thread_name_prefix='atq-worker')
+        return cls(host, port, event_loop, pool_executor,
+                   max_message_size=max_message_size,
+                   result_cache_size=result_cache_size,
+                   result_cache_ttl=result_cache_ttl,
+                   max_queue_depth=max_queue_depth,
+                   task_log_rate=task_log_rate, metrics_port=metrics_port,
+                   queue_weights=queue_weights, peers=peers,
+                   offload_interval=offload_interval,
+                   thread_executor=thread_executor,
+                   default_executor=default_executor,
+                   accepted_serializers=accepted_serializers,
+                   accepted_codecs=accepted_codecs,
+                   compression_threshold=compression_threshold,
+                   object_store_size=object_store_size,
+                   object_ttl=object_ttl,
+                   journal=(None if journal_path is None
+                            else journals.Journal(journal_path, journal_size)))
@@ -0,0 +1,276 @@
+"""Benchmark of atq client and server.
+
+Starts local servers, runs workload through them and prints throughput
+and latency percentiles as JSON, so results of different runs can be
+compared. Latency of every task is broken down into phases:
+
+    connect: Selecting server and getting connection to it.
+    serialize: Pickling the task on the client.
+    queue_wait: Time between sending the task and getting its result,
+                except execution. Includes network and waiting for free
+                worker.
+    execute: Running the function in the worker.
+    deserialize: Unpickling the result on the client.
+
+All times are in seconds. Arguments that are not recognized are passed
+to the servers. Usage:
+
+    python3 -m atq.bench --workload cpu --servers 2 --clients 4
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from atq import atqclient
+from atq import stats
+
+HOST = 'localhost'
+PORT = 12345
+NUM_SERVERS_DEFAULT = 1
+NUM_WORKERS_DEFAULT = 4
+NUM_CLIENTS_DEFAULT = 1
+CONCURRENCY_DEFAULT = 16
+NUM_TASKS_DEFAULT = 2000
+NUM_WARMUP_TASKS = 100
+CPU_ITERATIONS_DEFAULT = 100000
+PAYLOAD_SIZE_DEFAULT = 1024 * 1024  # bytes
+SERVER_START_TIMEOUT = 30  # seconds
+PHASES = ('connect', 'serialize', 'queue_wait', 'execute', 'deserialize')
+
+# Durations of phases of the current task.
+_timings = contextvars.ContextVar('timings')
+
+
+def _noop():
+    """Does nothing."""
+    return None
+
+
+def _cpu(iterations):
+    """Burns CPU."""
+    return sum(i * i for i in range(iterations))
+
+
+def _echo(data):
+    """Returns its argument."""
+    return data
+
+
+def _run_timed(func, *args):
+    """Runs function and returns its execution time and result."""
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+WORKLOADS = {
+    'noop': lambda args: (_noop,),
+    'cpu': lambda args: (_cpu, args.cpu_iterations),
+    'payload': lambda args: (_echo, os.urandom(args.payload_size)),
+}
+
+
+def _observe(event):
+    """Records phases of the finished task."""
+    timings = _timings.get(None)
+    if timings is not None:
+        timings.update({
+            'connect': event.connect_time,
+            'serialize': event.serialize_time,
+            'request': event.request_time,
+            'deserialize': event.deserialize_time,
+        })
+
+
+async def _run_task(q, call):
+    """Runs single task and returns durations of its phases."""
+    timings = {}
+    _timings.set(timings)
+    start = time.perf_counter()
+    timings['execute'], _ = await q.q(_run_timed, *call)
+    timings['total'] = time.perf_counter() - start
+    timings['queue_wait'] = timings.pop('request') - timings['execute']
+    return timings
+
+
+async def _run_client(q, call, num_tasks, concurrency):
+    """Runs tasks with given number of them in flight.
+
+    Returns:
+        List of durations of phases of every task.
+    """
+    remaining = iter(range(num_tasks))
+    results = []
+
+    async def run_tasks():
+        for _ in remaining:
+            results.append(await _run_task(q, call))
+
+    await asyncio.gather(*[run_tasks() for _ in range(concurrency)])
+    return results
+
+
+async def run(servers, call, num_tasks, num_clients, concurrency,
+              num_warmup_tasks=NUM_WARMUP_TASKS):
+    """Runs workload against servers.
+
+    Args:
+        servers: List of hosts and ports of the servers.
+        call: Tuple of function and its arguments.
+        num_tasks: Number of measured tasks.
+        num_clients: Number of clients, every client has own connections.
+        concurrency: Number of tasks in flight per client.
+        num_warmup_tasks: Number of tasks run by every client before
+                          measurement.
+    Returns:
+        Dict with throughput and latency percentiles.
+    """
+    clients = [atqclient.Q(servers, observers=[_observe])
+               for _ in range(num_clients)]
+    try:
+        await asyncio.gather(*[
+            _run_client(q, call, num_warmup_tasks, concurrency)
+            for q in clients])
+        shares = [num_tasks // num_clients + (i < num_tasks % num_clients)
+                  for i in range(num_clients)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            _run_client(q, call, share, concurrency)
+            for q, share in zip(clients, shares)])
+        duration = time.perf_counter() - start
+    finally:
+        for q in clients:
+            q.close()
+    timings = [task for client in results for task in client]
+    latency = {'total': stats.summary([task['total'] for task in timings])}
+    for phase in PHASES:
+        latency[phase] = stats.summary([task[phase] for task in timings])
+    return {
+        'tasks': len(timings),
+        'duration': duration,
+        'throughput': len(timings) / duration,
+        'latency': latency,
+    }
+
+
+def wait_for_server(host, port, process):
+    """Waits until server accepts connections.
+
+    Raises:
+        RuntimeError: Raised when server exits or doesn't start in time.
+    """
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server on port %s exited' % port)
+        try:
+            socket.create_connection((host, port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server on port %s didn't start" % port)
+
+
+def start_servers(host, port, num_servers, num_workers, server_args=()):
+    """Starts local servers on consecutive ports.
+
+    Returns:
+        List of server processes and list of their hosts and ports.
+    """
+    processes, servers = [], []
+    try:
+        for i in range(num_servers):
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'atq', '-H', host, '-p', str(port + i),
+                 '-w', str(num_workers)] + list(server_args),
+                stderr=subprocess.DEVNULL))
+            servers.append((host, port + i))
+        for process, (server_host, server_port) in zip(processes, servers):
+            wait_for_server(server_host, server_port, process)
+    except BaseException:
+        stop_servers(processes)
+        raise
+    return processes, servers
+
+
+def stop_servers(processes):
+    """Stops server processes."""
+    for process in processes:
+        if process.poll() is None:
+            os.kill(process.pid, signal.SIGINT)
+    for process in processes:
+        process.communicate()
+
+
+def main():
+    """Main function of the module."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--workload', choices=sorted(WORKLOADS),
+                        default='noop', help='function run by tasks')
+    parser.add_argument('-H', '--host', dest='host', type=str, default=HOST,
+                        help='host of the servers')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=PORT,
+                        help='port of the first server')
+    parser.add_argument('--servers', dest='num_servers', type=int,
+                        default=NUM_SERVERS_DEFAULT, help='number of servers')
+    parser.add_argument('-w', '--workers', dest='num_workers', type=int,
+                        default=NUM_WORKERS_DEFAULT,
+                        help='number of workers per server')
+    parser.add_argument('--clients', dest='num_clients', type=int,
+                        default=NUM_CLIENTS_DEFAULT, help='number of clients')
+    parser.add_argument('--concurrency', dest='concurrency', type=int,
+                        default=CONCURRENCY_DEFAULT,
+                        help='number of tasks in flight per client')
+    parser.add_argument('--tasks', dest='num_tasks', type=int,
+                        default=NUM_TASKS_DEFAULT,
+                        help='number of measured tasks')
+    parser.add_argument('--warmup', dest='num_warmup_tasks', type=int,
+                        default=NUM_WARMUP_TASKS,
+                        help='number of tasks per client before measurement')
+    parser.add_argument('--cpu-iterations', dest='cpu_iterations', type=int,
+                        default=CPU_ITERATIONS_DEFAULT,
+                        help='number of iterations of cpu workload')
+    parser.add_argument('--payload-size', dest='payload_size', type=int,
+                        default=PAYLOAD_SIZE_DEFAULT,
+                        help='size of argument and result of payload workload')
+    parser.add_argument('--output', dest='output', type=str, default=None,
+                        help='file to write results to instead of stdout')
+    args, server_args = parser.parse_known_args()
+    processes, servers = start_servers(
+        args.host, args.port, args.num_servers, args.num_workers, server_args)
+    try:
+        results = asyncio.get_event_loop().run_until_complete(run(
+            servers, WORKLOADS[args.workload](args), args.num_tasks,
+            args.num_clients, args.concurrency, args.num_warmup_tasks))
+    finally:
+        stop_servers(processes)
+    results['config'] = {
+        'workload': args.workload,
+        'servers': args.num_servers,
+        'workers': args.num_workers,
+        'clients': args.num_clients,
+        'concurrency': args.concurrency,
+        'server_args': server_args,
+    }
+    if args.workload == 'cpu':
+        results['config']['cpu_iterations'] = args.cpu_iterations
+    if args.workload == 'payload':
+        results['config']['payload_size'] = args.payload_size
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Caches used by client and server."""
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping with bounded size that evicts least recently used items.
+
+    Attributes:
+        maxsize: Maximum number of items in the cache.
+        _items: Ordered dict of items, most recently used ones at the end.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Returns item and marks it as recently used."""
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def put(self, key, value):
+        """Adds item, evicts least recently used one if cache is full."""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes item from the cache and returns it."""
+        return self._items.pop(key, default)
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose items expire after fixed time.
+
+    Attributes:
+        ttl: Number of seconds item stays in the cache.
+    """
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        """Returns item if it's not expired and marks it as recently used."""
+        item = super().get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            super().pop(key)
+            return default
+        return value
+
+    def put(self, key, value):
+        """Adds item, evicts least recently used one if cache is full."""
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+    def pop(self, key, default=None):
+        """Removes item from the cache and returns it."""
+        item = super().pop(key)
+        return default if item is None else item[1]
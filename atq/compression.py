@@ -0,0 +1,250 @@
+"""Compression of large messages.
+
+Client and server agree on codec in the handshake, then messages larger
+than threshold are compressed by the sender. Compressed payload starts
+with id of its codec, so receiver doesn't need to know the codec. Message
+that doesn't get smaller is sent as is.
+"""
+import time
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Names of codecs.
+ZLIB = 'zlib'
+LZ4 = 'lz4'
+ZSTD = 'zstd'
+
+# Messages smaller than that are not compressed.
+COMPRESSION_THRESHOLD = 64 * 1024  # bytes
+
+# Fast level, compressed messages are usually large.
+ZLIB_LEVEL = 1
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class UnknownCodecError(Error):
+    """Raised when codec is unknown or is not installed."""
+    pass
+
+
+class Codec:
+    """Compression algorithm.
+
+    Attributes:
+        name: Name of the codec in the handshake.
+        codec_id: Byte that starts compressed payload.
+    """
+    name = None
+    codec_id = None
+
+    @property
+    def is_available(self):
+        """Whether package of the codec is installed."""
+        return True
+
+    def compress(self, data):
+        """Returns compressed bytes-like data."""
+        raise NotImplementedError
+
+    def decompress(self, data, max_length=None):
+        """Returns decompressed bytes-like data.
+
+        Args:
+            data: Compressed data.
+            max_length: Data is decompressed up to max_length + 1 bytes,
+                        so larger data is detected without decompressing
+                        all of it. None means no limit.
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    """Codec of the standard library."""
+    name = ZLIB
+    codec_id = 1
+
+    def compress(self, data):
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    def decompress(self, data, max_length=None):
+        if max_length is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_length + 1)
+        if len(result) <= max_length and not decompressor.eof:
+            raise zlib.error('Incomplete compressed data')
+        return result
+
+
+class Lz4Codec(Codec):
+    """Fast codec, requires lz4 package."""
+    name = LZ4
+    codec_id = 2
+
+    @property
+    def is_available(self):
+        return lz4_frame is not None
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, max_length=None):
+        if max_length is None:
+            return lz4_frame.decompress(data)
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        result = decompressor.decompress(data, max_length=max_length + 1)
+        if len(result) <= max_length and not decompressor.eof:
+            raise RuntimeError('Incomplete compressed data')
+        return result
+
+
+class ZstdCodec(Codec):
+    """Codec with good ratio at high speed, requires zstandard package."""
+    name = ZSTD
+    codec_id = 3
+
+    @property
+    def is_available(self):
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor().compress(data)
+
+    def decompress(self, data, max_length=None):
+        if max_length is None:
+            return zstandard.ZstdDecompressor().decompress(data)
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            return reader.read(max_length + 1)
+
+
+# Codecs in order of preference.
+CODECS = [ZstdCodec(), Lz4Codec(), ZlibCodec()]
+_BY_NAME = {codec.name: codec for codec in CODECS}
+_BY_ID = {codec.codec_id: codec for codec in CODECS}
+
+
+def available():
+    """Returns names of codecs that can be used here in order of
+    preference."""
+    return [codec.name for codec in CODECS if codec.is_available]
+
+
+def get(name):
+    """Returns codec by name.
+
+    Raises:
+        UnknownCodecError: Raised when codec is unknown or its package is
+                           not installed.
+    """
+    if name not in available():
+        raise UnknownCodecError('Unknown codec: %r' % name)
+    return _BY_NAME[name]
+
+
+def choose(offered, accepted):
+    """Returns the first offered codec name that is accepted or None."""
+    for name in offered:
+        if name in accepted:
+            return name
+    return None
+
+
+class CompressionStats:
+    """Sizes and CPU time of compressed messages.
+
+    Attributes:
+        raw_bytes: Size of compressed messages before compression.
+        compressed_bytes: Size of compressed messages on the wire.
+        compress_time: CPU seconds spent compressing, including messages
+                       that didn't get smaller.
+        decompress_time: CPU seconds spent decompressing.
+    """
+    def __init__(self):
+        self.raw_bytes = self.compressed_bytes = 0
+        self.compress_time = self.decompress_time = 0
+
+    @property
+    def ratio(self):
+        """Size of compressed messages before compression divided by their
+        size on the wire or None if nothing is compressed."""
+        if not self.compressed_bytes:
+            return None
+        return self.raw_bytes / self.compressed_bytes
+
+    def snapshot(self):
+        """Returns dict with statistics."""
+        return {
+            'ratio': self.ratio,
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'compress_time': self.compress_time,
+            'decompress_time': self.decompress_time,
+        }
+
+
+class Compressor:
+    """Compresses messages sent through single connection.
+
+    Attributes:
+        codec: Codec of the messages.
+        threshold: Smaller messages are not compressed.
+        stats: CompressionStats that messages are counted in.
+    """
+    def __init__(self, codec, threshold=COMPRESSION_THRESHOLD, stats=None):
+        self.codec = codec
+        self.threshold = threshold
+        self.stats = stats if stats is not None else CompressionStats()
+
+    def compress(self, payload):
+        """Compresses message given in parts.
+
+        Returns:
+            Parts of compressed payload or None if it isn't smaller.
+        """
+        start = time.thread_time()
+        data = b''.join(payload)
+        compressed = self.codec.compress(data)
+        self.stats.compress_time += time.thread_time() - start
+        if len(compressed) + 1 >= len(data):
+            return None
+        self.stats.raw_bytes += len(data)
+        self.stats.compressed_bytes += len(compressed) + 1
+        return [bytes((self.codec.codec_id,)), compressed]
+
+
+def decompress(payload, stats=None, max_length=None):
+    """Decompresses payload of any codec.
+
+    Args:
+        payload: Codec id followed by compressed data.
+        stats: CompressionStats that payload is counted in or None.
+        max_length: Payload is decompressed up to max_length + 1 bytes,
+                    so caller can reject larger data without decompressing
+                    all of it. None means no limit.
+    Raises:
+        UnknownCodecError: Raised when codec is unknown or is not
+                           installed.
+    """
+    codec = _BY_ID.get(payload[0])
+    if codec is None or not codec.is_available:
+        raise UnknownCodecError('Unknown codec id: %s' % payload[0])
+    start = time.thread_time()
+    data = codec.decompress(memoryview(payload)[1:], max_length)
+    if stats is not None:
+        stats.decompress_time += time.thread_time() - start
+        stats.raw_bytes += len(data)
+        stats.compressed_bytes += len(payload)
+    return data
@@ -0,0 +1,376 @@
+"""Connections of clients and servers to task queue servers.
+
+Connection multiplexes requests of many tasks over single stream, so
+clients and servers that pass tasks to each other keep one connection per
+server.
+"""
+import asyncio
+import itertools
+
+from atq import compression as compressions
+from atq import protocol
+from atq import serializers
+
+HANDSHAKE_TIMEOUT = 1  # seconds
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class WorkerConnectionError(Error):
+    """Raised on socket read error."""
+    pass
+
+
+class UnknownFunctionError(Error):
+    """Raised when server doesn't know function of the task right after it
+    registered it."""
+    pass
+
+
+class Connection:
+    """Persistent connection to task queue server.
+
+    Multiplexes requests over single stream. Responses are matched to
+    requests by request id, so they may arrive in any order.
+
+    Attributes:
+        host: Hostname of the client side of the connection.
+        server_address: Host and port of the server.
+        closed: Whether connection is closed.
+        _reader: protocol.MessageReader of the connection.
+        _writer: protocol.FrameWriter of the connection.
+        _pending: Mapping from request id to future that waits for response.
+        _streams: Mapping from request id to queue that receives responses
+                  of the stream.
+        _request_ids: Generator of request ids.
+        _read_task: Task that reads responses from the server.
+        functions: Ids of functions registered on the server through
+                   this connection.
+        serializer: serializers.Serializer of tasks sent through the
+                    connection.
+        compression_stats: compression.CompressionStats of messages of the
+                           connection.
+    """
+    def __init__(self, reader, writer,
+                 max_message_size=protocol.MAX_MESSAGE_SIZE,
+                 compression_stats=None, server_address=None):
+        self.host, *_ = writer.get_extra_info('sockname')
+        self.server_address = server_address
+        self.closed = False
+        self.compression_stats = (
+            compression_stats if compression_stats is not None
+            else compressions.CompressionStats())
+        self._reader = protocol.MessageReader(
+            reader, max_message_size, self.compression_stats)
+        self._writer = protocol.FrameWriter(writer)
+        self._pending = {}
+        self._streams = {}
+        self._request_ids = itertools.count(1)
+        self._read_task = asyncio.ensure_future(self._read_responses())
+        self.functions = set()
+        self.serializer = serializers.SERIALIZERS[serializers.CLOUDPICKLE]
+
+    @property
+    def is_idle(self):
+        """Whether connection has no requests in flight."""
+        return not self._pending and not self._streams
+
+    @property
+    def is_alive(self):
+        """Whether connection can be used for new requests."""
+        return not self.closed and not self._reader.at_eof()
+
+    async def handshake(
+            self, serializer, codecs=(),
+            compression_threshold=compressions.COMPRESSION_THRESHOLD):
+        """Uses serializer if the server accepts it and compresses messages
+        with codec picked by the server.
+
+        Server that doesn't answer in time doesn't know handshake and gets
+        tasks serialized with CLOUDPICKLE and not compressed. As payloads
+        tell their serializer and codec, late answer does no harm.
+
+        Args:
+            serializer: Name of serializer of tasks.
+            codecs: Names of codecs in order of preference.
+            compression_threshold: Smaller messages are not compressed.
+        Raises:
+            WorkerConnectionError: Raised when connection is lost.
+        """
+        try:
+            msg_type, payload = await asyncio.wait_for(
+                self.request(protocol.HELLO,
+                             protocol.pack_hello([serializer], codecs)),
+                HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return
+        if msg_type != protocol.HELLO:
+            return
+        accepted, codec = protocol.unpack_hello(payload)
+        if serializer in accepted:
+            self.serializer = serializers.get(serializer)
+        if codec and codec[0] in codecs:
+            self._writer.compressor = compressions.Compressor(
+                compressions.get(codec[0]), compression_threshold,
+                self.compression_stats)
+
+    async def _read_responses(self):
+        """Reads responses and passes them to waiting requests."""
+        while True:
+            try:
+                request_id, msg_type, payload = await self._reader.read()
+            except (protocol.MessageTooLargeError,
+                    protocol.DecompressionError) as exc:
+                # Traceback references frame of this coroutine, clearing it
+                # in the request would finalize the coroutine.
+                self._deliver(exc.request_id, exc.with_traceback(None))
+                continue
+            except (asyncio.IncompleteReadError, ConnectionError,
+                    protocol.FrameTooLargeError):
+                break
+            self._deliver(request_id, (msg_type, payload))
+        self.close()
+
+    def _deliver(self, request_id, response):
+        """Passes response or exception to request waiting for it."""
+        stream = self._streams.get(request_id)
+        if stream is not None:
+            stream.put_nowait(response)
+            return
+        future = self._pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if isinstance(response, BaseException):
+            future.set_exception(response)
+        else:
+            future.set_result(response)
+
+    async def request(self, msg_type, *payload):
+        """Sends request and waits for response.
+
+        Payload may be given in several parts to avoid concatenating them.
+
+        Server is asked to stop the request if it's cancelled before
+        response is received.
+
+        Returns:
+            Tuple of message type and payload of the response.
+        Raises:
+            WorkerConnectionError: Raised when connection is lost before
+                                   response is received.
+        """
+        if self.closed:
+            raise WorkerConnectionError('Connection is closed')
+        request_id = next(self._request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self._writer.send(request_id, msg_type, *payload)
+            return await future
+        except ConnectionError as exc:
+            self.close()
+            raise WorkerConnectionError('Connection is lost') from exc
+        except asyncio.CancelledError:
+            asyncio.ensure_future(self.cancel(request_id))
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def open_stream(self, msg_type, *payload):
+        """Sends request that gets several responses.
+
+        Returns:
+            Request id and asyncio.Queue that receives responses. Queue gets
+            exception if connection is lost. Stream must be closed with
+            close_stream when done.
+        Raises:
+            WorkerConnectionError: Raised when connection is lost.
+        """
+        if self.closed:
+            raise WorkerConnectionError('Connection is closed')
+        request_id = next(self._request_ids)
+        queue = self._streams[request_id] = asyncio.Queue()
+        try:
+            await self._writer.send(request_id, msg_type, *payload)
+        except ConnectionError as exc:
+            self.close()
+            raise WorkerConnectionError('Connection is lost') from exc
+        return request_id, queue
+
+    def close_stream(self, request_id):
+        """Stops passing responses of the stream."""
+        self._streams.pop(request_id, None)
+
+    async def send(self, msg_type, *payload, request_id=protocol.NO_RESPONSE):
+        """Sends message that doesn't expect response.
+
+        Raises:
+            WorkerConnectionError: Raised when connection is lost.
+        """
+        if self.closed:
+            raise WorkerConnectionError('Connection is closed')
+        try:
+            await self._writer.send(request_id, msg_type, *payload)
+        except ConnectionError as exc:
+            self.close()
+            raise WorkerConnectionError('Connection is lost') from exc
+
+    async def register(self, func_id, serialized_func):
+        """Uploads function to the server and waits until server keeps it.
+
+        Function counts as registered while it's uploaded, so tasks sent
+        meanwhile don't upload it again, server reads them after it.
+
+        Raises:
+            WorkerConnectionError: Raised when connection is lost.
+            protocol.MessageTooLargeError: Raised when function is larger
+                                           than maximum message size of
+                                           the server.
+        """
+        self.functions.add(func_id)
+        try:
+            _, payload = await self.request(
+                protocol.REGISTER, func_id, serialized_func)
+            result = serializers.loads(
+                memoryview(payload)[protocol.LOAD_REPORT.size:])
+            if isinstance(result, BaseException):
+                raise result
+        except BaseException:
+            self.functions.discard(func_id)
+            raise
+
+    async def cancel(self, request_id):
+        """Asks server to stop the request if connection is still alive."""
+        try:
+            await self.send(protocol.CANCEL, request_id=request_id)
+        except WorkerConnectionError:
+            pass
+
+    def close(self):
+        """Closes connection and fails all requests in flight."""
+        if self.closed:
+            return
+        self.closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(
+                    WorkerConnectionError('Connection is lost'))
+        self._pending.clear()
+        for stream in self._streams.values():
+            stream.put_nowait(WorkerConnectionError('Connection is lost'))
+        self._streams.clear()
+        self._writer.close()
+        # Close may be called outside of running event loop.
+        if self._read_task is not asyncio.current_task(
+                self._read_task.get_loop()):
+            self._read_task.cancel()
+
+
+async def connect(server_address, max_message_size=protocol.MAX_MESSAGE_SIZE,
+                  serializer=serializers.CLOUDPICKLE, codecs=(),
+                  compression_threshold=compressions.COMPRESSION_THRESHOLD,
+                  compression_stats=None):
+    """Opens connection to task queue server.
+
+    Used by Q and by servers that pass tasks to each other. Serializers
+    other than CLOUDPICKLE, that every server accepts, and compression are
+    negotiated in the handshake.
+
+    Args:
+        server_address: Host and port of the server.
+        max_message_size: Larger messages from the server are rejected.
+        serializer: Name of serializer of tasks.
+        codecs: Names of codecs in order of preference, messages are not
+                compressed if it's empty.
+        compression_threshold: Smaller messages are not compressed.
+        compression_stats: compression.CompressionStats that messages of
+                           the connection are counted in or None.
+    Returns:
+        Connection that multiplexes requests to the server.
+    Raises:
+        OSError: Raised when connection can't be established.
+    """
+    reader, writer = await asyncio.open_connection(*server_address)
+    connection = Connection(reader, writer, max_message_size,
+                            compression_stats, tuple(server_address))
+    if serializer != serializers.CLOUDPICKLE or codecs:
+        try:
+            await connection.handshake(
+                serializer, codecs, compression_threshold)
+        except WorkerConnectionError as exc:
+            raise ConnectionError(str(exc)) from exc
+        except BaseException:
+            connection.close()
+            raise
+    return connection
+
+
+def _connection_or_none(future):
+    """Returns connection from finished future or None if opening failed."""
+    if future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+class Pool:
+    """Connections to servers used by single event loop.
+
+    Concurrent requests to the server wait for single connection, which
+    is reused while it's alive.
+
+    Attributes:
+        _open: Coroutine function that opens connection to the server.
+        _pending: Maps server to future of pending or established
+                  connection.
+    """
+    def __init__(self, open_connection):
+        self._open = open_connection
+        self._pending = {}
+
+    async def get(self, server_address):
+        """Returns connection to the server, opens it if needed.
+
+        Raises:
+            OSError: Raised when connection can't be established.
+        """
+        pending = self._pending.get(server_address)
+        if pending is not None and pending.done():
+            connection = _connection_or_none(pending)
+            if connection is not None and connection.is_idle:
+                # Lets event loop process pending I/O, so connection dropped
+                # by the server while idle is noticed before reuse.
+                await asyncio.sleep(0)
+            if connection is not None and connection.is_alive:
+                return connection
+            if self._pending.get(server_address) is pending:
+                del self._pending[server_address]
+            pending = None
+        if pending is None:
+            pending = asyncio.ensure_future(self._open(server_address))
+            self._pending[server_address] = pending
+        try:
+            return await asyncio.shield(pending)
+        except OSError:
+            if self._pending.get(server_address) is pending:
+                del self._pending[server_address]
+            raise
+
+    def drop(self, server_address):
+        """Closes connection to the server or stops opening it."""
+        pending = self._pending.pop(server_address, None)
+        if pending is None:
+            return
+        if pending.done():
+            connection = _connection_or_none(pending)
+            if connection is not None:
+                connection.close()
+        else:
+            pending.cancel()
+
+    def close(self):
+        """Closes all connections."""
+        for server_address in list(self._pending):
+            self.drop(server_address)
@@ -0,0 +1,55 @@
+"""Sources of task queue servers.
+
+Discovery is a callable that takes no arguments and returns iterable of
+hosts and ports of the servers, it may also be a coroutine function. Q
+polls discovery and adds and removes servers to match it, so capacity can
+change without restarting clients.
+"""
+import os
+
+
+def parse_servers(text):
+    """Parses servers from text with single host:port per line.
+
+    Empty lines and comments starting with # are skipped.
+
+    Returns:
+        List of hosts and ports.
+    Raises:
+        ValueError: Raised when line is not valid server address.
+    """
+    servers = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        host, separator, port = line.rpartition(':')
+        if not separator or not host or not port.isdigit():
+            raise ValueError('Invalid server address: %r' % line)
+        servers.append((host, int(port)))
+    return servers
+
+
+class FileDiscovery:
+    """Discovery that reads servers from file.
+
+    File is parsed again only when it changes.
+
+    Attributes:
+        path: Path to the file.
+        _version: Modification time and size of the file when it was read.
+        _servers: Servers read from the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._version = None
+        self._servers = []
+
+    def __call__(self):
+        stat = os.stat(self.path)
+        version = stat.st_mtime_ns, stat.st_size
+        if version != self._version:
+            with open(self.path, encoding='utf-8') as servers_file:
+                self._servers = parse_servers(servers_file.read())
+            self._version = version
+        return list(self._servers)
@@ -1,31 +1,255 @@
-"""Customized ProcessPoolExecutor."""
+"""Process pool that runs tasks of the server.
+
+Unlike concurrent.futures.ProcessPoolExecutor, the pool can stop task that
+is already running: its worker process is killed and replaced, while other
+workers keep running their tasks. Worker that dies is replaced as well and
+workers are recycled after given number of tasks or when they grow too
+large, so memory leaks of tasks are contained.
+"""
 import concurrent.futures
-import concurrent.futures.process
+import importlib
+import importlib.util
 import multiprocessing
+import queue
+import resource
+import sys
+import threading
+
+from multiprocessing import connection as mp_connection
+
+# Workers are started by fork server, so they don't inherit pipes of other
+# workers and death of the worker is noticed.
+START_METHOD = 'forkserver'
 
 
-def _process_worker(initializer, call_queue, result_queue):
-    """Runs initializer before _process_worker to set signal handlers."""
-    initializer()
-    concurrent.futures.process._process_worker(call_queue, result_queue)  # pylint: disable=protected-access
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
 
 
-class ProcessPoolExecutorWithInit(concurrent.futures.ProcessPoolExecutor):
-    """Process pool executor with initializer.
+class WorkerDiedError(Error):
+    """Raised when worker process exits while running the task."""
+    pass
 
-    Allows executing _initializer on each worker before processing tasks.
+
+def _rss():
+    """Returns resident set size of the current process in bytes.
+
+    Peak resident set size is returned where current one is not known.
     """
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes.
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def _process_worker(initializer, preload, max_rss, conn):
+    """Runs calls received from the pool until it sends None.
+
+    Every result is sent with flag that asks pool to replace the worker,
+    it's set when worker is larger than max_rss bytes.
+    """
+    for module in preload:
+        importlib.import_module(module)
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            call = conn.recv()
+        except EOFError:
+            return
+        if call is None:
+            return
+        func, args, kwargs = call
+        try:
+            succeeded, result = True, func(*args, **kwargs)
+        except BaseException as exc:  # pylint: disable=broad-except
+            succeeded, result = False, exc
+        recycle = max_rss is not None and _rss() > max_rss
+        try:
+            conn.send((succeeded, result, recycle))
+        except Exception as exc:  # pylint: disable=broad-except
+            conn.send((False, exc, recycle))
+
+
+class WorkerPool(concurrent.futures.Executor):
+    """Pool of worker processes.
 
-    def __init__(self, *args, initializer=None, **kwargs):
-        super().__init__(*args, **kwargs)
+    Every worker process is served by its own thread that passes calls to
+    the process and waits for results. Modules that workers need are
+    preloaded by the fork server, so new worker is forked with them
+    already imported and starts in milliseconds.
+
+    Attributes:
+        restarts: Number of worker processes that were replaced because
+                  they died or were killed.
+        recycles: Number of worker processes that were replaced because
+                  they ran max_tasks_per_worker tasks or grew larger than
+                  max_rss.
+        max_tasks_per_worker: Number of tasks after which worker is
+                              replaced or None.
+        max_rss: Resident set size in bytes after which worker is
+                 replaced or None.
+        _max_workers: Number of worker processes.
+        _initializer: Function that is run by every worker process on start.
+        _preload: Names of modules imported by the fork server and by every
+                  worker process on start.
+        _context: Multiprocessing context that starts workers.
+        _calls: Queue of calls that are not started yet.
+        _running: Maps futures of running calls to their worker processes.
+        _killed: Pids of worker processes killed by the pool.
+        _lock: Lock that guards _running and _killed.
+        _shutdown: Whether pool doesn't accept new calls.
+        _threads: Threads that serve worker processes.
+    """
+    def __init__(self, max_workers, initializer=None,
+                 max_tasks_per_worker=None, max_rss=None, preload=()):
+        self.restarts = 0
+        self.recycles = 0
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss = max_rss
+        self._max_workers = max_workers
         self._initializer = initializer
+        for module in preload:
+            if importlib.util.find_spec(module) is None:
+                raise ValueError('Module is not found: %r' % module)
+        self._preload = tuple(preload)
+        self._context = multiprocessing.get_context(START_METHOD)
+        # Takes effect only if fork server is not running yet.
+        self._context.set_forkserver_preload(list(self._preload))
+        self._calls = queue.Queue()
+        self._running = {}
+        self._killed = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._serve, daemon=True)
+            for _ in range(max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):  # pylint: disable=arguments-differ
+        """Schedules call of fn in worker process.
+
+        Returns:
+            concurrent.futures.Future of the call.
+        """
+        if self._shutdown:
+            raise RuntimeError('Cannot schedule new calls after shutdown')
+        future = concurrent.futures.Future()
+        self._calls.put((future, fn, args, kwargs))
+        return future
+
+    def kill(self, future):
+        """Stops the call.
+
+        Call that is not started yet is cancelled. Worker process running
+        the call is killed and replaced with new one, future of the call
+        gets WorkerDiedError.
+        """
+        with self._lock:
+            process = self._running.get(future)
+            if process is None:
+                future.cancel()
+                return
+            self._killed.add(process.pid)
+            process.kill()
+
+    def shutdown(self, wait=True):  # pylint: disable=arguments-differ
+        """Stops worker processes when calls submitted before are done."""
+        self._shutdown = True
+        for _ in self._threads:
+            self._calls.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _start_process(self):
+        """Starts worker process and returns it and pipe to it."""
+        conn, worker_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_process_worker,
+            args=(self._initializer, self._preload, self.max_rss,
+                  worker_conn),
+            daemon=True)
+        process.start()
+        worker_conn.close()
+        return process, conn
+
+    def _serve(self):
+        """Passes calls to worker process, replaces process when it dies or
+        has to be recycled."""
+        process, conn = self._start_process()
+        num_tasks = 0
+        while True:
+            call = self._calls.get()
+            if call is None:
+                break
+            future, func, args, kwargs = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._running[future] = process
+            recycle = False
+            try:
+                succeeded, result, recycle = self._call(
+                    process, conn, func, args, kwargs)
+            except BaseException as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+            else:
+                if succeeded:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+            num_tasks += 1
+            with self._lock:
+                del self._running[future]
+                replace = (process.pid in self._killed or
+                           not process.is_alive())
+                self._killed.discard(process.pid)
+            if not replace and (recycle or (
+                    self.max_tasks_per_worker is not None and
+                    num_tasks >= self.max_tasks_per_worker)):
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                self.recycles += 1
+                replace = True
+            elif replace:
+                self.restarts += 1
+            if replace:
+                conn.close()
+                process.join()
+                process, conn = self._start_process()
+                num_tasks = 0
+        conn.send(None)
+        process.join()
+        conn.close()
+
+    @staticmethod
+    def _call(process, conn, func, args, kwargs):
+        """Runs single call in worker process.
 
-    def _adjust_process_count(self):
-        for _ in range(len(self._processes), self._max_workers):
-            p = multiprocessing.Process(
-                target=_process_worker,
-                args=(self._initializer,
-                      self._call_queue,
-                      self._result_queue))
-            p.start()
-            self._processes[p.pid] = p
+        Returns:
+            Tuple of whether call succeeded, its result or exception and
+            whether worker asks to be replaced.
+        Raises:
+            WorkerDiedError: Raised when process exits before it returns
+                             result.
+        """
+        try:
+            conn.send((func, args, kwargs))
+            mp_connection.wait([conn, process.sentinel])
+            succeeded, result, recycle = (
+                conn.recv() if conn.poll() else (None, None, False))
+        except (EOFError, BrokenPipeError):
+            succeeded = None
+        if succeeded is None:
+            process.join()
+            raise WorkerDiedError(
+                'Worker process exited with code %s' % process.exitcode)
+        return succeeded, result, recycle
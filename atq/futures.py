@@ -0,0 +1,208 @@
+"""concurrent.futures interface of the client for code without asyncio.
+
+QExecutor runs Q in event loop of single background thread, so calling
+threads share its pooled connections and don't start event loop for every
+call. Tasks are submitted to the loop and their results are passed back
+through concurrent.futures.Future.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import queue
+import threading
+import time
+import weakref
+
+from atq import atqclient
+
+# Marks end of results of map.
+_DONE = object()
+
+
+class QExecutor(concurrent.futures.Executor):
+    """Executor that runs calls in the task queue.
+
+    Can replace concurrent.futures.ProcessPoolExecutor, functions and
+    arguments are sent to servers instead of local processes.
+
+    Attributes:
+        q: atqclient.Q that runs the tasks, its event loop runs in the
+           thread of the executor.
+        _loop: Event loop of the thread.
+        _thread: Thread that runs the event loop.
+        _futures: Futures of submitted calls that are not done.
+        _lock: Lock of futures and shutdown flag.
+        _shutdown: Whether executor accepts no new calls.
+    """
+    def __init__(self, workers, **kwargs):
+        """Creates client and starts its thread.
+
+        Args:
+            workers: Hosts and ports of servers.
+            kwargs: Keyword arguments of atqclient.Q.
+        """
+        self.q = atqclient.Q(workers, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._thread = threading.Thread(
+            target=self._run_loop, name='atq-client', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        """Runs event loop until executor is shut down."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+
+    def _start(self, coro):
+        """Runs coroutine in the event loop and returns its future.
+
+        Raises:
+            RuntimeError: Raised when executor is shut down.
+        """
+        with self._lock:
+            if self._shutdown:
+                coro.close()
+                raise RuntimeError(
+                    'cannot schedule new futures after shutdown')
+            future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        """Drops future of the call when it's done."""
+        with self._lock:
+            self._futures.discard(future)
+
+    def submit(self, fn, *args, **kwargs):  # pylint: disable=arguments-differ
+        """Runs fn(*args, **kwargs) in the task queue.
+
+        Keyword arguments of Q.q, like timeout, priority or retry, are
+        accepted too. Cancelling the future before it's done stops the task
+        on the server.
+
+        Returns:
+            concurrent.futures.Future of the result.
+        Raises:
+            RuntimeError: Raised when executor is shut down.
+        """
+        return self._start(self.q.q(fn, *args, **kwargs))
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """Returns iterator over results of fn called with items of
+        iterables, in their order.
+
+        Calls start right away in chunks of chunksize calls, every chunk
+        runs as single task like in Q.map: items of iterables are consumed
+        as chunks finish and at most mapreduce.MAX_CHUNKS_IN_FLIGHT chunks
+        run at once. Results wait in memory until iterator takes them.
+        Closing iterator early, or dropping it, cancels calls that are not
+        done.
+
+        Args:
+            fn: Function to run in the task queue.
+            iterables: Iterables of function arguments.
+            timeout: Seconds from this call to wait for results or None.
+            chunksize: Number of function calls in single task.
+        Raises:
+            RuntimeError: Raised when executor is shut down.
+        """
+        end_time = None if timeout is None else time.monotonic() + timeout
+        results = queue.Queue()
+        driver = self._start(
+            self._collect(self.q.map(fn, *iterables, chunksize=chunksize),
+                          results))
+        driver.add_done_callback(functools.partial(_finish, results))
+        iterator = _iterate(results, driver, end_time)
+        # Generator that is never started doesn't run its finally clause.
+        weakref.finalize(iterator, driver.cancel)
+        return iterator
+
+    @staticmethod
+    async def _collect(items, results):
+        """Passes items of async iterator to the queue as pairs of item and
+        None."""
+        async for item in items:
+            results.put((item, None))
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Stops accepting calls and stops the thread when submitted calls
+        are done.
+
+        Args:
+            wait: Whether to wait until calls are done and thread stops.
+            cancel_futures: Whether to cancel calls that are not done.
+        """
+        with self._lock:
+            if self._shutdown:
+                futures = None
+            else:
+                self._shutdown = True
+                futures = list(self._futures)
+        if futures is not None:
+            if cancel_futures:
+                for future in futures:
+                    future.cancel()
+            asyncio.run_coroutine_threadsafe(self._close(futures), self._loop)
+        if wait:
+            self._thread.join()
+
+    async def _close(self, futures):
+        """Waits for calls, closes connections and stops event loop."""
+        await asyncio.gather(
+            *[asyncio.wrap_future(future) for future in futures],
+            return_exceptions=True)
+        self.q.close()
+        self._loop.stop()
+
+
+def _finish(results, driver):
+    """Passes pair of None and exception or end of items to the queue when
+    driver of map is done.
+
+    Driver may be cancelled before it starts, so it can't do that itself.
+    Cancelled driver ends results with concurrent.futures.CancelledError.
+    """
+    if driver.cancelled():
+        results.put((None, concurrent.futures.CancelledError()))
+    elif driver.exception() is not None:
+        results.put((None, driver.exception()))
+    else:
+        results.put(_DONE)
+
+
+def _iterate(results, driver, end_time):
+    """Yields results of map from the queue.
+
+    Raises:
+        concurrent.futures.TimeoutError: Raised when result is not ready
+                                         by end_time.
+        concurrent.futures.CancelledError: Raised when calls are cancelled
+                                           by shutdown.
+        Exception raised by any call.
+    """
+    try:
+        while True:
+            try:
+                result = results.get(timeout=(
+                    None if end_time is None
+                    else max(end_time - time.monotonic(), 0)))
+            except queue.Empty:
+                raise concurrent.futures.TimeoutError from None
+            if result is _DONE:
+                return
+            result, exc = result
+            if exc is not None:
+                raise exc
+            yield result
+    finally:
+        driver.cancel()
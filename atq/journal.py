@@ -0,0 +1,203 @@
+"""Journal of tasks accepted and completed by the server.
+
+Server started with journal appends record to the log file when it accepts
+task that has id and when the task completes, so server restarted after
+crash can tell clients which tasks it completed before. Records are written
+by single background flush that calls fsync once for all records appended
+while previous flush was running, so concurrent tasks share fsync instead
+of waiting for their own. Task completes only when its record is on disk,
+accepted record is written with the next flush and nobody waits for it.
+
+Journal remembers the last max_completed completed tasks, ids of older ones
+are forgotten. File is compacted when it's opened and when it grows to
+COMPACTION_FACTOR times that many records: it's rewritten with completed
+records that are remembered only, so it stays bounded too.
+"""
+import asyncio
+import logging
+import os
+import struct
+import time
+
+from atq import protocol
+
+# State, id of the task and time of the record as returned by time.time.
+RECORD = struct.Struct('!B%dsd' % protocol.TASK_ID_SIZE)
+
+# States of tasks in records, task that raised exception is completed too.
+ACCEPTED = 1
+COMPLETED = 2
+
+# Number of completed tasks remembered by default, they take about 100 bytes
+# of memory and 25 bytes of the file each.
+MAX_COMPLETED = 100000
+# File is compacted when it has that many times more records than the
+# number of remembered tasks.
+COMPACTION_FACTOR = 2
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class NoJournalError(Error):
+    """Raised when server that has no journal is asked about tasks."""
+    pass
+
+
+def read_records(path):
+    """Reads records from the journal file.
+
+    Record that is cut short by crash is ignored.
+
+    Returns:
+        List of records, each one is tuple of state, task id and time.
+    """
+    try:
+        with open(path, 'rb') as journal_file:
+            data = journal_file.read()
+    except FileNotFoundError:
+        return []
+    end = len(data) - len(data) % RECORD.size
+    return list(RECORD.iter_unpack(data[:end]))
+
+
+class Journal:
+    """Append-only log of tasks.
+
+    Attributes:
+        path: Path of the journal file.
+        max_completed: Number of completed tasks that are remembered.
+        completed: Maps ids of remembered completed tasks, including tasks
+                   completed before restart, to their completion time in
+                   order of completion.
+        records: Number of records written since the journal is opened.
+        syncs: Number of fsync calls, records / syncs is average batch.
+        compactions: Number of times the file was rewritten since the
+                     journal is opened.
+        _file: Journal file opened for appending.
+        _size: Number of records in the file.
+        _pending: Packed records waiting for the next flush.
+        _waiters: Futures of coroutines that wait for the next flush.
+        _flush_task: Task that writes records or None if it's idle.
+    """
+    def __init__(self, path, max_completed=MAX_COMPLETED):
+        self.path = path
+        self.max_completed = max_completed
+        self.completed = {}
+        for state, task_id, completed in read_records(path):
+            if state == COMPLETED:
+                self._remember(task_id, completed)
+        self._file, self._size = None, 0
+        # Drops accepted, forgotten and torn records.
+        self._rewrite(self._pack_completed())
+        self.records = self.syncs = self.compactions = 0
+        self._pending, self._waiters = [], []
+        self._flush_task = None
+
+    def _remember(self, task_id, completed):
+        """Adds completed task and forgets the oldest one if there are too
+        many."""
+        self.completed.pop(task_id, None)
+        self.completed[task_id] = completed
+        if len(self.completed) > self.max_completed:
+            del self.completed[next(iter(self.completed))]
+
+    def _pack_completed(self):
+        """Returns packed records of remembered completed tasks."""
+        return b''.join(RECORD.pack(COMPLETED, task_id, completed)
+                        for task_id, completed in self.completed.items())
+
+    def append(self, state, task_id):
+        """Appends record of the task, it's written by background flush."""
+        now = time.time()
+        self._pending.append(RECORD.pack(state, task_id, now))
+        if state == COMPLETED:
+            self._remember(task_id, now)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def sync(self):
+        """Waits until records appended so far are on disk.
+
+        Raises:
+            OSError: Raised when records can't be written.
+        """
+        if self._flush_task is None:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        await waiter
+
+    async def _flush(self):
+        """Writes pending records until there are none left.
+
+        File that grows too large is rewritten with completed tasks
+        instead, they include completed tasks of pending records.
+        """
+        try:
+            while self._pending or self._waiters:
+                data, self._pending = b''.join(self._pending), []
+                waiters, self._waiters = self._waiters, []
+                compact = (self._size + len(data) // RECORD.size >
+                           COMPACTION_FACTOR * self.max_completed)
+                if compact:
+                    data = self._pack_completed()
+                try:
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self._rewrite if compact else self._write,
+                        data)
+                except OSError as exc:
+                    logging.error("Can't write journal %s: %s", self.path,
+                                  str(exc))
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(exc)
+                    continue
+                self.records += len(data) // RECORD.size
+                self.syncs += 1
+                if compact:
+                    self.compactions += 1
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self._flush_task = None
+
+    def _write(self, data):
+        """Appends packed records to the file and syncs it, runs in thread."""
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data) // RECORD.size
+
+    def _rewrite(self, data):
+        """Replaces the file with packed records, runs in thread.
+
+        New file is synced before it replaces the old one, so crash leaves
+        one of them whole.
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)),
+                            os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'ab')
+        self._size = len(data) // RECORD.size
+
+    def close(self):
+        """Writes pending records and closes the file."""
+        data, self._pending = b''.join(self._pending), []
+        if data:
+            self._write(data)
+        self._file.close()
@@ -0,0 +1,211 @@
+"""Running functions over iterables in the task queue.
+
+Items are grouped into chunks that run as single tasks, at most
+MAX_CHUNKS_IN_FLIGHT chunks run at once, so iterables are consumed lazily.
+"""
+import asyncio
+import functools
+import itertools
+
+from atq import protocol
+from atq import tasks
+
+MAX_CHUNKS_IN_FLIGHT = 64
+# Number of partial results combined by single reduce task.
+REDUCE_FANIN = 8
+
+
+def _combine(mapper, reducer, chunk):
+    """Maps items of the chunk and combines results, runs on the server."""
+    return functools.reduce(reducer, map(mapper, chunk))
+
+
+def _reduce(reducer, values):
+    """Combines partial results, runs on the server."""
+    return functools.reduce(reducer, values)
+
+
+def _chunked(iterable, chunksize):
+    """Splits iterable into lists of chunksize items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _ReduceTree:
+    """Tree of reduce tasks that grows as partial results are added.
+
+    Attributes:
+        handles: Handles of all partial results of the tree, including
+                 results of reduce tasks.
+        _reduce: Function that starts task that reduces list of handles
+                 and returns its handle.
+        _fanin: Number of partial results reduced by single task.
+        _levels: Handles of partial results that are not reduced yet by
+                 level of the tree, upper levels cover earlier items.
+    """
+    def __init__(self, reduce, fanin):
+        self.handles = []
+        self._reduce, self._fanin = reduce, fanin
+        self._levels = []
+
+    def add(self, handle, level=0):
+        """Adds partial result, reduces level once it has fanin of them."""
+        self.handles.append(handle)
+        if level == len(self._levels):
+            self._levels.append([])
+        self._levels[level].append(handle)
+        if len(self._levels[level]) == self._fanin:
+            handles, self._levels[level] = self._levels[level], []
+            self.add(self._reduce(handles), level + 1)
+
+    def root(self):
+        """Reduces the rest of every level and returns handle of the final
+        result, tree must not be empty."""
+        handle = None
+        for handles in self._levels:
+            # Rest of lower level covers later items than rest of upper one.
+            if handle is not None:
+                handles.append(handle)
+            if len(handles) > 1:
+                handle = self._reduce(handles)
+                self.handles.append(handle)
+            elif handles:
+                handle = handles[0]
+        return handle
+
+
+class MapReduce:
+    """Base class of Q that runs functions over iterables.
+
+    Chunks run through Q._execute, partial results of map_reduce stay on
+    the servers as results of Q.submit until Q.release drops them.
+    """
+    async def map_reduce(self, mapper, reducer, iterable, chunksize=1,
+                         fanin=REDUCE_FANIN, priority=0,
+                         queue=protocol.DEFAULT_QUEUE, executor=None,
+                         retry=False):
+        """Maps items of iterable and reduces results on the servers.
+
+        Every chunk of items is mapped and combined with reducer by single
+        task. Partial results stay on the servers and are reduced by tree
+        of tasks, fanin of them at a time, so levels of the tree run in
+        parallel and only the final result goes back to the client.
+        Partial results are released when done. At most
+        MAX_CHUNKS_IN_FLIGHT chunks are mapped at once, so iterable is
+        consumed lazily, and every fanin partial results are reduced as
+        soon as they are started.
+
+        Args:
+            mapper: Function called with every item.
+            reducer: Function that combines two results, it must be
+                     associative. Results are combined in order of items.
+            iterable: Iterable of items.
+            chunksize: Number of items in single map task.
+            fanin: Number of partial results combined by single task.
+            priority: Priority of tasks in their queue on the server.
+            queue: Name of the queue of tasks on the server.
+            executor: Executor of tasks on the server or None.
+            retry: Whether tasks may run again on another server when
+                   connection is lost.
+        Returns:
+            Reduced result.
+        Raises:
+            TypeError: Raised when iterable is empty.
+            ValueError: Raised when fanin is less than 2.
+        """
+        if fanin < 2:
+            raise ValueError('Fanin must be at least 2, got %r' % fanin)
+        options = {'priority': priority, 'queue': queue, 'executor': executor,
+                   'retry': retry}
+        tree = _ReduceTree(
+            lambda handles: self.submit(_reduce, reducer, handles, **options),
+            fanin)
+        chunks, mapping = _chunked(iterable, chunksize), set()
+        try:
+            while True:
+                while len(mapping) >= MAX_CHUNKS_IN_FLIGHT:
+                    done, mapping = await asyncio.wait(
+                        mapping, return_when=asyncio.FIRST_COMPLETED)
+                    for producer in done:
+                        producer.result()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                handle = self.submit(_combine, mapper, reducer, chunk,
+                                     **options)
+                mapping.add(handle.producer)
+                tree.add(handle)
+            if not tree.handles:
+                raise TypeError('map_reduce() of empty iterable')
+            return await tree.root()
+        finally:
+            for handle in tree.handles:
+                if not handle.done():
+                    handle.producer.cancel()
+            await asyncio.gather(
+                *[self.release(handle) for handle in tree.handles])
+
+    def map(self, func, *iterables, chunksize=1, ordered=True, priority=0,
+            queue=protocol.DEFAULT_QUEUE, executor=None, retry=False):
+        """Runs function over items of iterables in the task queue.
+
+        Same as starmap(func, zip(*iterables), ...).
+        """
+        return self.starmap(
+            func, zip(*iterables), chunksize=chunksize, ordered=ordered,
+            priority=priority, queue=queue, executor=executor, retry=retry)
+
+    async def starmap(self, func, iterable, chunksize=1, ordered=True,
+                      priority=0, queue=protocol.DEFAULT_QUEUE,
+                      executor=None, retry=False):
+        """Runs function over argument tuples in the task queue.
+
+        Arguments are grouped into chunks, every chunk is sent as single
+        task and run by single worker call. At most MAX_CHUNKS_IN_FLIGHT
+        chunks are run at once, so iterable is consumed lazily.
+
+        Args:
+            func: Function to run in task queue.
+            iterable: Iterable of tuples of function arguments.
+            chunksize: Number of function calls in single task.
+            ordered: Whether results are yielded in order of arguments or
+                     as soon as their chunks complete.
+            priority: Priority of chunks in their queue on the server.
+            queue: Name of the queue of chunks on the server.
+            executor: Executor of chunks on the server or None.
+            retry: Whether chunks may run again on another server when
+                   connection is lost.
+        Yields:
+            Function results. Exception raised by any call is reraised
+            and remaining chunks are cancelled.
+        """
+        func_name = tasks.name_of(func)
+        options = tasks.pack_options(func, priority, queue, executor)
+        chunks = _chunked(iterable, chunksize)
+        in_flight = []
+        try:
+            while True:
+                for chunk in itertools.islice(
+                        chunks, MAX_CHUNKS_IN_FLIGHT - len(in_flight)):
+                    in_flight.append(asyncio.ensure_future(self._execute(
+                        func, tasks.ChunkTask(None, func_name, chunk),
+                        options=options, retry=retry)))
+                if not in_flight:
+                    return
+                if ordered:
+                    done = [in_flight.pop(0)]
+                    await done[0]
+                else:
+                    done, _ = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    in_flight = [f for f in in_flight if f not in done]
+                for future in done:
+                    for result in future.result():
+                        yield result
+        finally:
+            for future in in_flight:
+                future.cancel()
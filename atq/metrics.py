@@ -0,0 +1,254 @@
+"""Metrics of task queue server in Prometheus text format."""
+import asyncio
+import bisect
+import math
+
+# Upper bounds of histogram buckets in seconds.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10,
+           60, math.inf)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    """Escapes label value."""
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_value(value):
+    """Formats sample value."""
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_sample(name, labels, value):
+    """Formats single sample line."""
+    if labels:
+        name += '{%s}' % ','.join(
+            '%s="%s"' % (label, _escape(label_value))
+            for label, label_value in labels)
+    return '%s %s' % (name, _format_value(value))
+
+
+class Counter:
+    """Value that only grows.
+
+    Attributes:
+        name: Name of the metric.
+        help_text: Description of the metric.
+        label_names: Names of labels of the metric.
+        _values: Maps tuple of label values to the value.
+    """
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text = name, help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        """Adds amount to the value."""
+        self._values[label_values] = (
+            self._values.get(label_values, 0) + amount)
+
+    def set(self, value, *label_values):
+        """Sets the value, used for values counted elsewhere."""
+        self._values[label_values] = value
+
+    def get(self, *label_values):
+        """Returns the value."""
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        """Yields name, labels and value of every sample."""
+        if not self._values and not self.label_names:
+            yield self.name, (), 0
+        for label_values, value in sorted(self._values.items()):
+            yield self.name, tuple(zip(self.label_names, label_values)), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    type_name = 'gauge'
+
+
+class Histogram:
+    """Distribution of observed values.
+
+    Attributes:
+        name: Name of the metric.
+        help_text: Description of the metric.
+        label_names: Names of labels of the metric.
+        buckets: Sorted upper bounds of buckets, the last one is infinity.
+        _values: Maps tuple of label values to list of bucket counts, sum
+                 and count of observations.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=BUCKETS):
+        self.name, self.help_text = name, help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        """Adds observation."""
+        counts, total, count = self._values.get(
+            label_values, ([0] * len(self.buckets), 0, 0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[label_values] = counts, total + value, count + 1
+
+    def samples(self):
+        """Yields name, labels and value of every sample."""
+        for label_values, (counts, total, count) in sorted(
+                self._values.items()):
+            labels = tuple(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket',
+                       labels + (('le', _format_value(float(bound))),),
+                       cumulative)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+    """Collection of metrics.
+
+    Attributes:
+        _metrics: Registered metrics in order of registration.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        """Registers and returns new counter."""
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        """Registers and returns new gauge."""
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=BUCKETS):
+        """Registers and returns new histogram."""
+        return self._register(
+            Histogram(name, help_text, label_names, buckets))
+
+    def _register(self, metric):
+        """Adds metric to the registry."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns all metrics in Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help_text))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            lines.extend(_format_sample(*sample)
+                         for sample in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+async def serve(reader, writer, render):
+    """Answers single HTTP request for metrics.
+
+    Args:
+        reader: asyncio.StreamReader of the connection.
+        writer: asyncio.StreamWriter of the connection.
+        render: Function that returns metrics in text format.
+    """
+    try:
+        request = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError):
+        writer.close()
+        return
+    path = (request.split(b' ') + [b''])[1].split(b'?')[0]
+    if path in (b'/', b'/metrics'):
+        status, body = '200 OK', render().encode()
+    else:
+        status, body = '404 Not Found', b''
+    writer.write((
+        'HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+        'Connection: close\r\n\r\n' % (
+            status, CONTENT_TYPE, len(body))).encode() + body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+class ServerMetrics(Registry):
+    """Metrics of task queue server.
+
+    Tasks are single and cached calls, streams are counted separately.
+    Bytes are counted in payloads of messages.
+    """
+    def __init__(self):
+        super().__init__()
+        self.tasks_received = self.counter(
+            'atq_tasks_received_total', 'Tasks received from clients.')
+        self.tasks_completed = self.counter(
+            'atq_tasks_completed_total', 'Tasks completed by workers.',
+            ('function',))
+        self.tasks_failed = self.counter(
+            'atq_tasks_failed_total', 'Tasks that raised exception.',
+            ('function',))
+        self.tasks_rejected = self.counter(
+            'atq_tasks_rejected_total',
+            'Tasks and streams rejected because server is busy.')
+        self.tasks_offloaded = self.counter(
+            'atq_tasks_offloaded_total', 'Tasks run by peer servers.')
+        self.cache_hits = self.counter(
+            'atq_cache_hits_total',
+            'Cached tasks answered without running worker.')
+        self.streams_received = self.counter(
+            'atq_streams_received_total', 'Streams received from clients.')
+        self.queue_depth = self.gauge(
+            'atq_queue_depth', 'Tasks and streams queued or running.')
+        self.queued_tasks = self.gauge(
+            'atq_queued_tasks', 'Tasks and streams waiting for free worker.',
+            ('queue',))
+        self.executor_wait = self.histogram(
+            'atq_executor_wait_seconds',
+            'Time between submitting task and start of its execution.')
+        self.execution_time = self.histogram(
+            'atq_execution_seconds', 'Execution time of tasks.',
+            ('function',))
+        self.bytes_received = self.counter(
+            'atq_received_bytes_total', 'Bytes received from clients.')
+        self.bytes_sent = self.counter(
+            'atq_sent_bytes_total', 'Bytes sent to clients.')
+        self.compression_raw_bytes = self.counter(
+            'atq_compression_raw_bytes_total',
+            'Size of compressed messages before compression.')
+        self.compression_compressed_bytes = self.counter(
+            'atq_compression_compressed_bytes_total',
+            'Size of compressed messages on the wire.')
+        self.compression_time = self.counter(
+            'atq_compression_cpu_seconds_total',
+            'CPU time of compression of messages.', ('operation',))
+        self.stored_objects = self.gauge(
+            'atq_stored_objects', 'Objects put by clients.')
+        self.object_store_bytes = self.gauge(
+            'atq_object_store_bytes', 'Size of objects put by clients.')
+        self.journal_records = self.counter(
+            'atq_journal_records_total', 'Records written to the journal.')
+        self.journal_syncs = self.counter(
+            'atq_journal_syncs_total',
+            'Writes of batches of records to the journal.')
+        self.journal_compactions = self.counter(
+            'atq_journal_compactions_total',
+            'Rewrites of the journal with remembered completed tasks.')
+        self.worker_restarts = self.counter(
+            'atq_worker_restarts_total',
+            'Worker processes replaced because they died or were killed.')
+        self.worker_recycles = self.counter(
+            'atq_worker_recycles_total',
+            'Worker processes replaced after too many tasks or too much '
+            'memory.')
@@ -0,0 +1,283 @@
+"""Objects stored on servers and referenced by tasks.
+
+Large object that many tasks use is put on servers once and tasks get
+ObjectRef instead of the object. Ref is pickled as id of the object only
+and is resolved to the object when worker unpickles the task. Workers keep
+recently used objects deserialized, so object is read once per worker.
+
+Server keeps objects in shared memory, so they are passed to worker
+processes without copying. Object is dropped when client releases it, when
+it's not used for its time to live or when store is full, least recently
+used first. Dropped object stays in memory until tasks that use it finish.
+"""
+import os
+import time
+
+from collections import OrderedDict
+
+from atq import cache
+from atq import protocol
+from atq import transfer
+
+OBJECT_STORE_SIZE = 1024 ** 3  # bytes
+OBJECT_TTL = 3600  # seconds
+# Number of deserialized objects kept by every worker, all objects of the
+# task are kept while it's unpickled.
+WORKER_CACHE_SIZE = 16
+
+_MISSING = object()
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class ObjectTooLargeError(Error):
+    """Raised when object is larger than the store."""
+    pass
+
+
+class ObjectNotFoundError(Error):
+    """Raised when object is not stored where it's looked for."""
+    pass
+
+
+class ObjectRef:
+    """Reference to object stored on servers.
+
+    Attributes:
+        object_id: Unique id of the object.
+        size: Size of serialized object in bytes.
+    """
+    def __init__(self, object_id, size):
+        self.object_id, self.size = object_id, size
+
+    def __reduce__(self):
+        return resolve, (self.object_id,)
+
+    def __repr__(self):
+        return '<ObjectRef %s>' % self.object_id.hex()
+
+
+class TaskHandle(ObjectRef):
+    """Pending result of the task started by Q.submit.
+
+    Result stays on the server that ran the task. Handle is passed to other
+    tasks like objects.ObjectRef and awaiting it fetches the result.
+
+    Attributes:
+        producer: Future of the task, its result is size of the stored
+                  result.
+        _client: Q that started the task.
+    """
+    def __init__(self, object_id, client, producer):
+        super().__init__(object_id, None)
+        self.producer = producer
+        self._client = client
+
+    def __await__(self):
+        return self._client.get(self).__await__()
+
+    def done(self):
+        """Whether task is finished."""
+        return self.producer.done()
+
+
+class ClientObject:
+    """Object put by the client or result of the task started by the
+    client, kept until its ref is released.
+
+    Attributes:
+        parts: Serialized object or None for result of the task.
+        size: Size of serialized object in bytes.
+        servers: Servers that object is uploaded to or stored on.
+        uploads: Maps server to task that uploads object to it.
+        producer: Future of the task that computes the object or None.
+    """
+    def __init__(self, parts, producer=None):
+        self.parts = parts
+        self.size = sum(len(part) for part in parts or ())
+        self.servers = set()
+        self.uploads = {}
+        self.producer = producer
+
+
+def new_id():
+    """Returns id of new object."""
+    return os.urandom(protocol.OBJECT_ID_SIZE)
+
+
+def find_refs(values):
+    """Returns ids of objects referenced by values.
+
+    Refs are looked for in values and in lists, tuples, sets and dicts
+    inside them.
+    """
+    refs, stack = {}, list(values)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ObjectRef):
+            refs[value.object_id] = None
+        elif isinstance(value, dict):
+            stack.extend(value.items())
+        elif type(value) in (list, tuple, set, frozenset):  # pylint: disable=unidiomatic-typecheck
+            stack.extend(value)
+    return list(refs)
+
+
+# Objects deserialized by the worker.
+_loaded = cache.LRUCache(WORKER_CACHE_SIZE)
+
+
+def load(stored_objects):
+    """Deserializes objects of the task that worker doesn't have yet.
+
+    Not thread safe, objects must stay loaded until the task is unpickled,
+    so worker that loads tasks in threads holds its lock over both.
+
+    Args:
+        stored_objects: Pairs of object id and payload as returned by
+                        transfer.share.
+    """
+    _loaded.maxsize = max(WORKER_CACHE_SIZE, len(stored_objects))
+    for object_id, payload in stored_objects:
+        if _loaded.get(object_id, _MISSING) is _MISSING:
+            _loaded.put(object_id, transfer.loads(payload))
+
+
+def resolve(object_id):
+    """Returns object loaded by the worker, called when ref is unpickled.
+
+    Raises:
+        ObjectNotFoundError: Raised when object is not loaded.
+    """
+    obj = _loaded.get(object_id, _MISSING)
+    if obj is _MISSING:
+        raise ObjectNotFoundError(
+            'Object %s is not found, refs must be task arguments or be '
+            'inside lists, tuples, sets or dicts' % object_id.hex())
+    return obj
+
+
+class StoredObject:
+    """Object kept by the server.
+
+    Attributes:
+        object_id: Id of the object.
+        payload: Serialized object as returned by transfer.share.
+        size: Size of serialized object in bytes.
+        pins: Number of tasks that use the object.
+        expires_at: Time when object is dropped unless it's used.
+        dropped: Whether object is removed from the store.
+    """
+    def __init__(self, object_id, payload, size):
+        self.object_id, self.payload, self.size = object_id, payload, size
+        self.pins = 0
+        self.expires_at = 0
+        self.dropped = False
+
+
+class ObjectStore:
+    """Objects put by clients.
+
+    Attributes:
+        max_size: Least recently used objects are dropped when total size
+                  of objects exceeds that.
+        ttl: Number of seconds after last use when object is dropped.
+        size: Total size of stored objects.
+        _objects: Ordered dict of objects, recently used ones at the end.
+    """
+    def __init__(self, max_size=OBJECT_STORE_SIZE, ttl=OBJECT_TTL):
+        self.max_size, self.ttl = max_size, ttl
+        self.size = 0
+        self._objects = OrderedDict()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def put(self, object_id, data):
+        """Stores object, object that is stored already is kept.
+
+        Raises:
+            ObjectTooLargeError: Raised when object is larger than the
+                                 store.
+        """
+        if len(data) > self.max_size:
+            raise ObjectTooLargeError(
+                'Object is larger than %s bytes' % self.max_size)
+        stored = self._objects.get(object_id)
+        if stored is None:
+            stored = self._objects[object_id] = StoredObject(
+                object_id, transfer.share(data), len(data))
+            self.size += stored.size
+        self._touch(stored)
+        while self.size > self.max_size:
+            self._drop(next(iter(self._objects.values())))
+
+    def read(self, object_id):
+        """Returns serialized object or None if it's not stored."""
+        self._expire()
+        stored = self._objects.get(object_id)
+        if stored is None:
+            return None
+        self._touch(stored)
+        return transfer.copy(stored.payload)
+
+    def release(self, object_id):
+        """Drops object."""
+        stored = self._objects.get(object_id)
+        if stored is not None:
+            self._drop(stored)
+
+    def missing(self, object_ids):
+        """Returns ids of objects that are not stored."""
+        self._expire()
+        return [object_id for object_id in object_ids
+                if object_id not in self._objects]
+
+    def pin(self, object_ids):
+        """Returns stored objects, they are kept until unpinned.
+
+        All objects must be stored, see missing.
+        """
+        pinned = [self._objects[object_id] for object_id in object_ids]
+        for stored in pinned:
+            stored.pins += 1
+            self._touch(stored)
+        return pinned
+
+    @staticmethod
+    def unpin(pinned):
+        """Frees memory of pinned objects that are dropped and not used."""
+        for stored in pinned:
+            stored.pins -= 1
+            if stored.dropped and not stored.pins:
+                transfer.discard(stored.payload)
+
+    def clear(self):
+        """Drops all objects."""
+        for stored in list(self._objects.values()):
+            self._drop(stored)
+
+    def _touch(self, stored):
+        """Marks object as recently used."""
+        stored.expires_at = time.monotonic() + self.ttl
+        self._objects.move_to_end(stored.object_id)
+
+    def _expire(self):
+        """Drops objects that are not used for their time to live."""
+        now = time.monotonic()
+        while self._objects:
+            stored = next(iter(self._objects.values()))
+            if stored.expires_at > now:
+                return
+            self._drop(stored)
+
+    def _drop(self, stored):
+        """Removes object, its memory is freed when it's not used."""
+        del self._objects[stored.object_id]
+        self.size -= stored.size
+        stored.dropped = True
+        if not stored.pins:
+            transfer.discard(stored.payload)
@@ -0,0 +1,442 @@
+"""atq wire protocol.
+
+Client and server exchange length-prefixed frames over long-lived
+connections. Every frame carries request id, so many tasks can share
+single connection and responses may arrive out of order. Large messages
+are split into several frames, so they don't block other messages on the
+same connection.
+"""
+import asyncio
+import hashlib
+import struct
+
+from atq import compression
+
+# Payload length, request id, message type.
+HEADER = struct.Struct('!IQB')
+
+# Set in message type of all frames of the message except the last one.
+MORE = 0x80
+# Set in message type of all frames of compressed message.
+COMPRESSED = 0x40
+
+FRAME_SIZE = 256 * 1024  # bytes
+MAX_MESSAGE_SIZE = 4 * 1024 ** 3  # bytes
+
+# Request id of messages that don't expect response.
+NO_RESPONSE = 0
+
+# Message types.
+TASK = 1
+RESULT = 2
+# Response to register is result with None or exception raised by the
+# server, like MessageTooLargeError for function that is too large.
+REGISTER = 3
+UNKNOWN_FUNCTION = 4
+STREAM = 5
+STREAM_ITEM = 6
+STREAM_END = 7
+ACK = 8
+CANCEL = 9
+CACHED_TASK = 10
+BUSY = 11
+PING = 12
+PONG = 13
+# Task passed by another server, it has the same payload as task, but is
+# never offloaded again.
+OFFLOADED_TASK = 14
+# Handshake: client sends name of serializer it wants to use and names of
+# codecs it can compress messages with, server answers with names of
+# serializers it accepts and name of codec that both sides use, empty if
+# messages are not compressed. Names are separated by commas, serializers
+# and codecs by semicolon.
+HELLO = 15
+# Object store: client puts object, payload is id of the object followed by
+# serialized object, and gets result with None or exception raised by the
+# store. Released object is dropped, release expects no response.
+PUT = 16
+RELEASE = 17
+# Response to task that refers to objects the server doesn't have, payload
+# is ids of missing objects.
+UNKNOWN_OBJECT = 18
+# Task whose result is stored on the server as object, payload has id of
+# the object after task options. Response is result with size of stored
+# result or exception raised by the task.
+STORED_TASK = 19
+# Server gets object from another server, payload is id of the object
+# followed by HOST:PORT of that server. Response is the same as for PUT.
+FETCH = 20
+# Payload is id of the object, response is result with serialized object
+# or UNKNOWN_OBJECT.
+GET = 21
+# Payload is ids of tasks, response is result with list of ids of those
+# tasks that the server completed according to its journal or exception if
+# server has no journal.
+COMPLETED_TASKS = 22
+
+# Result, busy and pong payloads start with load report: number of workers
+# and number of tasks on the server.
+LOAD_REPORT = struct.Struct('!HI')
+
+# Ack payload is number of stream items consumed by the client.
+ACK_COUNT = struct.Struct('!I')
+
+# Maximum number of stream items sent and not acked by the client.
+STREAM_WINDOW = 16
+
+# Task, cached task and stream payloads start with task options: priority,
+# executor and length of the queue name, followed by the name. Executor is
+# index in EXECUTORS plus one, zero means default executor of the server.
+TASK_OPTIONS = struct.Struct('!iBB')
+DEFAULT_QUEUE = 'default'
+
+# Set in executor of task options when the name is followed by number of
+# objects used by the task and their ids.
+REFS = 0x80
+REF_COUNT = struct.Struct('!H')
+OBJECT_ID_SIZE = 16
+# Set in executor of task options when they end with id of the task that
+# the client keeps across retries, server journals tasks by it.
+TASK_ID = 0x40
+TASK_ID_SIZE = 16
+
+# Executors that run tasks on the server: worker processes, threads of the
+# server process and event loop of the server for coroutine functions.
+PROCESS = 'process'
+THREAD = 'thread'
+ASYNC = 'async'
+EXECUTORS = (PROCESS, THREAD, ASYNC)
+
+# Task and register payloads then go on with id of the function.
+FUNCTION_ID_SIZE = hashlib.sha1().digest_size
+
+# Cached task payload has key of the result after task options, followed by
+# the rest of task payload.
+CACHE_KEY_SIZE = hashlib.sha1().digest_size
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class MessageTooLargeError(Error):
+    """Raised when message exceeds maximum message size."""
+    def __init__(self, request_id, max_size):
+        super().__init__(request_id, max_size)
+        self.request_id, self.max_size = request_id, max_size
+
+    def __str__(self):
+        return 'Message is larger than %s bytes' % self.max_size
+
+
+class FrameTooLargeError(Error):
+    """Raised when frame is larger than FRAME_SIZE, stream can't be read
+    any further."""
+    def __init__(self, length):
+        super().__init__(length)
+        self.length = length
+
+    def __str__(self):
+        return 'Frame of %s bytes is larger than %s bytes' % (
+            self.length, FRAME_SIZE)
+
+
+class DecompressionError(Error):
+    """Raised when compressed message can't be decompressed."""
+    def __init__(self, request_id, reason):
+        super().__init__(request_id, reason)
+        self.request_id, self.reason = request_id, reason
+
+    def __str__(self):
+        return "Message can't be decompressed: %s" % self.reason
+
+
+def pack_hello(serializer_names, codec_names):
+    """Returns payload of handshake message."""
+    return ('%s;%s' % (','.join(serializer_names),
+                       ','.join(codec_names))).encode()
+
+
+def unpack_hello(payload):
+    """Returns two lists of names from handshake payload."""
+    serializer_names, _, codec_names = bytes(payload).decode().partition(';')
+    return ([name for name in serializer_names.split(',') if name],
+            [name for name in codec_names.split(',') if name])
+
+
+def function_id(serialized_func):
+    """Returns id of serialized function derived from its content."""
+    return hashlib.sha1(serialized_func).digest()
+
+
+def cache_key(func_id, serialized_args):
+    """Returns key of cached result of the function called with arguments."""
+    return hashlib.sha1(func_id + serialized_args).digest()
+
+
+def pack_options(priority=0, queue=DEFAULT_QUEUE, executor=None,
+                 refs=(), task_id=None):
+    """Returns task options that start task payload.
+
+    Args:
+        priority: Priority of the task in its queue.
+        queue: Name of the queue of the task.
+        executor: One of EXECUTORS or None for default executor of the
+                  server.
+        refs: Ids of stored objects used by the task.
+        task_id: Id of the task or None.
+    Raises:
+        ValueError: Raised when queue name is longer than 255 bytes or
+                    executor is unknown.
+    """
+    name = queue.encode()
+    if len(name) > 255:
+        raise ValueError('Queue name is too long: %r' % queue)
+    if executor is not None and executor not in EXECUTORS:
+        raise ValueError('Unknown executor: %r' % executor)
+    executor_index = 0 if executor is None else EXECUTORS.index(executor) + 1
+    return extend_options(
+        TASK_OPTIONS.pack(priority, executor_index, len(name)) + name, refs,
+        task_id)
+
+
+def extend_options(options, refs=(), task_id=None):
+    """Returns packed task options with ids of stored objects and id of
+    the task added.
+
+    Options must not have them already.
+
+    Raises:
+        ValueError: Raised when task uses too many objects.
+    """
+    if not refs and task_id is None:
+        return options
+    if len(refs) >= 2 ** (8 * REF_COUNT.size):
+        raise ValueError('Task uses too many objects: %d' % len(refs))
+    # Executor is the second to last field of the options.
+    flags = TASK_OPTIONS.size - 2
+    executor_index, extra = options[flags], []
+    if refs:
+        executor_index |= REFS
+        extra = [REF_COUNT.pack(len(refs))] + list(refs)
+    if task_id is not None:
+        executor_index |= TASK_ID
+        extra.append(task_id)
+    return b''.join([options[:flags], bytes((executor_index,)),
+                     options[flags + 1:]] + extra)
+
+
+def unpack_options(payload):
+    """Returns task options and the rest of task payload.
+
+    Options are tuple of priority, queue name, executor or None, list of
+    ids of stored objects used by the task and id of the task or None.
+    """
+    priority, executor_index, length = TASK_OPTIONS.unpack_from(payload)
+    end = TASK_OPTIONS.size + length
+    queue = bytes(payload[TASK_OPTIONS.size:end]).decode()
+    refs = []
+    if executor_index & REFS:
+        executor_index &= ~REFS
+        count, = REF_COUNT.unpack_from(payload, end)
+        end += REF_COUNT.size
+        refs = split_ids(payload[end:end + count * OBJECT_ID_SIZE])
+        end += count * OBJECT_ID_SIZE
+    task_id = None
+    if executor_index & TASK_ID:
+        executor_index &= ~TASK_ID
+        task_id = bytes(payload[end:end + TASK_ID_SIZE])
+        end += TASK_ID_SIZE
+    executor = (EXECUTORS[executor_index - 1]
+                if 0 < executor_index <= len(EXECUTORS) else None)
+    return ((priority, queue, executor, refs, task_id),
+            memoryview(payload)[end:])
+
+
+def split_ids(payload):
+    """Returns list of object ids packed one after another."""
+    return [bytes(payload[i:i + OBJECT_ID_SIZE])
+            for i in range(0, len(payload), OBJECT_ID_SIZE)]
+
+
+async def read_frame(reader):
+    """Reads single frame from the stream.
+
+    Args:
+        reader: asyncio.StreamReader to read frame from.
+    Returns:
+        Tuple of request id, message type and payload.
+    Raises:
+        asyncio.IncompleteReadError: Raised when stream ends before whole
+                                     frame is read.
+        FrameTooLargeError: Raised when frame is larger than FRAME_SIZE,
+                            its payload is not read.
+    """
+    header = await reader.readexactly(HEADER.size)
+    length, request_id, msg_type = HEADER.unpack(header)
+    if length > FRAME_SIZE:
+        raise FrameTooLargeError(length)
+    payload = await reader.readexactly(length)
+    return request_id, msg_type, payload
+
+
+class MessageReader:
+    """Reads messages from the stream and joins their frames.
+
+    Compressed messages are decompressed, codec doesn't have to be known
+    in advance. Frames of message that is cancelled before its last frame
+    are dropped.
+
+    Attributes:
+        reader: Underlying asyncio.StreamReader.
+        max_message_size: Messages larger than that are rejected, both
+                          before and after decompression.
+        compression_stats: compression.CompressionStats that decompressed
+                           messages are counted in or None.
+        _partial: Maps request id to payload of partially read message.
+        _dropped: Request ids of rejected messages with frames still to
+                  be skipped.
+    """
+    def __init__(self, reader, max_message_size=MAX_MESSAGE_SIZE,
+                 compression_stats=None):
+        self.reader = reader
+        self.max_message_size = max_message_size
+        self.compression_stats = compression_stats
+        self._partial = {}
+        self._dropped = set()
+
+    def at_eof(self):
+        """Whether stream is over."""
+        return self.reader.at_eof()
+
+    async def read(self):
+        """Reads next whole message.
+
+        Returns:
+            Tuple of request id, message type and payload.
+        Raises:
+            asyncio.IncompleteReadError: Raised when stream ends before
+                                         whole frame is read.
+            FrameTooLargeError: Raised when frame is larger than
+                                FRAME_SIZE, connection must be closed.
+            MessageTooLargeError: Raised when message exceeds maximum
+                                  message size. Its remaining frames are
+                                  skipped.
+            DecompressionError: Raised when compressed message is broken
+                                or its codec is not installed.
+        """
+        while True:
+            request_id, msg_type, payload = await read_frame(self.reader)
+            more, compressed = msg_type & MORE, msg_type & COMPRESSED
+            msg_type &= ~(MORE | COMPRESSED)
+            if msg_type == CANCEL:
+                # Rest of the message that is cancelled is never sent.
+                self._partial.pop(request_id, None)
+                self._dropped.discard(request_id)
+                return request_id, msg_type, payload
+            if request_id in self._dropped:
+                if not more:
+                    self._dropped.discard(request_id)
+                continue
+            partial = self._partial.pop(request_id, None)
+            if partial is not None:
+                partial += payload
+                payload = partial
+            if len(payload) > self.max_message_size:
+                if more:
+                    self._dropped.add(request_id)
+                raise MessageTooLargeError(request_id, self.max_message_size)
+            if not more:
+                if compressed:
+                    payload = await self._decompress(request_id, payload)
+                return request_id, msg_type, payload
+            self._partial[request_id] = (
+                payload if partial is not None else bytearray(payload))
+
+    async def _decompress(self, request_id, payload):
+        """Decompresses payload in thread, so event loop is not blocked.
+
+        Decompression stops once payload exceeds maximum message size.
+        """
+        try:
+            payload = await asyncio.get_event_loop().run_in_executor(
+                None, compression.decompress, payload,
+                self.compression_stats, self.max_message_size)
+        except Exception as exc:  # pylint: disable=broad-except
+            raise DecompressionError(request_id, str(exc)) from exc
+        if len(payload) > self.max_message_size:
+            raise MessageTooLargeError(request_id, self.max_message_size)
+        return payload
+
+
+class FrameWriter:
+    """Writes messages to the stream.
+
+    Frame is written with single call, so frames from concurrent
+    coroutines never interleave. Messages larger than FRAME_SIZE are split
+    into several frames and other messages may be sent in between. Lock
+    serializes waiting for the buffer to drain. Messages are compressed in
+    thread once compressor is set.
+
+    Attributes:
+        writer: Underlying asyncio.StreamWriter.
+        compressor: compression.Compressor of messages or None.
+    """
+    def __init__(self, writer, compressor=None):
+        self.writer = writer
+        self.compressor = compressor
+        self._drain_lock = asyncio.Lock()
+
+    async def send(self, request_id, msg_type, *payload):
+        """Sends single message.
+
+        Payload may be given in several parts to avoid concatenating them.
+        """
+        length = sum(len(part) for part in payload)
+        if self.compressor is not None and length >= self.compressor.threshold:
+            compressed = await asyncio.get_event_loop().run_in_executor(
+                None, self.compressor.compress, payload)
+            if compressed is not None:
+                payload, msg_type = compressed, msg_type | COMPRESSED
+                length = sum(len(part) for part in payload)
+        if length <= FRAME_SIZE:
+            self.writer.writelines(
+                [HEADER.pack(length, request_id, msg_type)] + list(payload))
+            async with self._drain_lock:
+                await self.writer.drain()
+            return
+        for frame, last in _split(payload, FRAME_SIZE):
+            frame_type = msg_type if last else msg_type | MORE
+            self.writer.writelines(
+                [HEADER.pack(sum(len(part) for part in frame), request_id,
+                             frame_type)] + frame)
+            async with self._drain_lock:
+                await self.writer.drain()
+
+    def close(self):
+        """Closes underlying stream."""
+        self.writer.close()
+
+
+def _split(payload, frame_size):
+    """Splits payload parts into frames of at most frame_size bytes.
+
+    Yields:
+        Tuples of list of frame parts and whether frame is the last one.
+    """
+    frame, frame_length = [], 0
+    parts = [memoryview(part).cast('B') for part in payload]
+    for i, part in enumerate(parts):
+        while part:
+            chunk = part[:frame_size - frame_length]
+            part = part[len(chunk):]
+            frame.append(chunk)
+            frame_length += len(chunk)
+            if frame_length == frame_size:
+                last = not part and not any(parts[i + 1:])
+                yield frame, last
+                if last:
+                    return
+                frame, frame_length = [], 0
+    yield frame, True
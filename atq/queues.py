@@ -0,0 +1,145 @@
+"""Scheduler that hands tasks of the server to free workers.
+
+Tasks wait in named queues until some worker is free. Queue is picked by
+weighted fair sharing, so while both have waiting tasks, queue with weight
+3 gets three times as many workers as queue with weight 1. Inside the
+queue tasks with higher priority go first and tasks with equal priority go
+in order of arrival.
+
+Waiting tasks can also be offloaded to other servers, newest tasks of the
+lowest priority go first, as they would wait longest.
+"""
+import asyncio
+import heapq
+import itertools
+
+from atq import protocol
+
+DEFAULT_WEIGHT = 1
+
+
+class _Queue:
+    """Waiting tasks of single queue.
+
+    Attributes:
+        weight: Share of workers that queue gets.
+        virtual_time: Grows by 1 / weight with every task that is started,
+                      queue with the smallest one goes next.
+        waiting: Heap of negated priority, arrival number, future and
+                 whether task can be offloaded of every waiting task.
+    """
+    def __init__(self, weight):
+        self.weight = weight
+        self.virtual_time = 0
+        self.waiting = []
+
+
+class TaskScheduler:
+    """Limits number of running tasks to number of workers.
+
+    Attributes:
+        free_workers: Number of workers without task.
+        queues: Maps queue name to _Queue.
+        _arrivals: Counter that orders tasks with equal priority.
+        _virtual_time: Virtual time of the queue that started task last.
+    """
+    def __init__(self, num_workers, weights=None):
+        self.free_workers = num_workers
+        self.queues = {}
+        self._arrivals = itertools.count()
+        self._virtual_time = 0
+        for name, weight in (weights or {}).items():
+            self._get_queue(name).weight = weight
+
+    def queued(self):
+        """Returns dict that maps queue name to number of waiting tasks."""
+        return {name: len(queue.waiting)
+                for name, queue in self.queues.items()}
+
+    async def acquire(self, priority=0, queue=protocol.DEFAULT_QUEUE,
+                      offloadable=False):
+        """Waits until worker is free for the task or task is offloaded.
+
+        Caller must call release when task is done, unless it's offloaded.
+
+        Args:
+            priority: Tasks with higher priority are started first.
+            queue: Name of the queue, unknown queues get DEFAULT_WEIGHT.
+            offloadable: Whether task may be passed to another server.
+        Returns:
+            None if worker is acquired or address of the server that task
+            is offloaded to.
+        """
+        if self.free_workers:
+            self.free_workers -= 1
+            return None
+        task_queue = self._get_queue(queue)
+        if not task_queue.waiting:
+            # Queue that was idle doesn't get credit for the idle time.
+            task_queue.virtual_time = max(
+                task_queue.virtual_time, self._virtual_time)
+        entry = (-priority, next(self._arrivals),
+                 asyncio.get_event_loop().create_future(), offloadable)
+        heapq.heappush(task_queue.waiting, entry)
+        try:
+            return await entry[2]
+        except asyncio.CancelledError:
+            if (entry[2].done() and not entry[2].cancelled() and
+                    entry[2].result() is None):
+                self.release()
+            elif entry in task_queue.waiting:
+                task_queue.waiting.remove(entry)
+                heapq.heapify(task_queue.waiting)
+            raise
+
+    def release(self):
+        """Frees worker and hands it to the next waiting task."""
+        while True:
+            task_queue = self._next_queue()
+            if task_queue is None:
+                self.free_workers += 1
+                return
+            _, _, future, _ = heapq.heappop(task_queue.waiting)
+            # Task may be cancelled before it removes itself from the queue.
+            if not future.cancelled():
+                break
+        self._virtual_time = task_queue.virtual_time
+        task_queue.virtual_time += 1 / task_queue.weight
+        future.set_result(None)
+
+    def offload(self, count, server_address):
+        """Passes up to count waiting tasks to another server.
+
+        Returns:
+            Number of offloaded tasks.
+        """
+        offloaded = 0
+        while offloaded < count:
+            candidates = [
+                (entry, task_queue) for task_queue in self.queues.values()
+                for entry in task_queue.waiting
+                if entry[3] and not entry[2].cancelled()]
+            if not candidates:
+                break
+            entry, task_queue = max(candidates, key=lambda item: item[0][:2])
+            task_queue.waiting.remove(entry)
+            heapq.heapify(task_queue.waiting)
+            entry[2].set_result(server_address)
+            offloaded += 1
+        return offloaded
+
+    def _get_queue(self, name):
+        """Returns queue by name, creates it if needed."""
+        task_queue = self.queues.get(name)
+        if task_queue is None:
+            task_queue = self.queues[name] = _Queue(DEFAULT_WEIGHT)
+        return task_queue
+
+    def _next_queue(self):
+        """Returns queue that gets the next free worker or None."""
+        waiting = [(task_queue.virtual_time, name)
+                   for name, task_queue in self.queues.items()
+                   if task_queue.waiting]
+        if not waiting:
+            return None
+        return self.queues[min(waiting)[1]]
@@ -0,0 +1,163 @@
+"""Strategies that pick task queue server for the next task.
+
+Scheduler is a function that takes collection of workers and mapping from
+worker to its ServerLoad and returns iterator of selected workers.
+Custom scheduler with the same signature can be passed to Q.
+"""
+import random
+import time
+
+BACKOFF_BASE = 0.1  # seconds
+BACKOFF_MAX = 2  # seconds
+# Probe that doesn't finish in time, for example because event loop that
+# runs it is stopped, lets the next one through.
+PROBE_TIMEOUT = 1  # seconds
+
+# States of the circuit breaker.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def backoff(attempt):
+    """Returns jittered exponential delay after attempt-th failure.
+
+    Delay is drawn from the upper half of the exponential interval, so
+    clients that failed together don't retry together.
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ServerLoad:
+    """Load of task queue server as seen by the client.
+
+    Also works as circuit breaker. Failed server is open and avoided for
+    backoff delay, then single probe is let through while server is half
+    open. Successful probe closes the circuit, failed one opens it for
+    longer delay.
+
+    Attributes:
+        in_flight: Number of tasks sent by the client and not finished yet.
+        retries: Number of consecutive failed connection attempts.
+        retry_at: Time until which server is avoided after failure.
+        probing_until: Time until which probe of half open server is in
+                       progress.
+        busy_until: Time until which server is avoided after it rejected
+                    task because its queue is full.
+        num_workers: Number of workers advertised by the server.
+        server_tasks: Number of tasks on the server from all clients, as
+                      reported with the last response.
+    """
+    def __init__(self):
+        self.in_flight = 0
+        self.retries = 0
+        self.retry_at = 0
+        self.probing_until = 0
+        self.busy_until = 0
+        self.num_workers = 1
+        self.server_tasks = 0
+
+    def report(self, num_workers, server_tasks):
+        """Updates load from report sent by the server."""
+        self.num_workers = max(num_workers, 1)
+        self.server_tasks = server_tasks
+
+    @property
+    def tasks_per_worker(self):
+        """Estimated number of tasks per worker of the server."""
+        return max(self.in_flight, self.server_tasks) / self.num_workers
+
+    def failed(self):
+        """Registers failed connection, opens the circuit.
+
+        Failures of concurrent tasks while circuit is open are counted as
+        single retry.
+        """
+        now = time.monotonic()
+        self.probing_until = 0
+        if now >= self.retry_at:
+            self.retries += 1
+            self.retry_at = now + backoff(self.retries)
+
+    def probe(self):
+        """Registers connection attempt, claims the probe if server is
+        half open."""
+        if self.retries:
+            self.probing_until = time.monotonic() + PROBE_TIMEOUT
+
+    def busy(self, delay):
+        """Registers rejected task, server is avoided for delay seconds."""
+        self.busy_until = time.monotonic() + delay
+
+    def connected(self):
+        """Registers successful connection, closes the circuit."""
+        self.retries, self.retry_at, self.probing_until = 0, 0, 0
+
+    @property
+    def state(self):
+        """State of the circuit breaker."""
+        if not self.retries:
+            return CLOSED
+        if time.monotonic() < max(self.retry_at, self.probing_until):
+            return OPEN
+        return HALF_OPEN
+
+    def avoided_for(self):
+        """Returns number of seconds until server can be tried again."""
+        now = time.monotonic()
+        delay = self.busy_until - now
+        if self.retries:
+            delay = max(delay, self.retry_at - now, self.probing_until - now)
+        return max(delay, 0)
+
+    @property
+    def is_avoided(self):
+        """Whether server failed or was busy recently and should not be
+        picked."""
+        return (self.state == OPEN or
+                time.monotonic() < self.busy_until)
+
+    def rank(self):
+        """Sorting key, servers that failed recently go last."""
+        return self.is_avoided, self.tasks_per_worker
+
+
+def _healthy(workers, load):
+    """Returns workers that didn't fail recently or all of them."""
+    healthy = [worker for worker in workers if not load[worker].is_avoided]
+    return healthy or list(workers)
+
+
+def random_scheduler(workers, load=None):  # pylint: disable=unused-argument
+    """Picks next worker uniformly at random."""
+    while True:
+        yield random.choice(workers)
+
+
+def least_outstanding_scheduler(workers, load):
+    """Picks worker with the least number of tasks per worker process."""
+    while True:
+        yield min(workers,
+                  key=lambda worker: (load[worker].rank(), random.random()))
+
+
+def power_of_two_scheduler(workers, load):
+    """Picks less loaded worker of two chosen at random."""
+    while True:
+        if len(workers) < 2:
+            yield workers[0]
+            continue
+        first, second = random.sample(list(workers), 2)
+        yield (first if load[first].rank() <= load[second].rank()
+               else second)
+
+
+def weighted_scheduler(workers, load):
+    """Picks worker at random with probability proportional to number of
+    worker processes."""
+    while True:
+        candidates = _healthy(workers, load)
+        yield random.choices(
+            candidates,
+            weights=[load[worker].num_workers for worker in candidates])[0]
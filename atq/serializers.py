@@ -0,0 +1,315 @@
+"""Serializers of tasks, results and stream items.
+
+Serialized payload starts with tag of its serializer, so it can be read
+without knowing which serializer wrote it. Payloads of CLOUDPICKLE have no
+tag, they are plain pickles as sent by clients that don't know
+serializers, pickles start with PROTO opcode that no tag uses.
+
+Client picks serializer in the handshake from serializers the server
+accepts and server answers every task with serializer of the task, so old
+and new clients can use the same server.
+"""
+import importlib
+import io
+import pickle
+import struct
+import sys
+import types
+
+import cloudpickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Names of serializers.
+PICKLE = 'pickle'
+CLOUDPICKLE = 'cloudpickle'
+MSGPACK = 'msgpack'
+
+PROTOCOL = 5
+
+# Bytes and bytearrays passed as arguments of the task are sent out of band
+# when they are larger than that.
+ZERO_COPY_THRESHOLD = 64 * 1024  # bytes
+
+# Number of out-of-band buffers of pickle payload, followed by size of
+# every buffer.
+BUFFER_COUNT = struct.Struct('!I')
+BUFFER_SIZE = struct.Struct('!Q')
+
+# Msgpack extension types.
+_TUPLE = 1
+_OBJECT = 2
+_PICKLED = 3
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class UnknownSerializerError(Error):
+    """Raised when serializer is unknown or is not installed."""
+    pass
+
+
+class _ZeroCopyBytes:
+    """Bytes or bytearray that pickle protocol 5 sends out of band.
+
+    Unpickles to the wrapped type, so it never reaches the function.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        if protocol < 5:
+            return type(self.data), (self.data,)
+        return type(self.data), (pickle.PickleBuffer(self.data),)
+
+
+def zero_copy(value):
+    """Wraps large bytes or bytearray, so PICKLE sends it without copying
+    it into the pickle."""
+    if (type(value) in (bytes, bytearray) and  # pylint: disable=unidiomatic-typecheck
+            len(value) >= ZERO_COPY_THRESHOLD):
+        return _ZeroCopyBytes(value)
+    return value
+
+
+def _is_importable(obj):
+    """Whether function or class can be imported by its qualified name."""
+    module_name = getattr(obj, '__module__', None)
+    qualname = getattr(obj, '__qualname__', '')
+    if module_name in (None, '__main__') or '<' in qualname:
+        return False
+    module = sys.modules.get(module_name)
+    if module is None:
+        return False
+    for name in qualname.split('.'):
+        module = getattr(module, name, None)
+    return module is obj
+
+
+class _ReferencePickler(pickle.Pickler):
+    """Pickler that refuses functions and classes that can't be imported,
+    they are pickled by value with cloudpickle instead."""
+    def reducer_override(self, obj):
+        """Refuses functions and classes that are pickled by value, other
+        objects are pickled as usual."""
+        if (isinstance(obj, (types.FunctionType, type)) and
+                not _is_importable(obj)):
+            raise pickle.PicklingError('%r is pickled by value' % obj)
+        return NotImplemented
+
+
+def _dumps_by_reference(obj, buffer_callback=None):
+    """Pickles object, functions and classes are pickled by reference.
+
+    Raises:
+        pickle.PicklingError: Raised when object has function or class
+                              that has to be pickled by value.
+    """
+    output = io.BytesIO()
+    _ReferencePickler(
+        output, PROTOCOL, buffer_callback=buffer_callback).dump(obj)
+    return output.getvalue()
+
+
+def dumps_function(func):
+    """Pickles function of the task.
+
+    Function that workers can import is pickled by reference with plain
+    pickle, lambdas, closures and functions of __main__ are pickled by value
+    with cloudpickle.
+    """
+    try:
+        return _dumps_by_reference(func)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return cloudpickle.dumps(func, PROTOCOL)
+
+
+class Serializer:
+    """Base class of serializers.
+
+    Attributes:
+        name: Name of the serializer in the handshake.
+        tag: Byte that starts every payload of the serializer.
+    """
+    name = None
+    tag = b''
+
+    def dumps(self, obj):
+        """Returns list of parts of serialized object.
+
+        Parts are sent without joining them, so large buffers are not
+        copied.
+        """
+        raise NotImplementedError
+
+    def loads(self, data):
+        """Returns object read from bytes-like payload with tag."""
+        raise NotImplementedError
+
+
+class CloudpickleSerializer(Serializer):
+    """Pickles everything with cloudpickle, payloads have no tag.
+
+    Used by clients that don't know serializers.
+    """
+    name = CLOUDPICKLE
+
+    def dumps(self, obj):
+        return [cloudpickle.dumps(obj)]
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class PickleSerializer(Serializer):
+    """Pickles with plain pickle, falls back to cloudpickle for lambdas and
+    closures.
+
+    Buffers of objects that support pickle protocol 5, like NumPy arrays,
+    and bytes wrapped by zero_copy are sent out of band after the pickle.
+    Buffers are read without copying from bytearray payloads, that large
+    messages are read into, and are copied from read-only and shared
+    memory payloads.
+    """
+    name = PICKLE
+    tag = b'\x01'
+
+    def dumps(self, obj):
+        obj = zero_copy(obj)
+        buffers = []
+
+        def buffer_callback(buffer):
+            raw = buffer.raw()
+            if raw.nbytes < ZERO_COPY_THRESHOLD:
+                return True
+            buffers.append(raw)
+            return False
+
+        try:
+            data = _dumps_by_reference(obj, buffer_callback)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            del buffers[:]
+            data = cloudpickle.dumps(
+                obj, PROTOCOL, buffer_callback=buffer_callback)
+        header = BUFFER_COUNT.pack(len(buffers)) + b''.join(
+            BUFFER_SIZE.pack(buffer.nbytes) for buffer in buffers)
+        return [self.tag + header, data] + buffers
+
+    def loads(self, data):
+        view = memoryview(data).cast('B')
+        offset = len(self.tag)
+        count, = BUFFER_COUNT.unpack_from(view, offset)
+        offset += BUFFER_COUNT.size
+        sizes = [size for size, in BUFFER_SIZE.iter_unpack(
+            view[offset:offset + count * BUFFER_SIZE.size])]
+        offset += count * BUFFER_SIZE.size
+        pickle_end = end = len(view) - sum(sizes)
+        owned = isinstance(view.obj, bytearray)
+        buffers = []
+        for size in sizes:
+            buffer = view[end:end + size]
+            buffers.append(buffer if owned else bytearray(buffer))
+            end += size
+        return pickle.loads(view[offset:pickle_end], buffers=buffers)
+
+
+class MsgpackSerializer(Serializer):
+    """Packs simple values with msgpack.
+
+    Tuples and objects that keep their state in __dict__ are packed as
+    extension types, other objects are pickled with PICKLE inside the
+    payload. Requires msgpack package.
+    """
+    name = MSGPACK
+    tag = b'\x02'
+
+    def dumps(self, obj):
+        return [self.tag, self._pack(obj)]
+
+    def loads(self, data):
+        return msgpack.unpackb(
+            memoryview(data)[len(self.tag):], ext_hook=self._decode,
+            raw=False, strict_map_key=False)
+
+    def _encode(self, obj):
+        """Packs objects that msgpack doesn't support."""
+        if isinstance(obj, _ZeroCopyBytes):
+            return obj.data
+        if type(obj) is tuple:  # pylint: disable=unidiomatic-typecheck
+            return msgpack.ExtType(_TUPLE, self._pack(list(obj)))
+        cls = type(obj)
+        if (hasattr(obj, '__dict__') and _is_importable(cls) and
+                cls.__reduce_ex__ is object.__reduce_ex__ and
+                cls.__reduce__ is object.__reduce__ and
+                getattr(cls, '__getstate__', None) is getattr(
+                    object, '__getstate__', None)):
+            return msgpack.ExtType(_OBJECT, self._pack(
+                [cls.__module__, cls.__qualname__, vars(obj)]))
+        return msgpack.ExtType(
+            _PICKLED, b''.join(SERIALIZERS[PICKLE].dumps(obj)))
+
+    def _pack(self, obj):
+        """Packs nested value."""
+        return msgpack.packb(
+            obj, default=self._encode, use_bin_type=True, strict_types=True)
+
+    def _decode(self, code, data):
+        """Unpacks extension types."""
+        if code == _PICKLED:
+            return SERIALIZERS[PICKLE].loads(data)
+        value = msgpack.unpackb(data, ext_hook=self._decode, raw=False,
+                                strict_map_key=False)
+        if code == _TUPLE:
+            return tuple(value)
+        module_name, qualname, state = value
+        cls = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            cls = getattr(cls, name)
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+
+
+SERIALIZERS = {
+    serializer.name: serializer for serializer in (
+        PickleSerializer(), CloudpickleSerializer(), MsgpackSerializer())}
+_BY_TAG = {serializer.tag[0]: serializer
+           for serializer in SERIALIZERS.values() if serializer.tag}
+
+
+def available():
+    """Returns names of serializers that can be used here."""
+    return [name for name in SERIALIZERS
+            if name != MSGPACK or msgpack is not None]
+
+
+def get(name):
+    """Returns serializer by name.
+
+    Raises:
+        UnknownSerializerError: Raised when serializer is unknown or its
+                                package is not installed.
+    """
+    if name not in available():
+        raise UnknownSerializerError('Unknown serializer: %r' % name)
+    return SERIALIZERS[name]
+
+
+def detect(data):
+    """Returns serializer that wrote the payload.
+
+    Payloads without known tag are taken for CLOUDPICKLE ones.
+    """
+    view = memoryview(data).cast('B')
+    return _BY_TAG.get(view[0] if view else None, SERIALIZERS[CLOUDPICKLE])
+
+
+def loads(data):
+    """Reads payload written by any serializer."""
+    return detect(data).loads(data)
@@ -0,0 +1,92 @@
+"""Server side state of client connections.
+
+Server runs requests of every connection in background, so session keeps
+them to cancel tasks and streams when client asks for it or disconnects.
+"""
+import asyncio
+
+from atq import protocol
+
+
+class Stream:
+    """Flow control state of the stream.
+
+    Attributes:
+        credits: Number of items that can be sent before client acks them.
+        cancelled: Whether client cancelled the stream.
+        _wakeup: Event that is set when credits are added or stream is
+                 cancelled.
+    """
+    def __init__(self):
+        self.credits = protocol.STREAM_WINDOW
+        self.cancelled = False
+        self._wakeup = asyncio.Event()
+
+    def ack(self, count):
+        """Adds credits for items consumed by the client."""
+        self.credits += count
+        self._wakeup.set()
+
+    def cancel(self):
+        """Stops the stream."""
+        self.cancelled = True
+        self._wakeup.set()
+
+    async def wait(self):
+        """Waits until next item can be sent.
+
+        Returns:
+            False if stream is cancelled.
+        """
+        while not self.cancelled and self.credits <= 0:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return not self.cancelled
+
+
+class Session:
+    """Requests of single client connection.
+
+    Attributes:
+        frame_writer: protocol.FrameWriter of the connection.
+        running: Tasks of requests that are running.
+        tasks: Maps request id to task of the task request while it runs,
+               so client can cancel it.
+        streams: Maps request id to Stream while it runs.
+    """
+    def __init__(self, frame_writer):
+        self.frame_writer = frame_writer
+        self.running = set()
+        self.tasks, self.streams = {}, {}
+
+    def spawn(self, coro):
+        """Runs coroutine in background and keeps track of it."""
+        task = asyncio.ensure_future(coro)
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return task
+
+    def track(self, request_id, coro):
+        """Runs coroutine of the task request in background and keeps it
+        by request id while it runs."""
+        task = self.tasks[request_id] = self.spawn(coro)
+        task.add_done_callback(lambda _: self.tasks.pop(request_id, None))
+
+    async def close(self):
+        """Stops tasks and streams that run, waits for requests and closes
+        connection."""
+        for task in self.tasks.values():
+            task.cancel()
+        for stream in self.streams.values():
+            stream.cancel()
+        if self.running:
+            await asyncio.wait(self.running)
+        self.frame_writer.close()
+
+
+def spawner(request):
+    """Returns message handler that runs coroutine function of the request
+    in background, it's called with frame writer, request id and payload."""
+    def handle(client, request_id, payload):
+        client.spawn(request(client.frame_writer, request_id, payload))
+    return handle
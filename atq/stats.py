@@ -0,0 +1,113 @@
+"""Instrumentation of the client.
+
+Client reports TaskEvent of every finished task to its observers.
+Observer is a callable that takes the event. ClientStats is the observer
+that aggregates events into per server statistics.
+"""
+from collections import defaultdict
+from collections import deque
+
+# Number of the most recent tasks of every server used for percentiles.
+STATS_WINDOW = 1000
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+
+def percentile(sorted_values, fraction):
+    """Returns percentile of sorted values by nearest rank."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summary(values):
+    """Returns mean and percentiles of values."""
+    values = sorted(values)
+    result = {'mean': sum(values) / len(values) if values else None}
+    for name, fraction in PERCENTILES:
+        result[name] = percentile(values, fraction)
+    return result
+
+
+class TaskEvent:
+    """Timings and sizes of single task.
+
+    Times are in seconds.
+
+    Attributes:
+        func_name: Name of the function of the task.
+        task_id: Id of the task that servers journal it by or None.
+        server: Host and port of the server that ran the task or None if
+                task didn't reach any server.
+        connect_time: Time of selecting server and connecting to it,
+                      including retries.
+        serialize_time: Time of pickling the task.
+        request_time: Time between sending the task and receiving its
+                      result, includes network and the server.
+        deserialize_time: Time of unpickling the result.
+        total_time: Time of the whole task.
+        task_size: Size of pickled task in bytes.
+        result_size: Size of pickled result in bytes.
+        connect_failures: Servers that client failed to connect to.
+        rejections: Servers that rejected the task because they are busy.
+        error: Exception raised by the task or the client, None if task
+               succeeded.
+    """
+    def __init__(self, func_name):
+        self.func_name = func_name
+        self.task_id = None
+        self.server = None
+        self.connect_time = self.serialize_time = 0
+        self.request_time = self.deserialize_time = self.total_time = 0
+        self.task_size = self.result_size = 0
+        self.connect_failures, self.rejections = [], []
+        self.error = None
+
+
+class _ServerStats:
+    """Aggregated events of single server.
+
+    Attributes:
+        tasks: Number of tasks run on the server.
+        errors: Number of tasks that raised exception.
+        connect_failures: Number of failed connection attempts.
+        rejections: Number of tasks rejected because server is busy.
+        latencies: Total times of the most recent tasks.
+    """
+    def __init__(self):
+        self.tasks = self.errors = 0
+        self.connect_failures = self.rejections = 0
+        self.latencies = deque(maxlen=STATS_WINDOW)
+
+
+class ClientStats:
+    """Observer that aggregates task events by server.
+
+    Attributes:
+        _servers: Defaultdict that maps server to its _ServerStats.
+    """
+    def __init__(self):
+        self._servers = defaultdict(_ServerStats)
+
+    def __call__(self, event):
+        for server in event.connect_failures:
+            self._servers[server].connect_failures += 1
+        for server in event.rejections:
+            self._servers[server].rejections += 1
+        if event.server is None:
+            return
+        server_stats = self._servers[event.server]
+        server_stats.tasks += 1
+        server_stats.errors += event.error is not None
+        server_stats.latencies.append(event.total_time)
+
+    def snapshot(self):
+        """Returns dict that maps server to dict of its statistics."""
+        return {
+            server: {
+                'tasks': server_stats.tasks,
+                'errors': server_stats.errors,
+                'connect_failures': server_stats.connect_failures,
+                'rejections': server_stats.rejections,
+                'latency': summary(server_stats.latencies),
+            } for server, server_stats in self._servers.items()}
@@ -0,0 +1,115 @@
+"""Tasks that clients send to servers and decorators of their functions.
+
+Task carries arguments of the call, its function is shipped separately and
+is cached by servers and workers.
+"""
+import cloudpickle
+
+from atq import objects
+from atq import protocol
+from atq import serializers
+
+
+class Task:
+    """Wraps function arguments.
+
+    Function itself is shipped to the server separately, worker passes it
+    to run. Large bytes arguments are sent without copying them into the
+    pickle. Ids of stored objects that arguments refer to are kept in refs,
+    they are sent with the task.
+    """
+    def __init__(self, host, func_name, *args, **kwargs):
+        self.host, self.func_name = host, func_name
+        self.args = tuple(serializers.zero_copy(arg) for arg in args)
+        self.kwargs = {name: serializers.zero_copy(value)
+                       for name, value in kwargs.items()}
+        self.refs = objects.find_refs(args + tuple(kwargs.values()))
+
+    def run(self, func):
+        """Calls the function with arguments of the task."""
+        return func(*self.args, **self.kwargs)
+
+    def __str__(self):
+        return '<%s> from %s' % (self.func_name, self.host)
+
+    def cache_key(self, func_id):
+        """Returns key of the task result in the server cache."""
+        return protocol.cache_key(
+            func_id, cloudpickle.dumps((self.args, self.kwargs)))
+
+
+class ChunkTask(Task):
+    """Wraps arguments of several calls of the same function.
+
+    Whole chunk is run by single worker call and returns list of results.
+    """
+    def __init__(self, host, func_name, chunk):
+        super().__init__(host, func_name)
+        self.chunk = chunk
+        self.refs = objects.find_refs(chunk)
+
+    def run(self, func):
+        """Calls the function with arguments of every call of the chunk."""
+        return [func(*args) for args in self.chunk]
+
+    def __str__(self):
+        return '<%s> x %d from %s' % (
+            self.func_name, len(self.chunk), self.host)
+
+    def cache_key(self, func_id):
+        """Returns key of the chunk results in the server cache."""
+        return protocol.cache_key(func_id, cloudpickle.dumps(self.chunk))
+
+
+def cached(func):
+    """Decorator that makes servers cache results of the function.
+
+    Results are cached by function and arguments, so function must be pure
+    and its arguments must pickle the same way every time.
+    """
+    func.atq_cached = True
+    return func
+
+
+def idempotent(func):
+    """Decorator that lets client run the function again on another
+    server when connection to the server running it is lost.
+
+    Function may then run more than once, so running it again must do no
+    harm.
+    """
+    func.atq_idempotent = True
+    return func
+
+
+def run_in(executor):
+    """Decorator that sets executor that runs the function on the server.
+
+    Args:
+        executor: One of protocol.EXECUTORS: 'process' for worker
+                  processes, 'thread' for threads of the server, 'async'
+                  for event loop of the server, which suits coroutine
+                  functions.
+    Raises:
+        ValueError: Raised when executor is unknown.
+    """
+    if executor not in protocol.EXECUTORS:
+        raise ValueError('Unknown executor: %r' % executor)
+
+    def decorator(func):
+        func.atq_executor = executor
+        return func
+    return decorator
+
+
+def pack_options(func, priority, queue, executor):
+    """Packs task options, executor of the call overrides the one set with
+    run_in."""
+    if executor is None:
+        executor = getattr(func, 'atq_executor', None)
+    return protocol.pack_options(priority, queue, executor)
+
+
+def name_of(func):
+    """Returns name of the function for logging."""
+    return getattr(func, '__name__', repr(func))
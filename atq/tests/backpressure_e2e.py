@@ -0,0 +1,88 @@
+"""End to end tests for servers with bounded queue."""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 1
+MAX_QUEUE_DEPTH = 1
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 6  # Number of runs in tests.
+
+
+def first_available_scheduler(workers, load):
+    """Picks the first worker that isn't avoided."""
+    while True:
+        yield next((worker for worker in workers
+                    if not load[worker].is_avoided), workers[0])
+
+
+q = Q([
+    (HOST1, PORT1),
+    (HOST2, PORT2),
+], scheduler=first_available_scheduler)
+
+
+def slow_pid():
+    """Returns pid of the worker after some work."""
+    time.sleep(0.5)
+    return os.getpid()
+
+
+def slow_square(x):
+    """Returns square of x after some work."""
+    time.sleep(0.1)
+    return x * x
+
+
+async def reschedule_test():
+    """Runs two tasks concurrently."""
+    return await asyncio.gather(q.q(slow_pid), q.q(slow_pid))
+
+
+async def all_busy_test():
+    """Runs more tasks than servers accept at once."""
+    return await asyncio.gather(*[q.q(slow_square, x) for x in range(NUM_RUNS)])
+
+
+class BackpressureE2ETest(unittest.TestCase):
+    """e2e tests for servers with bounded queue."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS),
+             '--max-queue-depth', str(MAX_QUEUE_DEPTH)],
+            env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS),
+             '--max-queue-depth', str(MAX_QUEUE_DEPTH)],
+            env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testReschedule(self):
+        """Tests that task rejected by busy server runs on another one."""
+        first, second = asyncio.get_event_loop().run_until_complete(
+            reschedule_test())
+        self.assertNotEqual(first, second)
+
+    def testAllBusy(self):
+        """Tests that tasks wait while all servers are busy."""
+        result = asyncio.get_event_loop().run_until_complete(all_busy_test())
+        self.assertEqual(result, [x * x for x in range(NUM_RUNS)])
@@ -12,6 +12,7 @@ HOST, PORT = 'localhost', 12345
 NUM_WORKERS = 2
 TESTS_PATH = 'atq/tests'
 NUM_RUNS = 20  # Number of runs in tests.
+LARGE_PAYLOAD_SIZE = 4 * 1024 * 1024  # bytes
 
 q = Q([
     (HOST, PORT)
@@ -35,6 +36,11 @@ async def exception_test():
     return await q.q(raise_exception)
 
 
+async def large_payload_test(data):
+    """Sends large argument and gets large result."""
+    return await q.q(bytes.upper, data)
+
+
 class SimpleE2ETest(unittest.TestCase):
     """e2e tests for task queue basic functionality."""
 
@@ -67,3 +73,10 @@ class SimpleE2ETest(unittest.TestCase):
         for _ in range(NUM_RUNS):
             with self.assertRaises(Exception):
                 asyncio.get_event_loop().run_until_complete(exception_test())
+
+    def testLargePayload(self):
+        """Tests large arguments and results."""
+        data = b'atq' * LARGE_PAYLOAD_SIZE
+        result = asyncio.get_event_loop().run_until_complete(
+            large_payload_test(data))
+        self.assertEqual(result, data.upper())
@@ -0,0 +1,38 @@
+"""End to end tests for benchmark."""
+import asyncio
+import unittest
+
+from atq import bench
+from atq import stats
+
+HOST, PORT = 'localhost', 12345
+NUM_SERVERS = 2
+NUM_WORKERS = 2
+NUM_TASKS = 50
+NUM_CLIENTS = 2
+CONCURRENCY = 4
+
+
+class BenchE2ETest(unittest.TestCase):
+    """e2e tests for benchmark."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.processes, cls.servers = bench.start_servers(
+            HOST, PORT, NUM_SERVERS, NUM_WORKERS)
+
+    @classmethod
+    def tearDownClass(cls):
+        bench.stop_servers(cls.processes)
+
+    def testRun(self):
+        """Tests that benchmark reports all phases of tasks."""
+        results = asyncio.get_event_loop().run_until_complete(bench.run(
+            self.servers, (bench._cpu, 1000), NUM_TASKS, NUM_CLIENTS,  # pylint: disable=protected-access
+            CONCURRENCY, num_warmup_tasks=1))
+        self.assertEqual(results['tasks'], NUM_TASKS)
+        self.assertGreater(results['throughput'], 0)
+        for phase in ('total',) + bench.PHASES:
+            for name, _ in stats.PERCENTILES:
+                self.assertGreaterEqual(results['latency'][phase][name], 0)
+        self.assertGreater(results['latency']['execute']['p50'], 0)
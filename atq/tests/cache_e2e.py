@@ -0,0 +1,105 @@
+"""End to end tests for result cache."""
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import Q
+from atq import cached
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+RESULT_CACHE_TTL = 1  # seconds
+NUM_RUNS = 10  # Number of runs in tests.
+
+q = Q([
+    (HOST, PORT)
+])
+
+
+def draw(n):
+    """Returns random number after some work."""
+    time.sleep(0.2)
+    return n + random.random()
+
+
+@cached
+def cached_draw(n):
+    """Returns random number that is cached by the server."""
+    return n + random.random()
+
+
+async def cache_test():
+    """Runs the same task several times with and without cache."""
+    first = await q.q(draw, 1, cache=True)
+    second = await q.q(draw, 1, cache=True)
+    other = await q.q(draw, 2, cache=True)
+    uncached = await q.q(draw, 1)
+    return first, second, other, uncached
+
+
+async def merge_test():
+    """Runs the same cached task concurrently."""
+    return await asyncio.gather(*[
+        q.q(draw, 3, cache=True) for _ in range(NUM_RUNS)])
+
+
+async def decorator_test():
+    """Runs decorated function several times."""
+    return [await q.q(cached_draw, 4) for _ in range(NUM_RUNS)]
+
+
+async def expiry_test():
+    """Runs the same cached task before and after it expires."""
+    first = await q.q(draw, 5, cache=True)
+    await asyncio.sleep(RESULT_CACHE_TTL * 1.5)
+    second = await q.q(draw, 5, cache=True)
+    return first, second
+
+
+class CacheE2ETest(unittest.TestCase):
+    """e2e tests for result cache."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS),
+             '--result-cache-ttl', str(RESULT_CACHE_TTL)],
+            env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testCache(self):
+        """Tests that cached result is reused for the same arguments."""
+        first, second, other, uncached = (
+            asyncio.get_event_loop().run_until_complete(cache_test()))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertNotEqual(first, uncached)
+
+    def testMerge(self):
+        """Tests that concurrent tasks with the same key run once."""
+        result = asyncio.get_event_loop().run_until_complete(merge_test())
+        self.assertEqual(len(set(result)), 1)
+
+    def testDecorator(self):
+        """Tests caching of decorated function."""
+        result = asyncio.get_event_loop().run_until_complete(
+            decorator_test())
+        self.assertEqual(len(set(result)), 1)
+
+    def testExpiry(self):
+        """Tests that result is computed again after it expires."""
+        first, second = asyncio.get_event_loop().run_until_complete(
+            expiry_test())
+        self.assertNotEqual(first, second)
@@ -0,0 +1,98 @@
+"""End to end tests for compression of messages."""
+import asyncio
+import collections
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import bench
+from atq import compression
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+COMPRESSION_THRESHOLD = 1024  # bytes
+NUM_WORDS = 100000
+RANDOM_SIZE = 1024 * 1024  # bytes
+
+compressed_q = Q([(HOST1, PORT1)], compression=compression.ZLIB,
+                 compression_threshold=COMPRESSION_THRESHOLD)
+plain_q = Q([(HOST1, PORT1)])
+refused_q = Q([(HOST2, PORT2)], compression='auto',
+              compression_threshold=COMPRESSION_THRESHOLD)
+
+
+def count_words(text):
+    """Returns number of occurrences of every word of the text."""
+    return collections.Counter(text.split())
+
+
+def make_text():
+    """Returns text with many repeated words."""
+    return ' '.join('word%d' % (i % 5000) for i in range(NUM_WORDS))
+
+
+async def run_tasks(q):
+    """Runs tasks with compressible and random payloads."""
+    return await asyncio.gather(
+        q.q(count_words, make_text()), q.q(len, os.urandom(RANDOM_SIZE)))
+
+
+class CompressionE2ETest(unittest.TestCase):
+    """e2e tests for compression of messages."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS), '--compression-threshold',
+             str(COMPRESSION_THRESHOLD)],
+            env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS), '--no-compression'],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testCompression(self):
+        """Tests that large messages are compressed both ways."""
+        loop = asyncio.get_event_loop()
+        expected = [count_words(make_text()), RANDOM_SIZE]
+        self.assertEqual(loop.run_until_complete(run_tasks(compressed_q)),
+                         expected)
+        self.assertEqual(loop.run_until_complete(run_tasks(plain_q)),
+                         expected)
+        stats = compressed_q.stats()[(HOST1, PORT1)]['compression']
+        self.assertGreater(stats['ratio'], 2)
+        self.assertGreater(stats['raw_bytes'], len(make_text()))
+        self.assertGreater(stats['decompress_time'], 0)
+        self.assertGreater(stats['compress_time'], 0)
+        self.assertIsNone(
+            plain_q.stats()[(HOST1, PORT1)]['compression']['ratio'])
+
+    def testRefusedCompression(self):
+        """Tests that messages are not compressed if server refuses it."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(
+                refused_q.q(count_words, make_text())),
+            count_words(make_text()))
+        self.assertIsNone(
+            refused_q.stats()[(HOST2, PORT2)]['compression']['ratio'])
+
+    def testUnknownCodec(self):
+        """Tests that unknown codec is rejected."""
+        with self.assertRaises(compression.UnknownCodecError):
+            Q([(HOST1, PORT1)], compression='brotli')
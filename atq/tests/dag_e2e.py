@@ -0,0 +1,147 @@
+"""End to end tests for tasks that use results of other tasks."""
+import asyncio
+import cloudpickle
+import operator
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import bench
+from atq import connection as connections
+from atq import protocol
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+DATA_SIZE = 1024 * 1024  # bytes
+BUSY_TIME = 10  # seconds
+
+events = []
+q = Q([(HOST1, PORT1), (HOST2, PORT2)], observers=[events.append])
+
+
+def make_data(size):
+    """Returns bytes of given size."""
+    return bytes(size)
+
+
+def raise_exception():
+    """Raises generic exception."""
+    raise Exception('Hello, world!')
+
+
+async def pipeline_test(x, y):
+    """Runs pipeline of tasks without awaiting intermediate results."""
+    s1 = q.submit(operator.add, x, y)
+    s2 = q.submit(operator.mul, x, y)
+    return await q.q(operator.sub, s2, s1), await s1
+
+
+async def large_result_test():
+    """Passes large result to the next task on the same server."""
+    del events[:]
+    data = q.submit(make_data, DATA_SIZE)
+    length = await q.q(len, data)
+    return length, [event.result_size for event in events]
+
+
+async def moved_result_test():
+    """Passes result to the task that runs on another server."""
+    data = q.submit(make_data, DATA_SIZE)
+    await data.producer
+    stored = q._objects[data.object_id]  # pylint: disable=protected-access
+    holder, = stored.servers
+    # Makes client send the next task to the other server.
+    q._load[holder].busy(BUSY_TIME)  # pylint: disable=protected-access
+    try:
+        length = await q.q(len, data)
+    finally:
+        q._load[holder].busy_until = 0  # pylint: disable=protected-access
+    return length, len(stored.servers)
+
+
+async def map_test():
+    """Maps function over results of tasks."""
+    handles = [q.submit(operator.mul, i, i) for i in range(10)]
+    return [value async for value in q.map(operator.add, handles, range(10))]
+
+
+async def exception_test():
+    """Runs task that uses result of failed task."""
+    failed = q.submit(raise_exception)
+    return await q.q(operator.add, failed, 1)
+
+
+async def bad_fetch_test():
+    """Asks server to fetch object from invalid address."""
+    connection = await connections.connect((HOST1, PORT1))
+    try:
+        msg_type, payload = await asyncio.wait_for(connection.request(
+            protocol.FETCH, bytes(protocol.OBJECT_ID_SIZE), b'nowhere'), 1)
+    finally:
+        connection.close()
+    return msg_type, cloudpickle.loads(payload[protocol.LOAD_REPORT.size:])
+
+
+class DagE2ETest(unittest.TestCase):
+    """e2e tests for tasks that use results of other tasks."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testPipeline(self):
+        """Tests that handles can be passed to tasks and awaited."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(pipeline_test(4, 5)),
+            (11, 9))
+
+    def testLargeResult(self):
+        """Tests that large intermediate result doesn't reach client."""
+        length, result_sizes = asyncio.get_event_loop().run_until_complete(
+            large_result_test())
+        self.assertEqual(length, DATA_SIZE)
+        self.assertLess(max(result_sizes), 1024)
+
+    def testMovedResult(self):
+        """Tests that result is moved between servers."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(moved_result_test()),
+            (DATA_SIZE, 2))
+
+    def testMap(self):
+        """Tests that handles can be mapped over."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(map_test()),
+            [i * i + i for i in range(10)])
+
+    def testException(self):
+        """Tests that exception of the task is raised by dependent task."""
+        with self.assertRaisesRegex(Exception, 'Hello, world!'):
+            asyncio.get_event_loop().run_until_complete(exception_test())
+
+    def testBadFetch(self):
+        """Tests that server answers fetch with invalid address."""
+        msg_type, result = asyncio.get_event_loop().run_until_complete(
+            bad_fetch_test())
+        self.assertEqual(msg_type, protocol.RESULT)
+        self.assertIsInstance(result, ValueError)
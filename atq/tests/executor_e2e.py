@@ -0,0 +1,126 @@
+"""End to end tests for executors that run tasks on the server."""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+import atq
+from atq import bench
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 10  # Number of runs in tests.
+TASK_TIME = 0.2  # seconds
+
+
+q1 = Q([(HOST1, PORT1)])
+q2 = Q([(HOST2, PORT2)])
+
+
+async def sleep_and_get_pid():
+    """Sleeps without blocking event loop and returns pid."""
+    await asyncio.sleep(TASK_TIME)
+    return os.getpid()
+
+
+@atq.run_in('thread')
+def get_pid_in_thread():
+    """Returns pid of the process that runs the function."""
+    return os.getpid()
+
+
+def items():
+    """Yields pid of the process that runs the function."""
+    yield os.getpid()
+
+
+async def run_tasks(q, func, **kwargs):
+    """Runs tasks concurrently and returns their results."""
+    return await asyncio.gather(*[
+        q.q(func, **kwargs) for _ in range(NUM_RUNS)])
+
+
+async def stream_pids(q, **kwargs):
+    """Returns items streamed by the server."""
+    return [item async for item in q.stream(items, **kwargs)]
+
+
+class ExecutorE2ETest(unittest.TestCase):
+    """e2e tests for executors that run tasks on the server."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS), '--executor', 'thread'],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testProcess(self):
+        """Tests that tasks run in worker processes by default."""
+        pids = asyncio.get_event_loop().run_until_complete(
+            run_tasks(q1, os.getpid))
+        self.assertNotIn(self.p1.pid, pids)
+
+    def testThread(self):
+        """Tests that tasks run in threads of the server."""
+        loop = asyncio.get_event_loop()
+        pids = loop.run_until_complete(
+            run_tasks(q1, os.getpid, executor='thread'))
+        self.assertEqual(set(pids), {self.p1.pid})
+        pids = loop.run_until_complete(run_tasks(q1, get_pid_in_thread))
+        self.assertEqual(set(pids), {self.p1.pid})
+        pids = loop.run_until_complete(
+            run_tasks(q1, get_pid_in_thread, executor='process'))
+        self.assertNotIn(self.p1.pid, pids)
+
+    def testAsync(self):
+        """Tests that coroutine functions run concurrently in event loop."""
+        start = time.monotonic()
+        pids = asyncio.get_event_loop().run_until_complete(
+            run_tasks(q1, sleep_and_get_pid, executor='async'))
+        self.assertEqual(set(pids), {self.p1.pid})
+        self.assertLess(time.monotonic() - start, TASK_TIME * NUM_RUNS / 2)
+
+    def testStream(self):
+        """Tests streams in threads."""
+        loop = asyncio.get_event_loop()
+        self.assertEqual(loop.run_until_complete(
+            stream_pids(q1, executor='thread')), [self.p1.pid])
+        self.assertNotEqual(loop.run_until_complete(
+            stream_pids(q1)), [self.p1.pid])
+
+    def testDefaultExecutor(self):
+        """Tests server that runs tasks in threads by default."""
+        loop = asyncio.get_event_loop()
+        pids = loop.run_until_complete(run_tasks(q2, os.getpid))
+        self.assertEqual(set(pids), {self.p2.pid})
+        pids = loop.run_until_complete(
+            run_tasks(q2, os.getpid, executor='process'))
+        self.assertNotIn(self.p2.pid, pids)
+
+    def testUnknownExecutor(self):
+        """Tests that unknown executor is rejected."""
+        with self.assertRaises(ValueError):
+            asyncio.get_event_loop().run_until_complete(
+                q1.q(os.getpid, executor='gpu'))
+        with self.assertRaises(ValueError):
+            atq.run_in('gpu')
@@ -0,0 +1,85 @@
+"""End to end tests for function registration."""
+import asyncio
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import Q
+from atq import protocol
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 20  # Number of runs in tests.
+
+q = Q([
+    (HOST, PORT)
+])
+
+
+def make_adder(n):
+    """Returns closure that adds n to its argument."""
+    return lambda x: x + n
+
+
+async def closures_test():
+    """Runs several closures in the task queue."""
+    add1, add2 = make_adder(1), make_adder(2)
+    return await asyncio.gather(*[
+        q.q(add, x) for add in (add1, add2) for x in range(NUM_RUNS)])
+
+
+async def register_test():
+    """Registers function explicitly and runs it in the task queue."""
+    add3 = make_adder(3)
+    await q.register(add3)
+    return await q.q(add3, 1)
+
+
+async def evicted_function_test():
+    """Runs function that server doesn't know about anymore."""
+    add4 = make_adder(4)
+    await q.register(add4)
+    func_id = b'x' * protocol.FUNCTION_ID_SIZE
+    connection = await q._get_connection((HOST, PORT))  # pylint: disable=protected-access
+    # Marks function registered without server knowing about it.
+    connection.functions.add(func_id)
+    serialized_func = q._functions.get(add4)[1]  # pylint: disable=protected-access
+    q._functions.put(add4, (func_id, serialized_func))  # pylint: disable=protected-access
+    return await q.q(add4, 1)
+
+
+class FunctionsE2ETest(unittest.TestCase):
+    """e2e tests for function registration."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testClosures(self):
+        """Tests running different closures of the same function."""
+        result = asyncio.get_event_loop().run_until_complete(closures_test())
+        self.assertEqual(
+            result, [x + 1 for x in range(NUM_RUNS)] +
+            [x + 2 for x in range(NUM_RUNS)])
+
+    def testRegister(self):
+        """Tests explicit function registration."""
+        result = asyncio.get_event_loop().run_until_complete(register_test())
+        self.assertEqual(result, 4)
+
+    def testEvictedFunction(self):
+        """Tests function upload when server doesn't know function id."""
+        result = asyncio.get_event_loop().run_until_complete(
+            evicted_function_test())
+        self.assertEqual(result, 5)
@@ -0,0 +1,127 @@
+"""End to end tests for concurrent.futures interface of the client."""
+import concurrent.futures
+import gc
+import operator
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import bench
+from atq import QExecutor
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_ITEMS = 1000  # Number of items to map over.
+NUM_THREADS = 8  # Number of threads that submit calls.
+TASK_TIME = 1  # seconds
+
+
+def fail_on(x, bad):
+    """Raises exception if x equals bad."""
+    if x == bad:
+        raise ValueError(x)
+    return x
+
+
+def sleep_and_return(x):
+    """Returns x after a while."""
+    time.sleep(TASK_TIME)
+    return x
+
+
+class FuturesE2ETest(unittest.TestCase):
+    """e2e tests for QExecutor."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+        cls.executor = QExecutor([(HOST1, PORT1), (HOST2, PORT2)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testSubmit(self):
+        """Tests that calls submitted from many threads run."""
+        with concurrent.futures.ThreadPoolExecutor(NUM_THREADS) as threads:
+            futures = list(threads.map(
+                lambda i: self.executor.submit(operator.mul, i, i),
+                range(NUM_ITEMS)))
+        self.assertEqual([future.result() for future in futures],
+                         [i * i for i in range(NUM_ITEMS)])
+
+    def testException(self):
+        """Tests that exception of the call is set in its future."""
+        future = self.executor.submit(fail_on, 1, 1)
+        self.assertIsInstance(future.exception(), ValueError)
+
+    def testMap(self):
+        """Tests map with different chunk sizes."""
+        xs, ys = range(NUM_ITEMS), range(NUM_ITEMS, 0, -1)
+        for chunksize in (1, 7, NUM_ITEMS):
+            self.assertEqual(
+                list(self.executor.map(operator.add, xs, ys,
+                                       chunksize=chunksize)),
+                [NUM_ITEMS] * NUM_ITEMS)
+
+    def testMapException(self):
+        """Tests that exception of any call is raised by map iterator."""
+        with self.assertRaises(ValueError):
+            list(self.executor.map(fail_on, range(10), [5] * 10))
+
+    def testMapTimeout(self):
+        """Tests that map iterator raises TimeoutError."""
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            list(self.executor.map(sleep_and_return, range(2),
+                                   timeout=TASK_TIME / 10))
+
+    def testMapCancelled(self):
+        """Tests that map iterator raises CancelledError when shutdown
+        cancels its calls."""
+        executor = QExecutor([(HOST1, PORT1)])
+        results = executor.map(sleep_and_return, range(4 * NUM_WORKERS),
+                               timeout=8 * TASK_TIME)
+        with concurrent.futures.ThreadPoolExecutor(1) as threads:
+            iterated = threads.submit(list, results)
+            time.sleep(TASK_TIME / 2)
+            executor.shutdown(wait=False, cancel_futures=True)
+            with self.assertRaises(concurrent.futures.CancelledError):
+                iterated.result()
+        executor.shutdown()
+
+    def testShutdown(self):
+        """Tests that shutdown waits for calls and rejects new ones."""
+        executor = QExecutor([(HOST1, PORT1)])
+        with executor:
+            future = executor.submit(sleep_and_return, 1)
+        self.assertEqual(future.result(timeout=0), 1)
+        self.assertFalse(executor._thread.is_alive())  # pylint: disable=protected-access
+        with self.assertRaises(RuntimeError):
+            executor.submit(sleep_and_return, 1)
+
+    def testMapDropped(self):
+        """Tests that dropping map iterator cancels its calls."""
+        executor = QExecutor([(HOST1, PORT1)])
+        start = time.monotonic()
+        results = executor.map(sleep_and_return, range(4 * NUM_WORKERS))
+        del results
+        gc.collect()
+        executor.shutdown()
+        self.assertLess(time.monotonic() - start, 2 * TASK_TIME)
@@ -0,0 +1,92 @@
+"""End to end tests for health checks of task queue servers."""
+import asyncio
+import operator
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import bench
+from atq import scheduler
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 20  # Number of runs in tests.
+HEALTH_CHECK_INTERVAL = 0.1  # seconds
+
+
+q = Q([
+    (HOST1, PORT1),
+    (HOST2, PORT2),
+], health_check_interval=HEALTH_CHECK_INTERVAL)
+
+
+def start_server(host, port):
+    """Starts server and waits until it accepts connections."""
+    test_env = os.environ.copy()
+    test_env["PYTHONPATH"] = TESTS_PATH
+    process = subprocess.Popen(
+        ['python3', '-m', 'atq', '-H', host, '-p', str(port),
+         '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+    bench.wait_for_server(host, port, process)
+    return process
+
+
+def stop_server(process):
+    """Stops server."""
+    os.kill(process.pid, signal.SIGINT)
+    process.communicate()
+
+
+async def tasks_test():
+    """Runs tasks and returns their results."""
+    return await asyncio.gather(*[
+        q.q(operator.add, x, 1) for x in range(NUM_RUNS)])
+
+
+async def wait_for_state(server, state, timeout=5):
+    """Waits until circuit of the server gets to the state."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if q.stats().get(server, {}).get('state') == state:
+            return True
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL / 2)
+    return False
+
+
+class HealthE2ETest(unittest.TestCase):
+    """e2e tests for health checks of task queue servers."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.p1 = start_server(HOST1, PORT1)
+        cls.p2 = start_server(HOST2, PORT2)
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in (cls.p1, cls.p2):
+            if process.poll() is None:
+                stop_server(process)
+
+    def testServerRestart(self):
+        """Tests that dead server is avoided and used again when it's back."""
+        loop = asyncio.get_event_loop()
+        expected = [x + 1 for x in range(NUM_RUNS)]
+        self.assertEqual(loop.run_until_complete(tasks_test()), expected)
+
+        stop_server(self.p2)
+        self.assertTrue(loop.run_until_complete(
+            wait_for_state((HOST2, PORT2), scheduler.OPEN)))
+        start = time.monotonic()
+        self.assertEqual(loop.run_until_complete(tasks_test()), expected)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(q.stats()[(HOST1, PORT1)]['state'], scheduler.CLOSED)
+
+        self.__class__.p2 = start_server(HOST2, PORT2)
+        self.assertTrue(loop.run_until_complete(
+            wait_for_state((HOST2, PORT2), scheduler.CLOSED)))
+        self.assertEqual(loop.run_until_complete(tasks_test()), expected)
@@ -0,0 +1,166 @@
+"""End to end tests for journal of tasks and retries of tasks."""
+import asyncio
+import os
+import signal
+import subprocess
+import tempfile
+import time
+import unittest
+
+from atq import atqclient
+from atq import bench
+from atq import journal
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 20  # Number of runs in tests.
+TASK_TIME = 1  # seconds
+KILL_DELAY = 0.3  # seconds
+BUSY_TIME = 10  # seconds
+JOURNAL_SIZE = 3  # Number of completed tasks remembered.
+
+events = []
+q = Q([(HOST1, PORT1), (HOST2, PORT2)], observers=[events.append])
+
+
+def slow_square(x):
+    """Returns square of x after a while."""
+    time.sleep(TASK_TIME)
+    return x * x
+
+
+async def completed_test():
+    """Runs tasks on the server with journal and asks which it completed."""
+    del events[:]
+    q._load[(HOST2, PORT2)].busy(BUSY_TIME)  # pylint: disable=protected-access
+    try:
+        results = await asyncio.gather(*[
+            q.q(pow, i, 2) for i in range(NUM_RUNS)])
+    finally:
+        q._load[(HOST2, PORT2)].busy_until = 0  # pylint: disable=protected-access
+    task_ids = [event.task_id for event in events]
+    unknown_id = bytes(len(task_ids[0]))
+    completed = await q.completed_tasks(
+        (HOST1, PORT1), task_ids + [unknown_id])
+    return results, set(task_ids), completed
+
+
+async def crash_test(server, retry):
+    """Runs task on the first server and kills it while task runs."""
+    del events[:]
+    q._load[(HOST2, PORT2)].busy(BUSY_TIME)  # pylint: disable=protected-access
+    try:
+        future = asyncio.ensure_future(q.q(
+            slow_square, 5, retry=retry))
+        await asyncio.sleep(KILL_DELAY)
+    finally:
+        q._load[(HOST2, PORT2)].busy_until = 0  # pylint: disable=protected-access
+    os.killpg(server.pid, signal.SIGKILL)
+    server.communicate()
+    return await future
+
+
+async def compaction_test(path):
+    """Completes tasks with journal that remembers few of them."""
+    task_journal = journal.Journal(path, JOURNAL_SIZE)
+    task_ids = [bytes([i]) * 16 for i in range(NUM_RUNS)]
+    try:
+        for task_id in task_ids:
+            task_journal.append(journal.ACCEPTED, task_id)
+            task_journal.append(journal.COMPLETED, task_id)
+            await task_journal.sync()
+    finally:
+        task_journal.close()
+    return task_ids, task_journal.compactions, os.path.getsize(path)
+
+
+class JournalE2ETest(unittest.TestCase):
+    """e2e tests for journal of tasks and retries of tasks."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_env = os.environ.copy()
+        cls.test_env["PYTHONPATH"] = TESTS_PATH
+        cls.journal_dir = tempfile.TemporaryDirectory()
+        cls.journal_path = os.path.join(cls.journal_dir.name, 'journal')
+        cls.p1 = cls._start_journaled()
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS)], env=cls.test_env,
+            stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def _start_journaled(cls):
+        """Starts server with journal in its own process group, so it's
+        killed together with its workers."""
+        server = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS), '--journal', cls.journal_path],
+            env=cls.test_env, stderr=subprocess.DEVNULL,
+            start_new_session=True)
+        bench.wait_for_server(HOST1, PORT1, server)
+        return server
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+        cls.journal_dir.cleanup()
+
+    def testCompleted(self):
+        """Tests that server with journal reports completed tasks."""
+        results, task_ids, completed = (
+            asyncio.get_event_loop().run_until_complete(completed_test()))
+        self.assertEqual(results, [i * i for i in range(NUM_RUNS)])
+        self.assertEqual(completed, task_ids)
+
+    def testCompaction(self):
+        """Tests that journal forgets old tasks and stays bounded."""
+        path = os.path.join(self.journal_dir.name, 'compacted')
+        task_ids, compactions, size = (
+            asyncio.get_event_loop().run_until_complete(
+                compaction_test(path)))
+        self.assertGreater(compactions, 0)
+        self.assertLessEqual(size, journal.COMPACTION_FACTOR * JOURNAL_SIZE *
+                             journal.RECORD.size)
+        reopened = journal.Journal(path, JOURNAL_SIZE)
+        reopened.close()
+        self.assertEqual(list(reopened.completed), task_ids[-JOURNAL_SIZE:])
+        self.assertEqual(os.path.getsize(path),
+                         JOURNAL_SIZE * journal.RECORD.size)
+
+    def testNoJournal(self):
+        """Tests that server without journal can't report tasks."""
+        with self.assertRaises(journal.NoJournalError):
+            asyncio.get_event_loop().run_until_complete(
+                q.completed_tasks((HOST2, PORT2), [bytes(16)]))
+
+    def testRetry(self):
+        """Tests that task is retried on another server and
+        restarted server reports tasks it completed before crash."""
+        loop = asyncio.get_event_loop()
+        _, completed_ids, _ = loop.run_until_complete(completed_test())
+        result = loop.run_until_complete(crash_test(self.p1, True))
+        event = events[0]
+        type(self).p1 = self._start_journaled()
+        completed = loop.run_until_complete(q.completed_tasks(
+            (HOST1, PORT1), list(completed_ids) + [event.task_id]))
+        self.assertEqual(result, 25)
+        self.assertEqual(event.server, (HOST2, PORT2))
+        self.assertIn((HOST1, PORT1), event.connect_failures)
+        self.assertEqual(completed, completed_ids)
+
+    def testNoRetry(self):
+        """Tests that task is not retried unless it may be."""
+        try:
+            with self.assertRaises(atqclient.WorkerConnectionError):
+                asyncio.get_event_loop().run_until_complete(
+                    crash_test(self.p1, False))
+        finally:
+            type(self).p1 = self._start_journaled()
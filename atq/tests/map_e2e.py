@@ -0,0 +1,77 @@
+"""End to end tests for batch submission with multiple servers."""
+import asyncio
+import operator
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_ITEMS = 1000  # Number of items to map over.
+
+
+q = Q([
+    (HOST1, PORT1),
+    (HOST2, PORT2),
+])
+
+
+def fail_on(x, bad):
+    """Raises exception if x equals bad."""
+    if x == bad:
+        raise ValueError(x)
+    return x
+
+
+async def collect(results):
+    """Collects results of async iterator into a list."""
+    return [result async for result in results]
+
+
+class MapE2ETest(unittest.TestCase):
+    """e2e tests for map and starmap."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testMap(self):
+        """Tests ordered map with different chunk sizes."""
+        xs, ys = range(NUM_ITEMS), range(NUM_ITEMS, 0, -1)
+        for chunksize in (1, 7, NUM_ITEMS):
+            result = asyncio.get_event_loop().run_until_complete(collect(
+                q.map(operator.mul, xs, ys, chunksize=chunksize)))
+            self.assertEqual(result, list(map(operator.mul, xs, ys)))
+
+    def testStarmapUnordered(self):
+        """Tests unordered starmap."""
+        args = [(x, 1) for x in range(NUM_ITEMS)]
+        result = asyncio.get_event_loop().run_until_complete(collect(
+            q.starmap(operator.add, args, chunksize=10, ordered=False)))
+        self.assertEqual(sorted(result), list(range(1, NUM_ITEMS + 1)))
+
+    def testExceptions(self):
+        """Tests exception raised by one of the calls."""
+        with self.assertRaises(ValueError):
+            asyncio.get_event_loop().run_until_complete(collect(
+                q.starmap(fail_on, [(x, 42) for x in range(NUM_ITEMS)],
+                          chunksize=10)))
@@ -0,0 +1,132 @@
+"""End to end tests for map-reduce."""
+import asyncio
+import collections
+import operator
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import bench
+from atq import mapreduce
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_TEXTS = 50
+FANIN = 3
+
+events = []
+q = Q([(HOST1, PORT1), (HOST2, PORT2)], observers=[events.append])
+
+
+def make_text(i):
+    """Returns text with words that depend on i."""
+    return ' '.join('word%d' % (j % (i + 1)) for j in range(100))
+
+
+def count_words(text):
+    """Returns number of occurrences of every word of the text."""
+    return collections.Counter(text.split())
+
+
+def fail_on_ten(x):
+    """Raises exception for 10."""
+    if x == 10:
+        raise ValueError('Hello, world!')
+    return x
+
+
+async def word_count_test(chunksize):
+    """Counts words of all texts."""
+    del events[:]
+    texts = [make_text(i) for i in range(NUM_TEXTS)]
+    counts = await q.map_reduce(count_words, operator.add, texts,
+                                chunksize=chunksize, fanin=FANIN)
+    return counts, events[:]
+
+
+async def ordered_test():
+    """Concatenates lists in order of items."""
+    return await q.map_reduce(lambda x: [x], operator.add, range(NUM_TEXTS),
+                              chunksize=4, fanin=FANIN)
+
+
+async def bounded_test():
+    """Maps more chunks than are allowed in flight and records number of
+    finished tasks when every item is taken."""
+    del events[:]
+    finished = []
+
+    def items():
+        for i in range(mapreduce.MAX_CHUNKS_IN_FLIGHT * 2):
+            finished.append(len(events))
+            yield i
+
+    total = await q.map_reduce(abs, operator.add, items(), fanin=FANIN)
+    return total, finished
+
+
+class MapReduceE2ETest(unittest.TestCase):
+    """e2e tests for map-reduce."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testWordCount(self):
+        """Tests that words are counted by tree of tasks."""
+        expected = collections.Counter()
+        for i in range(NUM_TEXTS):
+            expected.update(make_text(i).split())
+        for chunksize in (1, 7, NUM_TEXTS):
+            counts, task_events = asyncio.get_event_loop().run_until_complete(
+                word_count_test(chunksize))
+            self.assertEqual(counts, expected)
+            # Tasks return only sizes of partial results.
+            self.assertLess(
+                max(event.result_size for event in task_events), 64)
+
+    def testOrdered(self):
+        """Tests that results are reduced in order of items."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(ordered_test()),
+            list(range(NUM_TEXTS)))
+
+    def testException(self):
+        """Tests that exception of mapper is raised."""
+        with self.assertRaisesRegex(ValueError, 'Hello, world!'):
+            asyncio.get_event_loop().run_until_complete(q.map_reduce(
+                fail_on_ten, operator.add, range(NUM_TEXTS), fanin=FANIN))
+
+    def testBounded(self):
+        """Tests that iterable is consumed as chunks finish."""
+        total, finished = asyncio.get_event_loop().run_until_complete(
+            bounded_test())
+        self.assertEqual(total, sum(range(len(finished))))
+        self.assertEqual(finished[mapreduce.MAX_CHUNKS_IN_FLIGHT - 1], 0)
+        self.assertGreater(finished[mapreduce.MAX_CHUNKS_IN_FLIGHT], 0)
+
+    def testEmpty(self):
+        """Tests that empty iterable is rejected."""
+        with self.assertRaises(TypeError):
+            asyncio.get_event_loop().run_until_complete(
+                q.map_reduce(count_words, operator.add, []))
@@ -0,0 +1,114 @@
+"""End to end tests for adding and removing task queue servers."""
+import asyncio
+import operator
+import os
+import signal
+import subprocess
+import tempfile
+import time
+import unittest
+
+from atq import bench
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 10  # Number of runs in tests.
+SLOW_TASK_TIME = 0.5  # seconds
+DISCOVERY_INTERVAL = 0.1  # seconds
+
+
+async def tasks_test(q):
+    """Runs tasks and checks their results."""
+    results = await asyncio.gather(*[
+        q.q(operator.add, x, 1) for x in range(NUM_RUNS)])
+    assert results == [x + 1 for x in range(NUM_RUNS)]
+
+
+def tasks_per_server(q):
+    """Returns number of tasks run by every server."""
+    return {server: server_stats.get('tasks', 0)
+            for server, server_stats in q.stats().items()}
+
+
+async def remove_test(q):
+    """Removes server while task is running on it.
+
+    Returns:
+        Result of the task and time spent removing the server.
+    """
+    task = asyncio.ensure_future(q.q(time.sleep, SLOW_TASK_TIME))
+    await asyncio.sleep(SLOW_TASK_TIME / 5)
+    q.add_server((HOST1, PORT1))
+    start = time.monotonic()
+    await q.remove_server((HOST2, PORT2))
+    return await task, time.monotonic() - start
+
+
+class MembershipE2ETest(unittest.TestCase):
+    """e2e tests for adding and removing task queue servers."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.processes = []
+        for host, port in ((HOST1, PORT1), (HOST2, PORT2)):
+            process = subprocess.Popen(
+                ['python3', '-m', 'atq', '-H', host, '-p', str(port),
+                 '-w', str(NUM_WORKERS)], env=test_env,
+                stderr=subprocess.DEVNULL)
+            cls.processes.append(process)
+            bench.wait_for_server(host, port, process)
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in cls.processes:
+            os.kill(process.pid, signal.SIGINT)
+            process.communicate()
+
+    def testAddServer(self):
+        """Tests that added server gets tasks."""
+        q = Q([(HOST1, PORT1)])
+        q.add_server((HOST2, PORT2))
+        loop = asyncio.get_event_loop()
+        for _ in range(NUM_RUNS):
+            loop.run_until_complete(tasks_test(q))
+        q.close()
+        tasks = tasks_per_server(q)
+        self.assertGreater(tasks[(HOST1, PORT1)], 0)
+        self.assertGreater(tasks[(HOST2, PORT2)], 0)
+
+    def testRemoveServer(self):
+        """Tests that removed server finishes its tasks and gets no more."""
+        q = Q([(HOST2, PORT2)])
+        loop = asyncio.get_event_loop()
+        result, remove_time = loop.run_until_complete(remove_test(q))
+        self.assertIsNone(result)
+        self.assertGreater(remove_time, SLOW_TASK_TIME / 2)
+        self.assertEqual(tasks_per_server(q)[(HOST2, PORT2)], 1)
+        loop.run_until_complete(tasks_test(q))
+        q.close()
+        tasks = tasks_per_server(q)
+        self.assertEqual(tasks[(HOST2, PORT2)], 1)
+        self.assertEqual(tasks[(HOST1, PORT1)], NUM_RUNS)
+
+    def testFileDiscovery(self):
+        """Tests that servers follow the discovery file."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'servers')
+            with open(path, 'w', encoding='utf-8') as servers_file:
+                servers_file.write('# Servers\n%s:%s\n' % (HOST1, PORT1))
+            q = Q([], discovery=path, discovery_interval=DISCOVERY_INTERVAL)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(tasks_test(q))
+            with open(path, 'w', encoding='utf-8') as servers_file:
+                servers_file.write('%s:%s\n' % (HOST2, PORT2))
+            loop.run_until_complete(asyncio.sleep(DISCOVERY_INTERVAL * 3))
+            loop.run_until_complete(tasks_test(q))
+            q.close()
+        tasks = tasks_per_server(q)
+        self.assertEqual(tasks[(HOST1, PORT1)], NUM_RUNS)
+        self.assertEqual(tasks[(HOST2, PORT2)], NUM_RUNS)
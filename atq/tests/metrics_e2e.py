@@ -0,0 +1,93 @@
+"""End to end tests for server metrics."""
+import asyncio
+import operator
+import os
+import re
+import signal
+import subprocess
+import unittest
+import urllib.error
+import urllib.request
+
+from atq import Q
+from atq import bench
+
+HOST, PORT = 'localhost', 12345
+METRICS_PORT = 12355
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 10  # Number of runs in tests.
+METRICS_URL = 'http://%s:%s/metrics' % (HOST, METRICS_PORT)
+
+q = Q([
+    (HOST, PORT)
+])
+
+
+def fail():
+    """Raises exception."""
+    raise ValueError('Hello, world!')
+
+
+async def tasks_test():
+    """Runs successful and failed tasks."""
+    await asyncio.gather(*[q.q(operator.add, x, 1) for x in range(NUM_RUNS)])
+    try:
+        await q.q(fail)
+    except ValueError:
+        pass
+
+
+def _sample(text, name):
+    """Returns value of the sample from metrics text."""
+    match = re.search(r'^%s (\S+)$' % re.escape(name), text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+class MetricsE2ETest(unittest.TestCase):
+    """e2e tests for server metrics."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS), '--metrics-port', str(METRICS_PORT),
+             '--task-log-rate', '0'],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST, METRICS_PORT, cls.p)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testMetrics(self):
+        """Tests counters and histograms of tasks."""
+        asyncio.get_event_loop().run_until_complete(tasks_test())
+        with urllib.request.urlopen(METRICS_URL) as response:
+            text = response.read().decode()
+        self.assertEqual(
+            _sample(text, 'atq_tasks_received_total'), NUM_RUNS + 1)
+        self.assertEqual(
+            _sample(text, 'atq_tasks_completed_total{function="add"}'),
+            NUM_RUNS)
+        self.assertEqual(
+            _sample(text, 'atq_tasks_failed_total{function="fail"}'), 1)
+        self.assertEqual(
+            _sample(text, 'atq_execution_seconds_count{function="add"}'),
+            NUM_RUNS)
+        self.assertEqual(
+            _sample(text, 'atq_executor_wait_seconds_bucket{le="+Inf"}'),
+            NUM_RUNS + 1)
+        self.assertEqual(_sample(text, 'atq_queue_depth'), 0)
+        self.assertGreater(_sample(text, 'atq_received_bytes_total'), 0)
+        self.assertGreater(_sample(text, 'atq_sent_bytes_total'), 0)
+        self.assertEqual(_sample(text, 'atq_worker_restarts_total'), 0)
+
+    def testNotFound(self):
+        """Tests unknown path of metrics endpoint."""
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(METRICS_URL + '/unknown')
+        self.assertEqual(context.exception.code, 404)
@@ -0,0 +1,144 @@
+"""End to end tests for objects stored on servers."""
+import asyncio
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import atqclient
+from atq import bench
+from atq import objects
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 10  # Number of runs in tests.
+OBJECT_STORE_SIZE = 1  # megabytes
+TABLE_SIZE = 20000  # Number of items in the table.
+
+servers = []
+q = Q([(HOST1, PORT1), (HOST2, PORT2)],
+      observers=[lambda event: servers.append(event.server)])
+small_q = Q([(HOST2, PORT2)])
+
+
+class Box:
+    """Object that hides ref from the client."""
+    def __init__(self, ref):
+        self.ref = ref
+
+
+def make_table():
+    """Returns large dict."""
+    return {i: 'value%d' % i for i in range(TABLE_SIZE)}
+
+
+def lookup(table, key):
+    """Returns value of the key."""
+    return table[key]
+
+
+def lookup_all(tables, key):
+    """Returns values of the key in all tables."""
+    return [table[key] for table in tables['tables']]
+
+
+def lookup_boxed(box, key):
+    """Returns value of the key in boxed table."""
+    return box.ref[key]
+
+
+def lookup_stream(table, keys):
+    """Yields values of the keys."""
+    for key in keys:
+        yield table[key]
+
+
+async def lookup_test():
+    """Runs tasks that use stored object."""
+    ref = await q.put(make_table())
+    del servers[:]
+    results = [await q.q(lookup, ref, i) for i in range(NUM_RUNS)]
+    results.append(await q.q(lookup_all, {'tables': [ref, ref]}, 1))
+    results.append(await q.q(lookup, ref, 2, cache=True))
+    # Sequential tasks go to the server that has the object.
+    used_servers = set(servers)
+    holders = set(q._objects[ref.object_id].servers)  # pylint: disable=protected-access
+    results.extend([value async for value in q.starmap(
+        lookup, [(ref, i) for i in range(NUM_RUNS)])])
+    results.extend([value async for value in q.stream(
+        lookup_stream, ref, range(NUM_RUNS))])
+    return results, used_servers, holders
+
+
+async def evicted_test():
+    """Runs tasks with objects that don't fit into the store together."""
+    refs = [await small_q.put(bytes(600 * 1024)) for _ in range(2)]
+    return [await small_q.q(len, ref) for ref in refs]
+
+
+async def released_test():
+    """Runs task with released object."""
+    ref = await q.put(make_table())
+    await q.release(ref)
+    return await q.q(lookup, ref, 1)
+
+
+async def hidden_ref_test():
+    """Runs task with ref that client doesn't see."""
+    ref = await q.put(make_table())
+    return await q.q(lookup_boxed, Box(ref), 1)
+
+
+class ObjectsE2ETest(unittest.TestCase):
+    """e2e tests for objects stored on servers."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS), '--object-store-size',
+             str(OBJECT_STORE_SIZE)],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testLookup(self):
+        """Tests that tasks get stored object on the server that has it."""
+        results, used_servers, holders = (
+            asyncio.get_event_loop().run_until_complete(lookup_test()))
+        values = ['value%d' % i for i in range(NUM_RUNS)]
+        self.assertEqual(results, values + [['value1', 'value1'], 'value2'] +
+                         values + values)
+        self.assertEqual(len(holders), 1)
+        self.assertEqual(used_servers, holders)
+
+    def testEvicted(self):
+        """Tests that object dropped by the server is uploaded again."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(evicted_test()),
+            [600 * 1024] * 2)
+
+    def testReleased(self):
+        """Tests that released object can't be used."""
+        with self.assertRaises(atqclient.ObjectReleasedError):
+            asyncio.get_event_loop().run_until_complete(released_test())
+
+    def testHiddenRef(self):
+        """Tests that ref hidden in other object can't be resolved."""
+        with self.assertRaises(objects.ObjectNotFoundError):
+            asyncio.get_event_loop().run_until_complete(hidden_ref_test())
@@ -0,0 +1,73 @@
+"""End to end tests for offloading tasks to peer servers."""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import bench
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS1, NUM_WORKERS2 = 1, 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 6  # Number of runs in tests.
+TASK_TIME = 0.3  # seconds
+OFFLOAD_INTERVAL = 0.05  # seconds
+
+
+q = Q([(HOST1, PORT1)])
+
+
+def sleep_and_get_pid():
+    """Sleeps and returns pid of the worker process."""
+    time.sleep(TASK_TIME)
+    return os.getpid()
+
+
+async def offload_test():
+    """Runs more tasks than the only server known to client has workers.
+
+    Returns:
+        Pids of workers that ran the tasks.
+    """
+    return await asyncio.gather(*[
+        q.q(sleep_and_get_pid) for _ in range(NUM_RUNS)])
+
+
+class OffloadE2ETest(unittest.TestCase):
+    """e2e tests for offloading tasks to peer servers."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS1), '--peer', '%s:%s' % (HOST2, PORT2),
+             '--offload-interval', str(OFFLOAD_INTERVAL)],
+            env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS2)], env=test_env,
+            stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testOffload(self):
+        """Tests that waiting tasks run on idle peer."""
+        start = time.monotonic()
+        pids = asyncio.get_event_loop().run_until_complete(offload_test())
+        duration = time.monotonic() - start
+        self.assertEqual(len(pids), NUM_RUNS)
+        self.assertGreater(len(set(pids)), NUM_WORKERS1)
+        self.assertLess(duration, NUM_RUNS * TASK_TIME * 0.75)
@@ -0,0 +1,97 @@
+"""End to end tests for task priorities and named queues."""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import bench
+from atq import Q
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 1
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 8  # Number of runs in tests.
+BLOCK_TIME = 0.5  # seconds
+ARRIVAL_TIME = 0.05  # seconds
+
+
+q = Q([(HOST, PORT)])
+
+
+async def block_worker():
+    """Occupies the only worker, so following tasks have to wait."""
+    blocker = asyncio.ensure_future(q.q(time.sleep, BLOCK_TIME))
+    await asyncio.sleep(BLOCK_TIME / 5)
+    return blocker
+
+
+async def priority_test():
+    """Runs low priority tasks followed by high priority one.
+
+    Returns:
+        Completion times of low priority tasks and of high priority task.
+    """
+    blocker = await block_worker()
+    low = [asyncio.ensure_future(q.q(time.time, priority=-1))
+           for _ in range(NUM_RUNS)]
+    await asyncio.sleep(ARRIVAL_TIME)
+    high = await q.q(time.time, priority=1)
+    await blocker
+    return await asyncio.gather(*low), high
+
+
+async def queues_test():
+    """Runs batch tasks followed by interactive ones.
+
+    Returns:
+        Names of queues of the tasks in order of their completion.
+    """
+    blocker = await block_worker()
+    tasks = []
+    for queue in ('batch', 'interactive'):
+        tasks.extend(
+            (queue, asyncio.ensure_future(q.q(time.time, queue=queue)))
+            for _ in range(NUM_RUNS))
+        await asyncio.sleep(ARRIVAL_TIME)
+    await blocker
+    finished = [(await task, queue) for queue, task in tasks]
+    return [queue for _, queue in sorted(finished)]
+
+
+class PriorityE2ETest(unittest.TestCase):
+    """e2e tests for task priorities and named queues."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS), '--queue-weight', 'interactive=3'],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST, PORT, cls.p)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testPriority(self):
+        """Tests that high priority task goes before waiting ones."""
+        low, high = asyncio.get_event_loop().run_until_complete(
+            priority_test())
+        self.assertLess(high, min(low))
+
+    def testQueueWeights(self):
+        """Tests that queues share workers by their weights."""
+        order = asyncio.get_event_loop().run_until_complete(queues_test())
+        self.assertGreaterEqual(order[:NUM_RUNS].count('interactive'),
+                                NUM_RUNS * 5 // 8)
+
+    def testInvalidQueue(self):
+        """Tests that too long queue name is rejected."""
+        with self.assertRaises(ValueError):
+            asyncio.get_event_loop().run_until_complete(
+                q.q(time.time, queue='x' * 256))
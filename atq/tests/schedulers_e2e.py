@@ -0,0 +1,73 @@
+"""End to end tests for scheduling strategies with multiple servers."""
+import asyncio
+import itertools
+import operator
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import Q
+from atq import scheduler
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS1, NUM_WORKERS2 = 1, 3
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 50  # Number of runs in tests.
+WORKERS = [(HOST1, PORT1), (HOST2, PORT2)]
+
+
+def round_robin_scheduler(workers, load):  # pylint: disable=unused-argument
+    """Custom scheduler that picks workers in turn."""
+    return itertools.cycle(workers)
+
+
+async def simple_test(q, x, y):
+    """Runs many tasks concurrently."""
+    return await asyncio.gather(*[
+        q.q(operator.add, x, y) for _ in range(NUM_RUNS)])
+
+
+class SchedulersE2ETest(unittest.TestCase):
+    """e2e tests for scheduling strategies."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS1)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS2)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testSchedulers(self):
+        """Tests running tasks with every scheduler."""
+        for strategy in (scheduler.random_scheduler,
+                         scheduler.least_outstanding_scheduler,
+                         scheduler.power_of_two_scheduler,
+                         scheduler.weighted_scheduler,
+                         round_robin_scheduler):
+            q = Q(WORKERS, scheduler=strategy)
+            result = asyncio.get_event_loop().run_until_complete(
+                simple_test(q, 1, 2))
+            self.assertEqual(result, [3] * NUM_RUNS)
+
+    def testLoadReports(self):
+        """Tests that servers report number of their workers."""
+        q = Q(WORKERS)
+        for _ in range(NUM_RUNS):
+            asyncio.get_event_loop().run_until_complete(simple_test(q, 1, 2))
+        load = q._load  # pylint: disable=protected-access
+        self.assertEqual(load[(HOST1, PORT1)].num_workers, NUM_WORKERS1)
+        self.assertEqual(load[(HOST2, PORT2)].num_workers, NUM_WORKERS2)
+        self.assertEqual(load[(HOST1, PORT1)].in_flight, 0)
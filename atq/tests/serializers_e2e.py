@@ -0,0 +1,112 @@
+"""End to end tests for serializers negotiated with servers."""
+import asyncio
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import bench
+from atq import serializers
+from atq import Q
+
+HOST1, PORT1 = 'localhost', 12345
+HOST2, PORT2 = 'localhost', 12346
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+PAYLOAD_SIZE = 1024 * 1024  # bytes
+
+pickle_q = Q([(HOST1, PORT1)], serializer=serializers.PICKLE)
+cloudpickle_q = Q([(HOST1, PORT1)], serializer=serializers.CLOUDPICKLE)
+fallback_q = Q([(HOST2, PORT2)], serializer=serializers.PICKLE)
+
+
+def reverse(data):
+    """Returns data in reverse order."""
+    return data[::-1]
+
+
+def chunks(data, size):
+    """Yields chunks of data."""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def run_tasks(q, data):
+    """Runs tasks with importable function, lambda and closure."""
+    offset = len(data)
+    return await asyncio.gather(
+        q.q(reverse, data),
+        q.q(lambda data: bytearray(data), data),  # pylint: disable=unnecessary-lambda
+        q.q(lambda: offset + 1),
+        q.q(reverse, (1, 'a', None)),
+        q.q(len, data, cache=True))
+
+
+async def stream_chunks(q, data, size):
+    """Returns chunks streamed by the server."""
+    return [chunk async for chunk in q.stream(chunks, data, size)]
+
+
+async def get_serializer(q, server_address):
+    """Returns name of serializer of the connection to the server."""
+    connection = await q._get_connection(server_address)  # pylint: disable=protected-access
+    return connection.serializer.name
+
+
+class SerializersE2ETest(unittest.TestCase):
+    """e2e tests for serializers negotiated with servers."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p1 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST1, '-p', str(PORT1),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+        cls.p2 = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST2, '-p', str(PORT2),
+             '-w', str(NUM_WORKERS), '--serializer', serializers.CLOUDPICKLE],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST1, PORT1, cls.p1)
+        bench.wait_for_server(HOST2, PORT2, cls.p2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p1.pid, signal.SIGINT)
+        os.kill(cls.p2.pid, signal.SIGINT)
+        cls.p1.communicate()
+        cls.p2.communicate()
+
+    def testHandshake(self):
+        """Tests that client uses serializer accepted by the server."""
+        loop = asyncio.get_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(get_serializer(pickle_q, (HOST1, PORT1))),
+            serializers.PICKLE)
+        self.assertEqual(
+            loop.run_until_complete(
+                get_serializer(fallback_q, (HOST2, PORT2))),
+            serializers.CLOUDPICKLE)
+
+    def testSerializers(self):
+        """Tests that clients with different serializers get the same
+        results."""
+        loop = asyncio.get_event_loop()
+        data = os.urandom(PAYLOAD_SIZE)
+        expected = [data[::-1], bytearray(data), PAYLOAD_SIZE + 1,
+                    (None, 'a', 1), PAYLOAD_SIZE]
+        for q in (pickle_q, cloudpickle_q, fallback_q):
+            self.assertEqual(loop.run_until_complete(run_tasks(q, data)),
+                             expected)
+
+    def testStream(self):
+        """Tests that stream items are deserialized."""
+        data = os.urandom(PAYLOAD_SIZE)
+        items = asyncio.get_event_loop().run_until_complete(
+            stream_chunks(pickle_q, data, PAYLOAD_SIZE // 4))
+        self.assertEqual(b''.join(items), data)
+
+    def testUnknownSerializer(self):
+        """Tests that unknown serializer is rejected."""
+        with self.assertRaises(serializers.UnknownSerializerError):
+            Q([(HOST1, PORT1)], serializer='yaml')
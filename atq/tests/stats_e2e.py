@@ -0,0 +1,85 @@
+"""End to end tests for client instrumentation."""
+import asyncio
+import itertools
+import operator
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import Q
+
+HOST, PORT = 'localhost', 12345
+MISSING_HOST, MISSING_PORT = 'localhost', 12347
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_RUNS = 10  # Number of runs in tests.
+
+
+def round_robin_scheduler(workers, load):  # pylint: disable=unused-argument
+    """Picks workers in turn."""
+    return itertools.cycle(workers)
+
+
+events = []
+q = Q([
+    (MISSING_HOST, MISSING_PORT),
+    (HOST, PORT),
+], scheduler=round_robin_scheduler, observers=[events.append])
+
+
+def fail():
+    """Raises exception."""
+    raise ValueError('Hello, world!')
+
+
+async def tasks_test():
+    """Runs successful and failed tasks."""
+    for x in range(NUM_RUNS):
+        await q.q(operator.add, x, 1)
+    try:
+        await q.q(fail)
+    except ValueError:
+        pass
+
+
+class StatsE2ETest(unittest.TestCase):
+    """e2e tests for client instrumentation."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testObserversAndStats(self):
+        """Tests task events and aggregated statistics."""
+        asyncio.get_event_loop().run_until_complete(tasks_test())
+        self.assertEqual(len(events), NUM_RUNS + 1)
+        for event in events:
+            self.assertEqual(event.server, (HOST, PORT))
+            self.assertGreater(event.task_size, 0)
+            self.assertGreater(event.result_size, 0)
+            self.assertGreater(event.request_time, 0)
+            self.assertGreaterEqual(event.total_time, event.request_time)
+        self.assertEqual(events[0].func_name, 'add')
+        self.assertIn((MISSING_HOST, MISSING_PORT), events[0].connect_failures)
+        self.assertIsNone(events[0].error)
+        self.assertIsInstance(events[-1].error, ValueError)
+
+        snapshot = q.stats()
+        server_stats = snapshot[(HOST, PORT)]
+        self.assertEqual(server_stats['tasks'], NUM_RUNS + 1)
+        self.assertEqual(server_stats['errors'], 1)
+        self.assertEqual(server_stats['in_flight'], 0)
+        self.assertEqual(server_stats['num_workers'], NUM_WORKERS)
+        self.assertGreater(server_stats['latency']['p99'], 0)
+        self.assertGreater(
+            snapshot[(MISSING_HOST, MISSING_PORT)]['connect_failures'], 0)
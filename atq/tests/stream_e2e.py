@@ -0,0 +1,160 @@
+"""End to end tests for streaming and large messages."""
+import asyncio
+import os
+import signal
+import subprocess
+import unittest
+
+from atq import compression
+from atq import Q
+from atq import protocol
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 2
+TESTS_PATH = 'atq/tests'
+NUM_ITEMS = 100  # Number of items in streams.
+ITEM_SIZE = 64 * 1024  # bytes
+MAX_MESSAGE_SIZE = 1024 * 1024  # bytes
+TIMEOUT = 5  # seconds
+
+q = Q([
+    (HOST, PORT)
+], max_message_size=MAX_MESSAGE_SIZE)
+compressed_q = Q([(HOST, PORT)], compression=compression.ZLIB)
+
+
+def generate_items(n):
+    """Yields n large items."""
+    for i in range(n):
+        yield i, bytes(ITEM_SIZE)
+
+
+def raise_in_generator():
+    """Yields item and raises exception."""
+    yield 0
+    raise ValueError('Hello, world!')
+
+
+async def stream_test(n):
+    """Collects numbers of streamed items."""
+    return [i async for i, _ in q.stream(generate_items, n)]
+
+
+async def early_close_test():
+    """Stops reading stream early and runs another stream."""
+    items = q.stream(generate_items, NUM_ITEMS * 10)
+    async for _ in items:
+        break
+    await items.aclose()
+    return await stream_test(1)
+
+
+async def exception_test():
+    """Reads stream of generator that raises exception."""
+    return [item async for item in q.stream(raise_in_generator)]
+
+
+async def large_function_test():
+    """Runs closure that is larger than maximum message size."""
+    data = bytes(MAX_MESSAGE_SIZE * 2)
+    return await asyncio.wait_for(q.q(lambda: len(data)), TIMEOUT)
+
+
+async def cancelled_message_test():
+    """Reads message cancelled before its last frame and the next one."""
+    reader = asyncio.StreamReader()
+    reader.feed_data(
+        protocol.HEADER.pack(3, 1, protocol.TASK | protocol.MORE) + b'abc')
+    reader.feed_data(protocol.HEADER.pack(0, 1, protocol.CANCEL))
+    reader.feed_data(protocol.HEADER.pack(3, 1, protocol.TASK) + b'xyz')
+    message_reader = protocol.MessageReader(reader)
+    return [(request_id, msg_type, bytes(payload))
+            for request_id, msg_type, payload in (
+                await message_reader.read(), await message_reader.read())]
+
+
+async def large_frame_test():
+    """Sends frame larger than frame size and reads what server answers."""
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write(protocol.HEADER.pack(
+        protocol.FRAME_SIZE + 1, 1, protocol.TASK))
+    try:
+        return await reader.read()
+    finally:
+        writer.close()
+
+
+class StreamE2ETest(unittest.TestCase):
+    """e2e tests for streaming and large messages."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS), '--max-message-size',
+             str(MAX_MESSAGE_SIZE)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testStream(self):
+        """Tests streaming of generator items."""
+        result = asyncio.get_event_loop().run_until_complete(
+            stream_test(NUM_ITEMS))
+        self.assertEqual(result, list(range(NUM_ITEMS)))
+
+    def testEarlyClose(self):
+        """Tests closing stream before generator is exhausted."""
+        result = asyncio.get_event_loop().run_until_complete(
+            early_close_test())
+        self.assertEqual(result, [0])
+
+    def testExceptions(self):
+        """Tests exception raised by generator."""
+        with self.assertRaises(ValueError):
+            asyncio.get_event_loop().run_until_complete(exception_test())
+
+    def testMessageTooLarge(self):
+        """Tests messages larger than maximum message size."""
+        with self.assertRaises(protocol.MessageTooLargeError):
+            asyncio.get_event_loop().run_until_complete(
+                q.q(bytes, MAX_MESSAGE_SIZE * 2))
+        with self.assertRaises(protocol.MessageTooLargeError):
+            asyncio.get_event_loop().run_until_complete(
+                q.q(len, bytes(MAX_MESSAGE_SIZE * 2)))
+        result = asyncio.get_event_loop().run_until_complete(
+            q.q(len, bytes(MAX_MESSAGE_SIZE // 2)))
+        self.assertEqual(result, MAX_MESSAGE_SIZE // 2)
+
+    def testFunctionTooLarge(self):
+        """Tests that function larger than maximum message size fails
+        instead of being registered again and again."""
+        with self.assertRaises(protocol.MessageTooLargeError):
+            asyncio.get_event_loop().run_until_complete(
+                large_function_test())
+
+    def testDecompressedTooLarge(self):
+        """Tests that message is rejected when it's too large after
+        decompression."""
+        with self.assertRaises(protocol.MessageTooLargeError):
+            asyncio.get_event_loop().run_until_complete(
+                compressed_q.q(len, bytes(MAX_MESSAGE_SIZE * 2)))
+
+    def testCancelledMessage(self):
+        """Tests that frames of cancelled message are dropped."""
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(
+                cancelled_message_test()),
+            [(1, protocol.CANCEL, b''), (1, protocol.TASK, b'xyz')])
+
+    def testFrameTooLarge(self):
+        """Tests that connection is closed when frame is too large."""
+        self.assertEqual(asyncio.get_event_loop().run_until_complete(
+            large_frame_test()), b'')
+        result = asyncio.get_event_loop().run_until_complete(
+            q.q(len, bytes(MAX_MESSAGE_SIZE // 2)))
+        self.assertEqual(result, MAX_MESSAGE_SIZE // 2)
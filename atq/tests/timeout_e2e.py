@@ -0,0 +1,91 @@
+"""End to end tests for task timeouts and cancellation."""
+import asyncio
+import operator
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from atq import Q
+from atq import executor
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 1
+TESTS_PATH = 'atq/tests'
+SLEEP_TIME = 30  # seconds
+TIMEOUT = 0.5  # seconds
+
+q = Q([
+    (HOST, PORT)
+])
+
+
+def exit_worker():
+    """Exits worker process."""
+    os._exit(1)  # pylint: disable=protected-access
+
+
+async def timeout_test():
+    """Runs task that doesn't finish in time and then another task."""
+    try:
+        await q.q(time.sleep, SLEEP_TIME, timeout=TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    else:
+        raise AssertionError('Task is not timed out')
+    return await q.q(operator.add, 1, 2)
+
+
+async def cancel_test():
+    """Cancels running and queued tasks and runs another task."""
+    running = asyncio.ensure_future(q.q(time.sleep, SLEEP_TIME))
+    queued = asyncio.ensure_future(q.q(time.sleep, SLEEP_TIME))
+    await asyncio.sleep(TIMEOUT)
+    running.cancel()
+    queued.cancel()
+    return await q.q(operator.mul, 2, 3)
+
+
+async def worker_died_test():
+    """Runs task that kills its worker."""
+    return await q.q(exit_worker)
+
+
+class TimeoutE2ETest(unittest.TestCase):
+    """e2e tests for task timeouts and cancellation."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS)], env=test_env, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testTimeout(self):
+        """Tests that timed out task stops occupying the worker."""
+        start = time.monotonic()
+        result = asyncio.get_event_loop().run_until_complete(timeout_test())
+        self.assertEqual(result, 3)
+        self.assertLess(time.monotonic() - start, SLEEP_TIME)
+
+    def testCancel(self):
+        """Tests that cancelled tasks stop occupying the worker."""
+        start = time.monotonic()
+        result = asyncio.get_event_loop().run_until_complete(cancel_test())
+        self.assertEqual(result, 6)
+        self.assertLess(time.monotonic() - start, SLEEP_TIME)
+
+    def testWorkerDied(self):
+        """Tests that worker is replaced when it exits."""
+        with self.assertRaises(executor.WorkerDiedError):
+            asyncio.get_event_loop().run_until_complete(worker_died_test())
+        result = asyncio.get_event_loop().run_until_complete(
+            q.q(operator.add, 2, 2))
+        self.assertEqual(result, 4)
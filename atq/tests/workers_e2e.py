@@ -0,0 +1,83 @@
+"""End to end tests for recycling and warm-up of worker processes."""
+import asyncio
+import collections
+import os
+import signal
+import subprocess
+import sys
+import unittest
+
+from atq import bench
+from atq import Q
+
+HOST, PORT = 'localhost', 12345
+NUM_WORKERS = 1
+TESTS_PATH = 'atq/tests'
+MAX_TASKS_PER_WORKER = 3
+MAX_WORKER_RSS = 100  # megabytes
+LEAK_SIZE = 2 * MAX_WORKER_RSS * 1024 ** 2  # bytes
+PRELOADED_MODULE = 'colorsys'
+
+q = Q([
+    (HOST, PORT)
+])
+
+# Memory leaked by the worker.
+_leaked = []
+
+
+def leak():
+    """Keeps large object in the worker and returns pid of the worker."""
+    _leaked.append(b'x' * LEAK_SIZE)
+    return os.getpid()
+
+
+def is_preloaded():
+    """Whether preloaded module is imported by the worker."""
+    return PRELOADED_MODULE in sys.modules
+
+
+async def get_pids(num_tasks):
+    """Runs tasks one by one and returns pids of their workers."""
+    return [await q.q(os.getpid) for _ in range(num_tasks)]
+
+
+class WorkersE2ETest(unittest.TestCase):
+    """e2e tests for recycling and warm-up of worker processes."""
+
+    @classmethod
+    def setUpClass(cls):
+        test_env = os.environ.copy()
+        test_env["PYTHONPATH"] = TESTS_PATH
+        cls.p = subprocess.Popen(
+            ['python3', '-m', 'atq', '-H', HOST, '-p', str(PORT),
+             '-w', str(NUM_WORKERS),
+             '--max-tasks-per-worker', str(MAX_TASKS_PER_WORKER),
+             '--max-worker-rss', str(MAX_WORKER_RSS),
+             '--preload', PRELOADED_MODULE],
+            env=test_env, stderr=subprocess.DEVNULL)
+        bench.wait_for_server(HOST, PORT, cls.p)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.kill(cls.p.pid, signal.SIGINT)
+        cls.p.communicate()
+
+    def testMaxTasksPerWorker(self):
+        """Tests that worker is replaced after max number of tasks."""
+        pids = asyncio.get_event_loop().run_until_complete(
+            get_pids(3 * MAX_TASKS_PER_WORKER))
+        counts = collections.Counter(pids)
+        self.assertGreaterEqual(len(counts), 3)
+        self.assertLessEqual(max(counts.values()), MAX_TASKS_PER_WORKER)
+
+    def testMaxWorkerRss(self):
+        """Tests that worker is replaced when it's too large."""
+        loop = asyncio.get_event_loop()
+        pid = loop.run_until_complete(q.q(leak))
+        self.assertNotEqual(loop.run_until_complete(q.q(os.getpid)), pid)
+
+    def testPreload(self):
+        """Tests that workers import preloaded modules."""
+        self.assertTrue(asyncio.get_event_loop().run_until_complete(
+            q.q(is_preloaded)))
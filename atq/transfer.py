@@ -0,0 +1,83 @@
+"""Transfer of payloads between server and worker processes.
+
+Large payloads are placed in shared memory segments and only names of the
+segments go through executor queues, so payload is copied once instead of
+being pickled again on the way to the worker and back.
+"""
+from atq import serializers
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8.
+    shared_memory = None
+
+SHARED_MEMORY_THRESHOLD = 64 * 1024  # bytes
+
+
+class SharedPayload:
+    """Payload placed in shared memory segment.
+
+    Attributes:
+        name: Name of the segment.
+        size: Size of the payload, segment may be larger.
+    """
+    def __init__(self, name, size):
+        self.name, self.size = name, size
+
+
+def share(data):
+    """Returns data as bytes or reference to its copy in shared memory."""
+    if shared_memory is None or len(data) < SHARED_MEMORY_THRESHOLD:
+        return bytes(data)
+    segment = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        segment.buf[:len(data)] = data
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    return SharedPayload(segment.name, len(data))
+
+
+def loads(payload):
+    """Deserializes payload, shared one is read in place without copying."""
+    if not isinstance(payload, SharedPayload):
+        return serializers.loads(payload)
+    segment = shared_memory.SharedMemory(name=payload.name)
+    try:
+        with segment.buf[:payload.size] as view:
+            return serializers.loads(view)
+    finally:
+        segment.close()
+
+
+def read(payload):
+    """Returns payload as bytes and frees its shared memory segment."""
+    if not isinstance(payload, SharedPayload):
+        return payload
+    segment = shared_memory.SharedMemory(name=payload.name)
+    try:
+        return bytes(segment.buf[:payload.size])
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def copy(payload):
+    """Returns payload as bytes, shared memory segment is kept."""
+    if not isinstance(payload, SharedPayload):
+        return payload
+    segment = shared_memory.SharedMemory(name=payload.name)
+    try:
+        return bytes(segment.buf[:payload.size])
+    finally:
+        segment.close()
+
+
+def discard(payload):
+    """Frees shared memory segment of the payload."""
+    if isinstance(payload, SharedPayload):
+        segment = shared_memory.SharedMemory(name=payload.name)
+        segment.close()
+        segment.unlink()
@@ -0,0 +1,166 @@
+"""Functions that run tasks in worker processes and threads of the server.
+
+Worker gets serialized function and task, so the functions are picklable by
+reference. Unpickled functions and stored objects are cached by the worker
+for the next tasks.
+"""
+import inspect
+import logging
+import pickle
+import signal
+import threading
+import time
+
+from atq import cache
+from atq import objects
+from atq import serializers
+from atq import transfer
+
+# Number of functions every worker keeps unpickled.
+FUNCTION_CACHE_SIZE = 1024
+STREAM_POLL_INTERVAL = 0.1  # seconds
+
+# Functions unpickled by the worker process.
+_functions = cache.LRUCache(FUNCTION_CACHE_SIZE)
+# Caches of the worker are shared by threads of the thread executor, task is
+# loaded under the lock, so other threads don't evict its function and
+# objects before the task is unpickled.
+_load_lock = threading.Lock()
+
+
+def _load_task(func_id, serialized_func, serialized_task, stored_objects=()):
+    """Unpickles function and task.
+
+    Function is unpickled only if it's not in the worker cache yet, as are
+    stored objects that refs of the task resolve to.
+
+    Returns:
+        Function and the task to run it with.
+    """
+    with _load_lock:
+        func = _functions.get(func_id)
+        if func is None:
+            func = pickle.loads(serialized_func)
+            _functions.put(func_id, func)
+        objects.load(stored_objects)
+        task = transfer.loads(serialized_task)
+    return func, task
+
+
+def _dumps(serializer, obj):
+    """Serializes result or stream item with serializer of its task."""
+    return b''.join(serializers.SERIALIZERS[serializer].dumps(obj))
+
+
+class TaskReport:
+    """Result of the task with its statistics, returned by the worker.
+
+    Attributes:
+        func_name: Name of the function of the task.
+        started: Time when worker started the task, as returned by
+                 time.time.
+        duration: Execution time of the task in seconds.
+        result: Pickled result or exception raised by the task, large one
+                is in shared memory.
+        failed: Whether task raised exception.
+    """
+    def __init__(self, func_name, started, duration, result, failed):
+        self.func_name = func_name
+        self.started, self.duration = started, duration
+        self.result, self.failed = result, failed
+
+
+def task_wrapper(func_id, serialized_func, serialized_task, log=True,
+                 share=True, serializer=serializers.CLOUDPICKLE,
+                 stored_objects=()):
+    """Unpickles task, runs it and serializes result.
+
+    Large task and result are passed through shared memory if share is
+    set, it's not needed when task runs in thread of the server. Result is
+    serialized with serializer of the task.
+
+    Returns:
+        TaskReport of the task.
+    """
+    func, task = _load_task(
+        func_id, serialized_func, serialized_task, stored_objects)
+    if log:
+        logging.info('Running %s', str(task))
+    started, start = time.time(), time.perf_counter()
+    try:
+        result, failed = task.run(func), False
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error('%s: %s', type(exc).__name__, str(exc))
+        result, failed = exc, True
+    duration = time.perf_counter() - start
+    result = _dumps(serializer, result)
+    return TaskReport(task.func_name, started, duration,
+                      transfer.share(result) if share else result, failed)
+
+
+async def coroutine_wrapper(func_id, serialized_func, serialized_task,
+                            log=True, serializer=serializers.CLOUDPICKLE,
+                            stored_objects=()):
+    """Unpickles task and runs it in the event loop of the server.
+
+    Result of the function is awaited if it's awaitable, so coroutine
+    functions run concurrently. Plain functions block the event loop.
+
+    Returns:
+        TaskReport of the task.
+    """
+    func, task = _load_task(
+        func_id, serialized_func, serialized_task, stored_objects)
+    if log:
+        logging.info('Running %s in event loop', str(task))
+    started, start = time.time(), time.perf_counter()
+    try:
+        result, failed = task.run(func), False
+        if inspect.isawaitable(result):
+            result = await result
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error('%s: %s', type(exc).__name__, str(exc))
+        result, failed = exc, True
+    duration = time.perf_counter() - start
+    return TaskReport(task.func_name, started, duration,
+                      _dumps(serializer, result), failed)
+
+
+def stream_wrapper(func_id, serialized_func, serialized_task, conn,
+                   log=True, serializer=serializers.CLOUDPICKLE,
+                   stored_objects=()):
+    """Unpickles task, runs it and sends every item it yields to conn.
+
+    Sending blocks while server doesn't read items, so memory stays
+    bounded. Any message from the server cancels the stream. Empty message
+    marks the end of the stream.
+    """
+    func, task = _load_task(
+        func_id, serialized_func, serialized_task, stored_objects)
+    if log:
+        logging.info('Streaming %s', str(task))
+    try:
+        for item in task.run(func):
+            if conn.poll():
+                break
+            conn.send_bytes(_dumps(serializer, item))
+    finally:
+        conn.send_bytes(b'')
+        conn.close()
+
+
+def receive_item(conn, future):
+    """Waits for next item sent by stream_wrapper, runs in the server.
+
+    Returns:
+        Serialized item or None when worker is done.
+    """
+    while not conn.poll(STREAM_POLL_INTERVAL):
+        if future.done() and not conn.poll():
+            return None
+    return conn.recv_bytes() or None
+
+
+def silence_sigint():
+    """Silences SIGINT, so only the server handles it."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -4,8 +4,8 @@ Simple web app that checks numbers for primality.
 
 To run this example run workers first:
 
-    python3 -m atq --host localhost --port 12345
-    python3 -m atq --host localhost --port 12346
+    python3 -m atq --host localhost --port 12345 --queue-weight interactive=4
+    python3 -m atq --host localhost --port 12346 --queue-weight interactive=4
 
 and then run
 
@@ -36,7 +36,7 @@ def check_prime(number):
 async def is_prime_handler(request):
     """Handles GET requests."""
     number = int(request.match_info['number'])
-    is_prime = await q.q(check_prime, number)
+    is_prime = await q.q(check_prime, number, queue='interactive')
     return web.Response(text=json.dumps({
         'number': number,
         'prime': is_prime
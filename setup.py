@@ -91,7 +91,11 @@ setup(
         'Intended Audience :: Developers',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development',
     ],
     entry_points={
@@ -103,7 +107,7 @@ setup(
         str(req.req) for req in parse_requirements('requirements.txt',
                                                    session=PipSession())
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.8',
     cmdclass={
         'lint': RunLintCommand,
         'test': RunEndToEndTestCommand,